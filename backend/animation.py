@@ -0,0 +1,98 @@
+import os
+import shutil
+import subprocess
+
+import imaging
+
+# 动图（GIF）的转码
+# 动态壁纸的GIF经常有几十MB，转为动画WebP后通常只有原来的几分之一到十几分之一，解码也更快；
+# 本机有ffmpeg时还可以转为H.264编码的MP4（体积更小，由<video>播放）。同时保存第一帧作为封面，用于缩略图。
+
+WEBP_QUALITY = 75
+# WebP编码的压缩力度（0-6），越大越慢、文件越小
+WEBP_METHOD = 4
+POSTER_QUALITY = 85
+# ffmpeg转码的质量（CRF，越小质量越高）和超时时间（秒）
+MP4_CRF = 28
+MP4_TIMEOUT = 300
+
+
+def find_ffmpeg():
+    """返回ffmpeg的路径，没有安装时返回None"""
+    return shutil.which('ffmpeg')
+
+
+def is_animated(source):
+    """判断图片是否为多帧动图，source为文件路径或文件对象"""
+    Image = imaging.image_module()
+    if Image is None:
+        return False
+    with Image.open(source) as image:
+        return getattr(image, 'is_animated', False)
+
+
+def _frame_durations(image):
+    """读取每一帧的显示时间（毫秒），GIF中缺少时间的帧按100毫秒处理"""
+    durations = []
+    for index in range(image.n_frames):
+        image.seek(index)
+        durations.append(image.info.get('duration') or 100)
+    image.seek(0)
+    return durations
+
+
+def transcode_webp(source, target_path):
+    """把动图转为动画WebP，逐帧编码，不会把所有帧同时保存在内存中"""
+    Image = imaging.image_module()
+    if Image is None:
+        return False
+    temp_path = target_path + '.tmp'
+    os.makedirs(os.path.dirname(target_path) or '.', exist_ok=True)
+    try:
+        with Image.open(source) as image:
+            image.save(
+                temp_path, 'WEBP', save_all=True, duration=_frame_durations(image), loop=image.info.get('loop', 0),
+                quality=WEBP_QUALITY, method=WEBP_METHOD
+            )
+        os.replace(temp_path, target_path)
+        return True
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def render_poster(source, target_path):
+    """把动图的第一帧保存为JPEG封面"""
+    Image = imaging.image_module()
+    if Image is None:
+        return False
+    temp_path = target_path + '.tmp'
+    os.makedirs(os.path.dirname(target_path) or '.', exist_ok=True)
+    try:
+        with Image.open(source) as image:
+            image.seek(0)
+            image.convert('RGB').save(temp_path, 'JPEG', quality=POSTER_QUALITY)
+        os.replace(temp_path, target_path)
+        return True
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def transcode_mp4(source_path, target_path, ffmpeg):
+    """用ffmpeg把动图转为MP4（H.264，宽高取偶数，moov放在文件开头以便边下边播），source_path必须是本地文件"""
+    temp_path = target_path + '.tmp.mp4'
+    os.makedirs(os.path.dirname(target_path) or '.', exist_ok=True)
+    try:
+        subprocess.run(
+            [ffmpeg, '-y', '-loglevel', 'error', '-i', source_path,
+             '-vf', 'scale=trunc(iw/2)*2:trunc(ih/2)*2', '-c:v', 'libx264', '-crf', str(MP4_CRF),
+             '-pix_fmt', 'yuv420p', '-movflags', '+faststart', '-an', temp_path],
+            check=True, stdin=subprocess.DEVNULL, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+            timeout=MP4_TIMEOUT
+        )
+        os.replace(temp_path, target_path)
+        return True
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
@@ -1,17 +1,52 @@
-from flask import Flask, render_template, request, jsonify, send_from_directory, redirect, url_for, session
+from flask import Flask, render_template, request, jsonify, send_from_directory, redirect, url_for, session, g, has_request_context
 import os
 import sqlite3
 import hashlib
 import json
-from datetime import datetime
+import time
+import logging
+import gzip
+import shutil
+import io
+import mimetypes
+import urllib.parse
+import threading
+import hmac
+import ipaddress
+import tempfile
+from datetime import datetime, timedelta, timezone
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
 import re
-import pytz
-# 添加Pillow库用于获取图片尺寸
+import base64
+import uuid
+import heapq
+import itertools
+import metrics
+import zipstream
+import palette
+import sprites
+import ratelimit
+import tagindex
+import viewcounter
+import storage
+import catalogsnapshot
+import animation
+import iohealth
+import integrity
+import imaging
+import atexit
+from profiler import StackSampler, top_stacks
+from jobs import JobQueue, RESCHEDULE
+# 可选：更快的JSON编码器
 try:
-    from PIL import Image
+    import orjson
 except ImportError:
-    # 如果没有安装Pillow，设置一个标志
-    Image = None
+    orjson = None
+# 可选：brotli压缩
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
 app = Flask(__name__, 
             static_folder='../static',
@@ -26,14 +61,572 @@ app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 # 设置数据库路径
 DATABASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'wallpaper.db')
 
+# 页面上显示的时区（UTC+8）；系统没有时区数据库时（如未安装tzdata的Windows）使用固定偏移
+try:
+    DISPLAY_TIMEZONE = ZoneInfo('Asia/Shanghai')
+except ZoneInfoNotFoundError:
+    DISPLAY_TIMEZONE = timezone(timedelta(hours=8), 'Asia/Shanghai')
+
+# 数据库结构版本（保存在PRAGMA user_version中），修改init_db中的表、索引或触发器时需要加1
+SCHEMA_VERSION = 13
+
+# 图片分辨率（像素数）和宽高比的SQL表达式，与表达式索引保持一致
+PIXEL_COUNT_EXPR = 'width * height'
+ASPECT_RATIO_EXPR = 'CAST(width AS REAL) / height'
+
+# 图片列表支持的排序字段（按顺序排列的列，与对应索引的列顺序一致）
+IMAGE_SORT_COLUMNS = {
+    'size': ('file_size', 'width', 'height'),
+    'resolution': (PIXEL_COUNT_EXPR, 'width', 'height'),
+    'upload_time': ('upload_time',),
+    'popular': ('popularity',),
+    'views': ('view_count',)
+}
+# 各排序字段对应的索引（None为默认的sort_index排序）
+IMAGE_SORT_INDEXES = {
+    None: 'idx_images_category_sort',
+    'size': 'idx_images_category_size',
+    'resolution': 'idx_images_category_pixels',
+    'upload_time': 'idx_images_category_upload_time',
+    'popular': 'idx_images_category_popularity',
+    'views': 'idx_images_category_views'
+}
+# 过滤结果超过该数量时，强制按排序索引顺序读取并逐行过滤，避免对大量结果做临时排序
+FILTERED_SORT_INDEX_THRESHOLD = 5000
+
+# 静态文件构建结果（由build_static.py生成）：带摘要的文件和预压缩版本，按优先顺序排列
+STATIC_DIST_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'static', 'dist')
+STATIC_MANIFEST = os.path.join(STATIC_DIST_FOLDER, 'manifest.json')
+PRECOMPRESSED_SUFFIXES = (('br', '.br'), ('gzip', '.gz'))
+STATIC_MAX_AGE = 365 * 24 * 3600
+static_manifest_cache = {'mtime': None, 'manifest': {}}
+
+# 启动时在后台扫描默认分类文件夹，服务器无需等待扫描完成即可处理请求
+app.config['DEFER_STARTUP_SCAN'] = True
+
+# 请求限流：按客户端（登录的用户或IP地址）对每类请求分别限流，每项为(每秒补充的请求数, 允许的突发请求数)
+# 多进程部署时可将RATE_LIMIT_STORE设为共享存储（如ratelimit.RedisStore），为None时保存在进程内存中
+app.config['RATE_LIMIT_ENABLED'] = True
+app.config['RATE_LIMITS'] = {
+    'api': (10, 40),
+    'originals': (20, 100),
+    'thumbnails': (20, 60)
+}
+app.config['RATE_LIMIT_STORE'] = None
+# 服务前面可信的反向代理（负载均衡）层数：大于0时按X-Forwarded-For识别匿名客户端的IP地址，
+# 为0时使用连接的地址（经过负载均衡时所有匿名访问者都是负载均衡的地址，会共用一个令牌桶）
+app.config['TRUSTED_PROXY_COUNT'] = 0
+# 同时发送中的原图总字节数上限，超出时返回503，避免大量大图请求占满内存和磁盘
+app.config['MAX_IN_FLIGHT_BYTES'] = 256 * 1024 * 1024
+
+# 是否统计图片浏览次数，以及把内存中的浏览次数写入数据库的间隔（秒）
+app.config['VIEW_COUNTING_ENABLED'] = True
+app.config['VIEW_FLUSH_INTERVAL'] = 10
+
+# 图片文件的存储后端：local为本地磁盘，s3为S3兼容的对象存储（AWS S3、MinIO等），连接信息从环境变量读取
+app.config['STORAGE_BACKEND'] = os.environ.get('WALLPAPER_STORAGE', 'local')
+app.config['S3_ENDPOINT'] = os.environ.get('WALLPAPER_S3_ENDPOINT', '')
+app.config['S3_BUCKET'] = os.environ.get('WALLPAPER_S3_BUCKET', '')
+app.config['S3_ACCESS_KEY'] = os.environ.get('WALLPAPER_S3_ACCESS_KEY', '')
+app.config['S3_SECRET_KEY'] = os.environ.get('WALLPAPER_S3_SECRET_KEY', '')
+app.config['S3_REGION'] = os.environ.get('WALLPAPER_S3_REGION', 'us-east-1')
+app.config['S3_PREFIX'] = os.environ.get('WALLPAPER_S3_PREFIX', '')
+app.config['S3_POOL_SIZE'] = 16
+# 使用对象存储时，原图请求重定向到预签名地址（有效期，秒），由对象存储直接发送文件；关闭后由本服务转发
+app.config['S3_PRESIGNED_REDIRECT'] = True
+app.config['S3_PRESIGN_EXPIRES'] = 3600
+# 托管目录结构：上传的文件按内容的SHA-256保存为 <分类文件夹>/ab/cd/<摘要>.<扩展名>，原文件名只保存在数据库中
+# 每个目录中的文件数保持在几百个以内，相同内容的文件只保存一份；已有文件可用migrate_layout.py在线迁移
+app.config['MANAGED_UPLOAD_LAYOUT'] = False
+MANAGED_NAME_PATTERN = re.compile(r'^([0-9a-f]{64})\.[A-Za-z0-9]+$')
+HASH_CHUNK_SIZE = 1024 * 1024
+# 原图请求按文件名或摘要查找时最多比较的记录数（相同内容或同名的文件在多个分类中时按路径选择）
+SERVE_LOOKUP_CANDIDATES = 50
+
+# catalog_changes中保留的最近变化数，落后更多的进程重新加载全部标签位图
+CATALOG_CHANGES_RETAINED = 200000
+
+# 图片列表快照：把各分类的图片列表写入二进制文件，所有工作进程通过mmap共享，没有搜索和过滤条件的分页直接从快照读取
+# 快照过期（图片有变化）时在后台重建，重建完成前查询数据库；两次重建至少间隔CATALOG_SNAPSHOT_REBUILD_INTERVAL秒
+app.config['CATALOG_SNAPSHOT_ENABLED'] = False
+app.config['CATALOG_SNAPSHOT_FOLDER'] = os.path.join(os.path.dirname(DATABASE), 'catalog')
+app.config['CATALOG_SNAPSHOT_REBUILD_INTERVAL'] = 5
+# 重建锁文件超过该时间（秒）仍未删除时，认为持有锁的进程已退出
+CATALOG_SNAPSHOT_LOCK_TIMEOUT = 600
+
+# 本地分类文件夹的I/O保护（见iohealth.py）：读取文件的操作在各分类文件夹自己的线程池中执行，最多等待IO_TIMEOUT秒；
+# 每个分类文件夹的线程池有IO_MAX_PER_ROOT个线程（同时最多这么多调用），连续失败IO_BREAKER_FAILURES次后断开IO_BREAKER_RESET秒，期间直接返回占位图片
+app.config['IO_GUARD_ENABLED'] = True
+app.config['IO_TIMEOUT'] = 10
+app.config['IO_MAX_PER_ROOT'] = 8
+app.config['IO_BREAKER_FAILURES'] = 5
+app.config['IO_BREAKER_RESET'] = 30
+# 分类文件夹列表的缓存时间（秒）
+IO_ROOTS_REFRESH_SECONDS = 10
+
+# 后台一致性检查（见integrity.py）：按id顺序分批检查图片文件是否存在、大小和修改时间是否与数据库记录一致，
+# 文件有变化时重新读取尺寸并更新记录，文件缺失或无法读取时记录到integrity_issues表；检查点保存在数据库中，重启后继续
+# INTEGRITY_FILES_PER_SECOND限制每秒检查的文件数，INTEGRITY_BYTES_PER_SECOND限制重新读取图片和计算摘要时每秒读取的字节数
+app.config['INTEGRITY_SWEEP_ENABLED'] = False
+app.config['INTEGRITY_FILES_PER_SECOND'] = 20
+app.config['INTEGRITY_BYTES_PER_SECOND'] = 4 * 1024 * 1024
+# 是否重新计算托管文件的SHA-256并与文件名中的摘要比较（需要读取整个文件）
+app.config['INTEGRITY_VERIFY_HASH'] = False
+# 完成一轮检查后，等待多少秒再开始下一轮
+app.config['INTEGRITY_PASS_INTERVAL'] = 3600
+INTEGRITY_BATCH_SIZE = 100
+# 多个工作进程中只有持有租约的进程进行检查，租约在检查过程中不断续期，进程退出后过期由其他进程接手
+INTEGRITY_LEASE_SECONDS = 120
+
+# 从对象存储读取图片尺寸时只下载文件开头的部分（图片头），不足以解析时再下载整个文件
+METADATA_HEAD_BYTES = 256 * 1024
+# 无法解析尺寸的图片记录的宽和高（与NULL区分，NULL表示还没有读取过），前端显示为未知
+UNREADABLE_DIMENSION = 0
+
+# 是否开放/metrics指标接口，以及允许访问的来源：
+# METRICS_ALLOWED_IPS中的地址或网段（经过可信代理时按X-Forwarded-For中的客户端地址判断），
+# 或者带有请求头 Authorization: Bearer <METRICS_TOKEN> 的请求（METRICS_TOKEN为空时不接受令牌）
+app.config['METRICS_ENABLED'] = True
+app.config['METRICS_ALLOWED_IPS'] = ['127.0.0.1', '::1']
+app.config['METRICS_TOKEN'] = None
+
+# 响应压缩配置（按Accept-Encoding协商gzip或brotli）
+app.config['COMPRESS_ENABLED'] = True
+app.config['COMPRESS_MIN_SIZE'] = 500
+app.config['COMPRESS_GZIP_LEVEL'] = 6
+app.config['COMPRESS_BROTLI_QUALITY'] = 5
+COMPRESSIBLE_MIMETYPES = {'application/json', 'text/html', 'text/plain'}
+
+# 请求阶段耗时与慢请求日志配置
+app.config['SERVER_TIMING_ENABLED'] = True
+app.config['SLOW_REQUEST_THRESHOLD_MS'] = 500
+app.config['SLOW_REQUEST_LOG'] = os.path.join(os.path.dirname(DATABASE), 'slow_requests.log')
+# 是否对请求进行调用栈采样（只有慢请求会写入采样结果）
+app.config['SLOW_REQUEST_PROFILER'] = False
+app.config['PROFILER_INTERVAL_MS'] = 5
+
 # 确保上传文件夹存在
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 
+# 后台任务队列（删除文件、移动文件等耗时操作）
+background_jobs = JobQueue()
+
+# 图片派生文件（缩略图、缓存变体等）的清理函数列表，签名为func(image_id, filepath)
+derived_file_cleanup_hooks = []
+
+# 分类概览拼图的缓存目录、每页最多包含的图片数，以及正在生成的拼图（文件名 -> 任务）
+SPRITE_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'sprites')
+SPRITE_MAX_PER_PAGE = 200
+sprite_jobs_lock = threading.Lock()
+pending_sprites = {}
+
+# 主色调提取：当前算法版本，以及每个后台任务最多处理的图片数（处理完后重新排队，避免长时间占用任务队列）
+PALETTE_VERSION = 1
+PALETTE_BATCH_SIZE = 100
+PALETTE_IMAGES_PER_JOB = 1000
+
+# 删除分类时每批删除的图片数，以及每批之间暂停的秒数（让上传和扫描有机会获得写锁）
+# 每执行CATEGORY_DELETE_BATCHES_PER_RUN批后任务重新排队，让队列中的其他任务先执行
+CATEGORY_DELETE_BATCH_SIZE = 500
+CATEGORY_DELETE_PAUSE = 0.05
+CATEGORY_DELETE_BATCHES_PER_RUN = 20
+
+# 批量移动图片时每批处理的图片数（每批更新一次图片记录和目标分类的排序索引）
+IMAGE_MOVE_BATCH_SIZE = 200
+
+# 扫描文件夹时每个写事务最多写入的记录数（读取图片元数据时不持有写锁）
+SCAN_WRITE_BATCH_SIZE = 200
+
+# 动图转码：上传或扫描到的GIF动图在后台转为动画WebP（本机有ffmpeg且ANIMATION_MP4_ENABLED时同时转为MP4），
+# 并保存第一帧作为封面；转码结果比原图小时才保留，页面上显示动图时使用的地址（?variant=auto）按Accept返回转码结果
+app.config['ANIMATION_VARIANTS_ENABLED'] = True
+app.config['ANIMATION_MP4_ENABLED'] = True
+ANIMATION_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'variants')
+ANIMATION_VERSION = 1
+ANIMATION_BATCH_SIZE = 5
+ANIMATION_IMAGES_PER_JOB = 50
+# 转码结果：名称 -> (文件名后缀, MIME类型)
+ANIMATION_VARIANTS = {
+    'webp': ('.webp', 'image/webp'),
+    'mp4': ('.mp4', 'video/mp4'),
+    'poster': ('-poster.jpg', 'image/jpeg')
+}
+animation_job_lock = threading.Lock()
+animation_job_active = False
+palette_job_lock = threading.Lock()
+palette_job_active = False
+
+# 时间轴按页面显示的日期分组：upload_time保存的是UTC时间，按UTC+8（没有夏令时，与DISPLAY_TIMEZONE一致）换算为日期
+TIMELINE_UTC_OFFSET_HOURS = 8
+# 各粒度的时间段键的长度（'2025'、'2025-03'、'2025-03-15'）
+TIMELINE_GRANULARITIES = {'year': 4, 'month': 7, 'day': 10}
+TIMELINE_KEY_PATTERN = re.compile(r'^\d{4}(-\d{2}(-\d{2})?)?$')
+
+# 最新图片动态：可访问的图片占全部图片的比例不低于该值时沿全局的上传时间索引读取并过滤掉无权访问的分类，
+# 否则对各可访问分类的上传时间索引做k路归并；两种方式读取的行数都与每页的数量成正比
+FEED_GLOBAL_SCAN_MIN_SHARE = 0.25
+# 每批最少和最多读取的行数
+FEED_MIN_BATCH = 8
+FEED_MAX_BATCH = 1000
+
+# 把累积的浏览次数批量写入数据库：pending为{图片ID: (浏览次数, 对数权重之和)}
+def flush_view_counts(pending):
+    conn = get_db_connection()
+    conn.create_function('logaddexp', 2, viewcounter.logaddexp, deterministic=True)
+    cursor = conn.cursor()
+    try:
+        cursor.executemany(
+            "UPDATE images SET view_count = view_count + ?, popularity = logaddexp(popularity, ?) WHERE id = ?",
+            [(count, weight, image_id) for image_id, (count, weight) in pending.items()]
+        )
+        conn.commit()
+    finally:
+        conn.close()
+
+view_counter = viewcounter.ViewCounter(flush_view_counts, interval=app.config['VIEW_FLUSH_INTERVAL'])
+
+# 进程退出时写入尚未保存的浏览次数
+@atexit.register
+def flush_view_counts_at_exit():
+    try:
+        view_counter.flush_now()
+    except Exception as e:
+        print(f"写入浏览次数失败: {e}")
+
+# 标签位图索引的当前快照，以及是否已提交后台重建任务
+tag_snapshot = None
+tag_index_lock = threading.Lock()
+tag_rebuild_pending = False
+# 当前进程映射的图片列表快照、是否已提交重建任务，以及上次重建的时间
+catalog_snapshot = None
+catalog_snapshot_lock = threading.Lock()
+catalog_snapshot_pending = False
+catalog_snapshot_built_at = 0
+# 标签名的最大长度；引号和括号用于标签查询语法，不能出现在标签名中
+MAX_TAG_LENGTH = 50
+INVALID_TAG_CHARS = set('"()')
+
+# 批量操作的ID数量上限，以及IN查询每批的参数个数（SQLite变量数量有限制）
+MAX_BULK_IDS = 10000
+# 批量获取图片详情时一次最多查询的图片数
+MAX_DETAIL_IDS = 500
+SQL_IN_CHUNK_SIZE = 500
+
+# 注册运行指标
+metrics.register_counter('wallpaper_http_requests_total', 'HTTP请求总数')
+metrics.register_histogram('wallpaper_http_request_duration_seconds', '按Flask端点统计的请求耗时')
+metrics.register_gauge('wallpaper_http_requests_in_flight', '正在处理中的HTTP请求数')
+metrics.register_histogram('wallpaper_db_query_duration_seconds', 'SQLite语句执行耗时')
+metrics.register_counter('wallpaper_db_connections_opened_total', '打开的数据库连接总数')
+metrics.register_gauge('wallpaper_db_connections_open', '当前打开的数据库连接数')
+metrics.register_counter('wallpaper_served_bytes_total', '图片文件服务发送的字节数')
+metrics.register_counter('wallpaper_scan_files_total', '文件夹扫描处理的文件数')
+metrics.register_counter('wallpaper_requests_rejected_total', '被限流或因负载过高而拒绝的请求数')
+metrics.register_histogram('wallpaper_scan_duration_seconds', '文件夹扫描耗时',
+                           buckets=(0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 10.0, 30.0, 60.0, 300.0))
+
+# 提取SQL语句类型作为指标标签
+def _sql_operation(sql):
+    parts = sql.lstrip().split(None, 1)
+    operation = parts[0].upper() if parts else ''
+    if operation in ('SELECT', 'INSERT', 'UPDATE', 'DELETE', 'CREATE', 'ALTER', 'PRAGMA'):
+        return operation
+    return 'OTHER'
+
+# 累加当前请求中某个阶段的耗时（秒）
+def add_phase_timing(name, seconds):
+    if not has_request_context():
+        return
+    timings = g.setdefault('phase_timings', {})
+    timings[name] = timings.get(name, 0.0) + seconds
+
+# 计时上下文管理器，用于统计请求内各阶段耗时（同名阶段会累加）
+class timed_phase(object):
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        add_phase_timing(self.name, time.perf_counter() - self.start)
+        return False
+
+# 记录一条SQL语句的耗时
+def _record_query(sql, elapsed):
+    metrics.observe('wallpaper_db_query_duration_seconds', elapsed, operation=_sql_operation(sql))
+    if has_request_context():
+        add_phase_timing('db', elapsed)
+        g.db_query_count = g.get('db_query_count', 0) + 1
+
+# 记录执行耗时的游标
+class MetricsCursor(sqlite3.Cursor):
+    def execute(self, sql, parameters=()):
+        start = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - start)
+
+    def executemany(self, sql, seq_of_parameters):
+        start = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            _record_query(sql, time.perf_counter() - start)
+
+# 统计连接数并默认使用MetricsCursor的连接
+class MetricsConnection(sqlite3.Connection):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._metrics_open = True
+        metrics.inc('wallpaper_db_connections_opened_total')
+        metrics.inc('wallpaper_db_connections_open')
+
+    def cursor(self, factory=MetricsCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def close(self):
+        if getattr(self, '_metrics_open', False):
+            self._metrics_open = False
+            metrics.dec('wallpaper_db_connections_open')
+        super().close()
+
+    def __del__(self):
+        # 未显式关闭的连接在回收时也要修正计数
+        if getattr(self, '_metrics_open', False):
+            self._metrics_open = False
+            metrics.dec('wallpaper_db_connections_open')
+
+# 获取数据库连接
+def get_db_connection():
+    return sqlite3.connect(DATABASE, factory=MetricsConnection)
+
+# 慢请求日志和调用栈采样器
+slow_request_logger = logging.getLogger('wallpaper.slow_requests')
+slow_request_logger.propagate = False
+stack_sampler = None
+
+# 获取慢请求日志记录器（首次使用时才创建日志文件）
+def get_slow_request_logger():
+    if not slow_request_logger.handlers:
+        handler = logging.FileHandler(app.config['SLOW_REQUEST_LOG'], encoding='utf-8')
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        slow_request_logger.addHandler(handler)
+        slow_request_logger.setLevel(logging.INFO)
+    return slow_request_logger
+
+# 获取调用栈采样器
+def get_stack_sampler():
+    global stack_sampler
+    if stack_sampler is None:
+        stack_sampler = StackSampler(interval=app.config['PROFILER_INTERVAL_MS'] / 1000.0)
+    return stack_sampler
+
+# 请求开始时记录时间
+@app.before_request
+def metrics_before_request():
+    g.request_start_time = time.perf_counter()
+    metrics.inc('wallpaper_http_requests_in_flight')
+    if app.config.get('SLOW_REQUEST_PROFILER'):
+        get_stack_sampler().start()
+        g.profiling = True
+
+# 令牌桶的默认存储和发送中字节数的限制器
+rate_limit_store = ratelimit.MemoryStore()
+in_flight_limiter = None
+
+def get_rate_limit_store():
+    return app.config.get('RATE_LIMIT_STORE') or rate_limit_store
+
+def get_in_flight_limiter():
+    global in_flight_limiter
+    if in_flight_limiter is None:
+        in_flight_limiter = ratelimit.InFlightLimiter(app.config['MAX_IN_FLIGHT_BYTES'])
+    return in_flight_limiter
+
+# 请求所属的限流类别：原图、缩略图拼图或API，其他请求（页面、静态文件）不限流
+def get_rate_limit_budget():
+    if request.endpoint == 'serve_uploads':
+        return 'originals'
+    if request.endpoint == 'serve_sprite':
+        return 'thumbnails'
+    if request.path.startswith('/api/'):
+        return 'api'
+    return None
+
+# 限流使用的客户端标识：登录后按账户，否则按IP地址（经过可信代理时取X-Forwarded-For中的客户端地址）
+def get_client_key():
+    if session.get('admin_logged_in'):
+        return 'admin:' + session.get('admin_username', '')
+    if session.get('user_logged_in'):
+        return 'user:' + session.get('user_username', '')
+    address = ratelimit.client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'),
+                                  app.config['TRUSTED_PROXY_COUNT'])
+    return 'ip:' + (address or '')
+
+# 拒绝请求：限流时返回429，负载过高时返回503，都带有Retry-After头
+def reject_response(status, message, retry_after, budget, reason):
+    metrics.inc('wallpaper_requests_rejected_total', budget=budget, reason=reason)
+    if budget == 'api':
+        response = jsonify({'success': False, 'message': message})
+    else:
+        response = app.response_class(response=message, mimetype='text/plain')
+    response.status_code = status
+    response.headers['Retry-After'] = ratelimit.retry_after_header(retry_after)
+    return response
+
+# 按客户端和请求类别限流
+@app.before_request
+def rate_limit_before_request():
+    if not app.config.get('RATE_LIMIT_ENABLED'):
+        return None
+    budget = get_rate_limit_budget()
+    if budget is None:
+        return None
+    rate, burst = app.config['RATE_LIMITS'][budget]
+    allowed, wait = get_rate_limit_store().take(f"{budget}:{get_client_key()}", rate, burst)
+    if allowed:
+        return None
+    return reject_response(429, '请求过于频繁，请稍后再试', wait, budget, 'rate_limit')
+
+# 添加Server-Timing响应头
+@app.after_request
+def timing_after_request(response):
+    start = g.get('request_start_time')
+    if start is None or not app.config.get('SERVER_TIMING_ENABLED'):
+        return response
+    total_ms = (time.perf_counter() - start) * 1000
+    entries = ['%s;dur=%.2f' % (name, seconds * 1000) for name, seconds in g.get('phase_timings', {}).items()]
+    entries.append('total;dur=%.2f' % total_ms)
+    response.headers['Server-Timing'] = ', '.join(entries)
+    return response
+
+# 请求结束时停止调用栈采样并记录慢请求（视图或其他钩子抛出异常时同样会执行）
+@app.teardown_request
+def timing_teardown_request(exc):
+    samples = None
+    if g.pop('profiling', False):
+        samples = get_stack_sampler().stop()
+    start = g.get('request_start_time')
+    if start is None:
+        return
+    total_ms = (time.perf_counter() - start) * 1000
+    phases = g.get('phase_timings', {})
+    
+    threshold = app.config.get('SLOW_REQUEST_THRESHOLD_MS')
+    if threshold is not None and total_ms >= threshold:
+        try:
+            record = {
+                'time': datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S'),
+                'method': request.method,
+                'path': request.path,
+                'endpoint': request.endpoint,
+                'args': request.args.to_dict(flat=False),
+                'view_args': request.view_args,
+                'status': g.get('response_status', 500 if exc is not None else 200),
+                'duration_ms': round(total_ms, 2),
+                'phases_ms': {name: round(seconds * 1000, 2) for name, seconds in phases.items()},
+                'db_queries': g.get('db_query_count', 0)
+            }
+            if samples is not None:
+                record['samples'] = top_stacks(samples)
+            get_slow_request_logger().info(json.dumps(record, ensure_ascii=False, default=str))
+        except Exception as e:
+            print(f"写入慢请求日志失败: {e}")
+
+# 根据Accept-Encoding选择压缩算法，优先brotli
+def choose_content_encoding():
+    accept = request.accept_encodings
+    if brotli is not None and accept['br']:
+        return 'br'
+    if accept['gzip']:
+        return 'gzip'
+    return None
+
+# 压缩JSON和文本响应（注册在计时钩子之后，因此压缩耗时会计入Server-Timing）
+@app.after_request
+def compress_response(response):
+    if not app.config.get('COMPRESS_ENABLED'):
+        return response
+    if response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    if response.direct_passthrough or response.is_streamed or 'Content-Encoding' in response.headers:
+        return response
+    if response.status_code < 200 or response.status_code >= 300:
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    encoding = choose_content_encoding()
+    if encoding is None:
+        return response
+    data = response.get_data()
+    if len(data) < app.config['COMPRESS_MIN_SIZE']:
+        return response
+    
+    with timed_phase('compress'):
+        if encoding == 'br':
+            compressed = brotli.compress(data, quality=app.config['COMPRESS_BROTLI_QUALITY'])
+        else:
+            compressed = gzip.compress(data, compresslevel=app.config['COMPRESS_GZIP_LEVEL'])
+    response.set_data(compressed)
+    response.headers['Content-Encoding'] = encoding
+    # 压缩后的内容与原内容字节不同，强ETag改为弱ETag
+    etag, weak = response.get_etag()
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+# 使用更快的JSON编码器生成响应（安装了orjson时使用orjson）
+def json_response(data, status=200):
+    if orjson is not None:
+        body = orjson.dumps(data, option=orjson.OPT_NON_STR_KEYS)
+    else:
+        body = json.dumps(data, ensure_ascii=False, separators=(',', ':'))
+    return app.response_class(response=body, status=status, mimetype='application/json')
+
+# 紧凑格式中图片列表返回的字段
+COMPACT_IMAGE_COLUMNS = ('id', 'filename', 'filepath', 'upload_time', 'width', 'height', 'size')
+
+# 将字典列表转换为列式结构：{字段名: [值, ...]}，renames用于修改输出的字段名
+def to_columns(rows, columns, renames=None):
+    renames = renames or {}
+    return {renames.get(column, column): [row.get(column) for row in rows] for column in columns}
+
+# 记录响应状态码
+@app.after_request
+def metrics_after_request(response):
+    g.response_status = response.status_code
+    return response
+
+# 请求结束时统计请求数和耗时（异常时同样会执行）
+@app.teardown_request
+def metrics_teardown_request(exc):
+    start = g.get('request_start_time')
+    if start is None:
+        return
+    elapsed = time.perf_counter() - start
+    endpoint = request.endpoint or 'unmatched'
+    status = g.get('response_status', 500 if exc is not None else 200)
+    metrics.dec('wallpaper_http_requests_in_flight')
+    metrics.inc('wallpaper_http_requests_total', endpoint=endpoint, method=request.method, status=str(status))
+    metrics.observe('wallpaper_http_request_duration_seconds', elapsed, endpoint=endpoint)
+
 # 初始化数据库
 def init_db():
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
+    # 数据库结构已是当前版本时跳过建表和各项检查，加快启动
+    cursor.execute("PRAGMA user_version")
+    if cursor.fetchone()[0] == SCHEMA_VERSION:
+        conn.close()
+        return
+    
     # 创建分类表
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS categories (
@@ -43,6 +636,32 @@ def init_db():
         )
     ''')
     
+    # 正在后台删除的分类：分类记录已删除（分类ID自增，不会被新分类重复使用），图片记录由后台任务分批删除，
+    # 应用重启后继续删除
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS category_deletions (
+            category_id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            folder_path TEXT NOT NULL,
+            image_count INTEGER NOT NULL DEFAULT 0,
+            deleted_count INTEGER NOT NULL DEFAULT 0,
+            requested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    
+    # 正在后台移动文件的图片：文件复制到目标位置后才更新图片记录，删除原文件后才删除这里的记录；
+    # 扫描文件夹时跳过其中的原路径和目标路径，应用重启后继续移动
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_moves (
+            image_id INTEGER PRIMARY KEY,
+            category_id INTEGER NOT NULL,
+            filename TEXT NOT NULL,
+            source_path TEXT NOT NULL,
+            target_path TEXT NOT NULL,
+            copied INTEGER NOT NULL DEFAULT 0
+        )
+    ''')
+    
     # 创建用户表
     cursor.execute('''
         CREATE TABLE IF NOT EXISTS users (
@@ -64,6 +683,8 @@ def init_db():
             UNIQUE (user_id, category_id)
         )
     ''')
+    # 删除分类时按分类删除权限记录
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_category_permissions_category ON user_category_permissions (category_id)")
     
     # 创建图片信息表
     cursor.execute('''
@@ -74,10 +695,207 @@ def init_db():
             category_id INTEGER,
             upload_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
             sort_index INTEGER,
+            file_size INTEGER,
+            width INTEGER,
+            height INTEGER,
+            view_count INTEGER NOT NULL DEFAULT 0,
+            popularity REAL,
             FOREIGN KEY (category_id) REFERENCES categories (id)
         )
     ''')
     
+    # 旧数据库补充新增的列
+    ensure_column(cursor, 'images', 'file_size', 'INTEGER')
+    ensure_column(cursor, 'images', 'width', 'INTEGER')
+    ensure_column(cursor, 'images', 'height', 'INTEGER')
+    # 主色调索引的版本，NULL表示尚未提取
+    ensure_column(cursor, 'images', 'palette_version', 'INTEGER')
+    # 动图转码的版本，NULL表示尚未处理（只处理GIF）
+    ensure_column(cursor, 'images', 'animation_version', 'INTEGER')
+    # 浏览次数和按时间衰减的热度分数（见viewcounter.py），NULL表示没有浏览记录
+    ensure_column(cursor, 'images', 'view_count', 'INTEGER NOT NULL DEFAULT 0')
+    ensure_column(cursor, 'images', 'popularity', 'REAL')
+    # 托管目录结构中文件内容的SHA-256，NULL表示文件按原文件名保存
+    ensure_column(cursor, 'images', 'content_hash', 'TEXT')
+    # 一致性检查时记录的文件修改时间（Unix时间戳），NULL表示尚未检查
+    ensure_column(cursor, 'images', 'file_mtime', 'REAL')
+    
+    # 列表查询的复合索引：按分类过滤后按各排序键有序读取
+    # 排序索引中带上width和height，分辨率/宽高比过滤条件可以直接在索引项上判断，不需要回表
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_category_sort ON images (category_id, sort_index, width, height)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_category_upload_time ON images (category_id, upload_time)")
+    # 跨分类的最新图片动态按上传时间读取
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_upload_time ON images (upload_time)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_category_size ON images (category_id, file_size, width, height)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_category_popularity ON images (category_id, popularity)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_category_views ON images (category_id, view_count)")
+    # 表达式索引，查询中必须使用完全相同的表达式（PIXEL_COUNT_EXPR / ASPECT_RATIO_EXPR）
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_images_category_pixels ON images (category_id, {PIXEL_COUNT_EXPR}, width, height)")
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS idx_images_category_aspect ON images (category_id, {ASPECT_RATIO_EXPR})")
+    # 分辨率过滤和计数使用的覆盖索引
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_category_dimensions ON images (category_id, width, height)")
+    # 分类内按id分批遍历（索引隐含rowid，可支持category_id = ? AND id > ? ORDER BY id）
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_category ON images (category_id)")
+    # 原图请求按文件名查找图片
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_filename ON images (filename)")
+    # 按内容摘要查找托管目录中的文件（部分索引，只包含托管的图片）
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_content_hash ON images (content_hash, filepath) WHERE content_hash IS NOT NULL")
+    
+    # 创建分类统计表（由触发器增量维护）
+    create_category_stats(cursor)
+    # 创建按日期统计的图片数表（时间轴，由触发器增量维护）
+    create_timeline_buckets(cursor)
+    
+    # 创建图片主色调表：每张图片若干个LAB颜色，按颜色桶组织以便按颜色搜索
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_colors (
+            bucket INTEGER NOT NULL,
+            image_id INTEGER NOT NULL,
+            slot INTEGER NOT NULL,
+            l REAL NOT NULL,
+            a REAL NOT NULL,
+            b REAL NOT NULL,
+            weight REAL NOT NULL,
+            PRIMARY KEY (bucket, image_id, slot)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_image_colors_image ON image_colors (image_id)")
+    # 待提取主色调的图片（部分索引，只包含palette_version为NULL的行）
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_images_palette_pending ON images (id) WHERE palette_version IS NULL")
+    # 待转码的GIF（部分索引，LIKE不区分大小写）
+    cursor.execute(
+        "CREATE INDEX IF NOT EXISTS idx_images_animation_pending ON images (id) "
+        "WHERE animation_version IS NULL AND filepath LIKE '%.gif'"
+    )
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_images_delete_colors AFTER DELETE ON images
+        BEGIN
+            DELETE FROM image_colors WHERE image_id = OLD.id;
+        END
+    ''')
+    
+    # 创建标签表和图片标签表（一张图片可以有多个标签）
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS tags (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            name TEXT NOT NULL UNIQUE COLLATE NOCASE
+        )
+    ''')
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_tags (
+            tag_id INTEGER NOT NULL,
+            image_id INTEGER NOT NULL,
+            PRIMARY KEY (tag_id, image_id),
+            FOREIGN KEY (tag_id) REFERENCES tags (id),
+            FOREIGN KEY (image_id) REFERENCES images (id)
+        ) WITHOUT ROWID
+    ''')
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_image_tags_image ON image_tags (image_id)")
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_images_delete_tags AFTER DELETE ON images
+        BEGIN
+            DELETE FROM image_tags WHERE image_id = OLD.id;
+        END
+    ''')
+    
+    # 图片目录的版本号：图片增删、移动分类或标签变化时由触发器加1，内存中的标签位图据此判断是否需要更新
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO catalog_version (id, version) VALUES (1, 0)")
+    # 每次加1时记录变化的内容（以加1后的版本号为主键），标签位图只需应用快照之后的变化；旧记录由重建任务清理
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS catalog_changes (
+            version INTEGER PRIMARY KEY,
+            image_id INTEGER NOT NULL,
+            tag_id INTEGER,
+            tag_added INTEGER,
+            old_category_id INTEGER,
+            new_category_id INTEGER
+        )
+    ''')
+    for trigger_name, event, columns, values in (
+        ('trg_images_insert_version', 'AFTER INSERT ON images',
+         'image_id, new_category_id', 'NEW.id, NEW.category_id'),
+        ('trg_images_delete_version', 'AFTER DELETE ON images',
+         'image_id, old_category_id', 'OLD.id, OLD.category_id'),
+        ('trg_images_move_version', 'AFTER UPDATE OF category_id ON images WHEN OLD.category_id IS NOT NEW.category_id',
+         'image_id, old_category_id, new_category_id', 'NEW.id, OLD.category_id, NEW.category_id'),
+        ('trg_image_tags_insert_version', 'AFTER INSERT ON image_tags',
+         'image_id, tag_id, tag_added', 'NEW.image_id, NEW.tag_id, 1'),
+        ('trg_image_tags_delete_version', 'AFTER DELETE ON image_tags',
+         'image_id, tag_id, tag_added', 'OLD.image_id, OLD.tag_id, 0')
+    ):
+        # 旧版本的触发器只增加版本号，重新创建
+        cursor.execute(f"DROP TRIGGER IF EXISTS {trigger_name}")
+        cursor.execute(f'''
+            CREATE TRIGGER {trigger_name} {event}
+            BEGIN
+                UPDATE catalog_version SET version = version + 1 WHERE id = 1;
+                INSERT INTO catalog_changes (version, {columns}) SELECT version, {values} FROM catalog_version WHERE id = 1;
+            END
+        ''')
+    
+    # 图片列表的版本号：列表中显示或用于排序的列有变化时由触发器加1，图片列表快照据此判断是否过期
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS listing_version (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            version INTEGER NOT NULL
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO listing_version (id, version) VALUES (1, 0)")
+    for trigger_name, event in (
+        ('trg_images_insert_listing', 'AFTER INSERT ON images'),
+        ('trg_images_delete_listing', 'AFTER DELETE ON images'),
+        ('trg_images_update_listing',
+         'AFTER UPDATE OF category_id, filename, filepath, upload_time, sort_index, file_size, width, height ON images')
+    ):
+        cursor.execute(f'''
+            CREATE TRIGGER IF NOT EXISTS {trigger_name} {event}
+            BEGIN
+                UPDATE listing_version SET version = version + 1 WHERE id = 1;
+            END
+        ''')
+    
+    # 一致性检查的检查点（只有一行）：本轮检查到的图片ID和计数、下一轮的开始时间，以及正在检查的进程的租约
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS integrity_checkpoint (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            last_id INTEGER NOT NULL DEFAULT 0,
+            checked INTEGER NOT NULL DEFAULT 0,
+            repaired INTEGER NOT NULL DEFAULT 0,
+            flagged INTEGER NOT NULL DEFAULT 0,
+            passes INTEGER NOT NULL DEFAULT 0,
+            pass_started_at TIMESTAMP,
+            pass_finished_at TIMESTAMP,
+            next_pass_at REAL NOT NULL DEFAULT 0,
+            owner TEXT,
+            lease_until REAL NOT NULL DEFAULT 0
+        )
+    ''')
+    cursor.execute("INSERT OR IGNORE INTO integrity_checkpoint (id) VALUES (1)")
+    # 一致性检查发现的问题：missing（文件不存在）、unreadable（无法读取）、unavailable（所属文件夹不可用）、hash_mismatch（内容与摘要不符），再次检查正常时删除
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS integrity_issues (
+            image_id INTEGER PRIMARY KEY,
+            issue TEXT NOT NULL,
+            detail TEXT,
+            detected_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    ''')
+    # 管理面板按发现时间列出问题、按类型计数
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_integrity_issues_detected ON integrity_issues (detected_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_integrity_issues_issue ON integrity_issues (issue)")
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_images_delete_integrity AFTER DELETE ON images
+        BEGIN
+            DELETE FROM integrity_issues WHERE image_id = OLD.id;
+        END
+    ''')
+    
     # 创建管理员账户（默认用户名：admin，密码：admin）
     cursor.execute("SELECT * FROM users WHERE username = 'admin'")
     if not cursor.fetchone():
@@ -91,9 +909,334 @@ def init_db():
         os.makedirs(default_folder, exist_ok=True)
         cursor.execute("INSERT INTO categories (name, folder_path) VALUES (?, ?)", ('默认分类', default_folder))
     
+    # 记录数据库结构版本，下次启动时不再重复检查
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
     conn.commit()
     conn.close()
 
+# 如果表中缺少某列则添加
+def ensure_column(cursor, table, column, definition):
+    cursor.execute(f"PRAGMA table_info({table})")
+    columns = [row[1] for row in cursor.fetchall()]
+    if column not in columns:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+        return True
+    return False
+
+# 创建分类统计表和维护它的触发器
+# 封面图为该分类最新上传的图片（上传时间相同时取ID最大的）
+def create_category_stats(cursor):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='category_stats'")
+    is_new = cursor.fetchone() is None
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS category_stats (
+            category_id INTEGER PRIMARY KEY,
+            image_count INTEGER NOT NULL DEFAULT 0,
+            total_bytes INTEGER NOT NULL DEFAULT 0,
+            newest_upload TIMESTAMP,
+            cover_image_id INTEGER,
+            FOREIGN KEY (category_id) REFERENCES categories (id)
+        )
+    ''')
+    
+    # 新增分类时创建统计行，删除分类时删除统计行
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_categories_insert_stats AFTER INSERT ON categories
+        BEGIN
+            INSERT OR IGNORE INTO category_stats (category_id) VALUES (NEW.id);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_categories_delete_stats AFTER DELETE ON categories
+        BEGIN
+            DELETE FROM category_stats WHERE category_id = OLD.id;
+        END
+    ''')
+    
+    # 新增图片：数量和大小累加，更新的图片成为封面
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_images_insert_stats AFTER INSERT ON images
+        BEGIN
+            INSERT OR IGNORE INTO category_stats (category_id) VALUES (NEW.category_id);
+            UPDATE category_stats SET
+                image_count = image_count + 1,
+                total_bytes = total_bytes + COALESCE(NEW.file_size, 0),
+                cover_image_id = CASE WHEN newest_upload IS NULL OR NEW.upload_time >= newest_upload
+                                      THEN NEW.id ELSE cover_image_id END,
+                newest_upload = CASE WHEN newest_upload IS NULL OR NEW.upload_time >= newest_upload
+                                     THEN NEW.upload_time ELSE newest_upload END
+            WHERE category_id = NEW.category_id;
+        END
+    ''')
+    
+    # 删除图片：数量和大小扣减，删除的是封面时通过索引重新查找最新图片
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_images_delete_stats AFTER DELETE ON images
+        BEGIN
+            UPDATE category_stats SET
+                image_count = image_count - 1,
+                total_bytes = total_bytes - COALESCE(OLD.file_size, 0)
+            WHERE category_id = OLD.category_id;
+            UPDATE category_stats SET
+                cover_image_id = (SELECT id FROM images WHERE category_id = OLD.category_id
+                                  ORDER BY upload_time DESC, id DESC LIMIT 1),
+                newest_upload = (SELECT upload_time FROM images WHERE category_id = OLD.category_id
+                                 ORDER BY upload_time DESC, id DESC LIMIT 1)
+            WHERE category_id = OLD.category_id AND cover_image_id = OLD.id;
+        END
+    ''')
+    
+    # 修改图片的分类、大小或上传时间：相当于从旧分类删除再加入新分类
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_images_update_stats
+        AFTER UPDATE OF category_id, file_size, upload_time ON images
+        BEGIN
+            UPDATE category_stats SET
+                image_count = image_count - 1,
+                total_bytes = total_bytes - COALESCE(OLD.file_size, 0)
+            WHERE category_id = OLD.category_id;
+            UPDATE category_stats SET
+                cover_image_id = (SELECT id FROM images WHERE category_id = OLD.category_id
+                                  ORDER BY upload_time DESC, id DESC LIMIT 1),
+                newest_upload = (SELECT upload_time FROM images WHERE category_id = OLD.category_id
+                                 ORDER BY upload_time DESC, id DESC LIMIT 1)
+            WHERE category_id = OLD.category_id AND cover_image_id = OLD.id;
+            INSERT OR IGNORE INTO category_stats (category_id) VALUES (NEW.category_id);
+            UPDATE category_stats SET
+                image_count = image_count + 1,
+                total_bytes = total_bytes + COALESCE(NEW.file_size, 0),
+                cover_image_id = CASE WHEN newest_upload IS NULL OR NEW.upload_time >= newest_upload
+                                      THEN NEW.id ELSE cover_image_id END,
+                newest_upload = CASE WHEN newest_upload IS NULL OR NEW.upload_time >= newest_upload
+                                     THEN NEW.upload_time ELSE newest_upload END
+            WHERE category_id = NEW.category_id;
+        END
+    ''')
+    
+    # 首次创建时根据现有数据初始化
+    if is_new:
+        rebuild_category_stats(cursor)
+
+# 创建每个分类每天的图片数表和维护它的触发器
+# 时间轴的年、月统计由该表汇总（每个分类每天最多一行），不需要对images表做GROUP BY
+def create_timeline_buckets(cursor):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='image_date_buckets'")
+    is_new = cursor.fetchone() is None
+    
+    cursor.execute('''
+        CREATE TABLE IF NOT EXISTS image_date_buckets (
+            category_id INTEGER NOT NULL,
+            day TEXT NOT NULL,
+            image_count INTEGER NOT NULL,
+            PRIMARY KEY (category_id, day)
+        ) WITHOUT ROWID
+    ''')
+    
+    day_expr = f"date({{0}}.upload_time, '+{TIMELINE_UTC_OFFSET_HOURS} hours')"
+    increment = f'''
+            INSERT INTO image_date_buckets (category_id, day, image_count)
+            SELECT NEW.category_id, {day_expr.format('NEW')}, 1
+            WHERE NEW.category_id IS NOT NULL AND NEW.upload_time IS NOT NULL
+            ON CONFLICT (category_id, day) DO UPDATE SET image_count = image_count + 1;
+    '''
+    # 计数减到0的行直接删除，表中只保存有图片的日期
+    decrement = f'''
+            UPDATE image_date_buckets SET image_count = image_count - 1
+            WHERE category_id = OLD.category_id AND day = {day_expr.format('OLD')};
+            DELETE FROM image_date_buckets
+            WHERE category_id = OLD.category_id AND day = {day_expr.format('OLD')} AND image_count <= 0;
+    '''
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_images_insert_timeline AFTER INSERT ON images BEGIN {increment} END")
+    cursor.execute(f"CREATE TRIGGER IF NOT EXISTS trg_images_delete_timeline AFTER DELETE ON images BEGIN {decrement} END")
+    cursor.execute(f'''
+        CREATE TRIGGER IF NOT EXISTS trg_images_update_timeline AFTER UPDATE OF category_id, upload_time ON images
+        WHEN OLD.category_id IS NOT NEW.category_id OR OLD.upload_time IS NOT NEW.upload_time
+        BEGIN {decrement} {increment} END
+    ''')
+    
+    # 首次创建时根据现有数据初始化
+    if is_new:
+        cursor.execute(f'''
+            INSERT INTO image_date_buckets (category_id, day, image_count)
+            SELECT category_id, {day_expr.format('images')}, COUNT(*) FROM images
+            WHERE category_id IS NOT NULL AND upload_time IS NOT NULL
+            GROUP BY 1, 2
+        ''')
+
+# 根据images表重新计算所有分类的统计信息
+def rebuild_category_stats(cursor):
+    cursor.execute("DELETE FROM category_stats")
+    cursor.execute('''
+        INSERT INTO category_stats (category_id, image_count, total_bytes, newest_upload, cover_image_id)
+        SELECT c.id,
+               (SELECT COUNT(*) FROM images WHERE category_id = c.id),
+               (SELECT COALESCE(SUM(file_size), 0) FROM images WHERE category_id = c.id),
+               (SELECT upload_time FROM images WHERE category_id = c.id ORDER BY upload_time DESC, id DESC LIMIT 1),
+               (SELECT id FROM images WHERE category_id = c.id ORDER BY upload_time DESC, id DESC LIMIT 1)
+        FROM categories c
+    ''')
+
+# 当前使用的存储后端，首次使用时根据配置创建
+storage_backend = None
+# 本地文件访问的I/O保护，以及缓存的分类文件夹列表
+io_guard = None
+io_roots = []
+io_roots_expires = 0
+
+def get_storage():
+    global storage_backend
+    if storage_backend is None:
+        if app.config['STORAGE_BACKEND'] == 's3':
+            storage_backend = storage.S3Storage(
+                app.config['S3_ENDPOINT'], app.config['S3_BUCKET'],
+                app.config['S3_ACCESS_KEY'], app.config['S3_SECRET_KEY'],
+                region=app.config['S3_REGION'], prefix=app.config['S3_PREFIX'],
+                pool_size=app.config['S3_POOL_SIZE']
+            )
+        elif app.config['IO_GUARD_ENABLED']:
+            storage_backend = iohealth.GuardedStorage(storage.LocalStorage(), get_io_guard(), get_io_root)
+        else:
+            storage_backend = storage.LocalStorage()
+    return storage_backend
+
+# 本地文件访问的I/O保护，首次使用时创建
+def get_io_guard():
+    global io_guard
+    if io_guard is None:
+        io_guard = iohealth.IOGuard(
+            max_per_root=app.config['IO_MAX_PER_ROOT'],
+            timeout=app.config['IO_TIMEOUT'], failure_threshold=app.config['IO_BREAKER_FAILURES'],
+            reset_seconds=app.config['IO_BREAKER_RESET']
+        )
+    return io_guard
+
+# 返回文件所属的分类文件夹（绝对路径），不在任何分类文件夹中时返回文件所在的目录
+def get_io_root(path):
+    global io_roots, io_roots_expires
+    now = time.monotonic()
+    if now >= io_roots_expires:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT folder_path FROM categories")
+        # 较长的路径在前，嵌套的分类文件夹匹配到最内层
+        io_roots = sorted({os.path.abspath(row[0]) for row in cursor.fetchall()}, key=len, reverse=True)
+        conn.close()
+        io_roots_expires = now + IO_ROOTS_REFRESH_SECONDS
+    abs_path = os.path.abspath(path)
+    for root in io_roots:
+        if abs_path == root or abs_path.startswith(root.rstrip(os.sep) + os.sep):
+            return root
+    return os.path.dirname(abs_path)
+
+# 在文件所属分类文件夹的I/O保护下执行func(*args)，没有启用I/O保护时直接执行
+def guarded_io(path, func, *args):
+    store = get_storage()
+    if isinstance(store, iohealth.GuardedStorage):
+        return store.call(path, func, *args)
+    return func(*args)
+
+# 读取图片的(宽, 高)，source为文件路径或文件对象
+def read_image_size(source):
+    with imaging.image_module().open(source) as img_obj:
+        return img_obj.size
+
+# 获取文件大小，文件不存在时返回None
+def get_file_size(file_path):
+    try:
+        return get_storage().stat(file_path)[0]
+    except OSError:
+        return None
+
+# 读取图片的(宽, 高)，无法读取时返回(None, None)；所属文件夹不可用（FolderUnavailable、TimeoutError）时抛出异常
+def read_image_dimensions(file_path, file_size):
+    store = get_storage()
+    try:
+        if store.remote:
+            # 对象存储中的图片先只读取图片头
+            try:
+                return read_image_size(io.BytesIO(store.read_range(file_path, 0, METADATA_HEAD_BYTES)))
+            except Exception:
+                if file_size <= METADATA_HEAD_BYTES:
+                    raise
+                return read_image_size(store.image_source(file_path))
+        # 本地文件在所属分类文件夹的I/O保护下读取，挂载点无响应时不会一直阻塞
+        return guarded_io(file_path, read_image_size, file_path)
+    except (iohealth.FolderUnavailable, TimeoutError):
+        raise
+    except Exception as e:
+        print(f"获取图片尺寸失败: {e}")
+        return None, None
+
+# 读取图片的文件大小和尺寸，返回(file_size, width, height)，无法读取的项为None
+# 文件存在但无法解析尺寸（文件损坏或格式不支持）时尺寸记为UNREADABLE_DIMENSION，之后的列表和扫描不再反复读取；
+# 文件夹暂时不可用或没有安装Pillow时仍为None，下次再读取
+def read_image_metadata(file_path):
+    file_size = get_file_size(file_path)
+    width = None
+    height = None
+    if imaging.image_module() and file_size is not None:
+        try:
+            width, height = read_image_dimensions(file_path, file_size)
+            if width is None:
+                width = height = UNREADABLE_DIMENSION
+        except OSError as e:
+            print(f"获取图片尺寸失败: {e}")
+    return file_size, width, height
+
+# 托管目录结构中的文件路径：按摘要的前两级各两个字符分目录
+def get_managed_path(folder_path, content_hash, ext):
+    return os.path.join(folder_path, content_hash[:2], content_hash[2:4], f"{content_hash}{ext.lower()}")
+
+# 托管文件的内容摘要，不是托管文件时返回None
+def get_managed_hash(file_path):
+    match = MANAGED_NAME_PATTERN.match(os.path.basename(file_path))
+    return match.group(1) if match else None
+
+# 计算文件流的SHA-256，完成后回到开头（上传的文件流可以seek）
+def hash_stream(stream):
+    digest = hashlib.sha256()
+    for data in iter(lambda: stream.read(HASH_CHUNK_SIZE), b''):
+        digest.update(data)
+    stream.seek(0)
+    return digest.hexdigest()
+
+# 按托管目录结构保存上传的文件，返回(文件路径, 内容摘要)；相同内容的文件已存在时不再重复保存
+def save_managed_upload(file, folder_path):
+    content_hash = hash_stream(file.stream)
+    file_path = get_managed_path(folder_path, content_hash, os.path.splitext(file.filename)[1])
+    if not get_storage().exists(file_path):
+        get_storage().save(file_path, file.stream)
+    return file_path, content_hash
+
+# 数据库中是否还有记录引用该文件（托管目录中相同内容的图片共用一个文件，删除或移走前需要检查）
+def is_file_referenced(file_path):
+    content_hash = get_managed_hash(file_path)
+    if not content_hash:
+        return False
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1 FROM images WHERE content_hash = ? AND filepath = ? LIMIT 1", (content_hash, file_path))
+        return cursor.fetchone() is not None
+    finally:
+        conn.close()
+
+# 计算图片文件相对于uploads目录的路径，用于生成/uploads/...地址
+def get_upload_rel_path(file_path, uploads_abs_path=None):
+    if uploads_abs_path is None:
+        uploads_abs_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
+    abs_file_path = os.path.abspath(file_path)
+    # 检查文件是否在uploads目录内
+    if os.path.commonpath([uploads_abs_path]) == os.path.commonpath([uploads_abs_path, abs_file_path]):
+        # 对于uploads目录内的文件，计算相对路径
+        rel_path = os.path.relpath(abs_file_path, uploads_abs_path)
+    else:
+        # 对于不在uploads目录内的文件，直接使用文件名
+        rel_path = os.path.basename(file_path)
+    # 将Windows路径分隔符替换为URL路径分隔符
+    return rel_path.replace('\\', '/')
+
 # 检查文件类型是否允许
 def allowed_file(filename):
     return '.' in filename and \
@@ -115,9 +1258,19 @@ def get_current_username():
         return session['user_username']
     return None
 
-# 获取用户可访问的分类
-def get_user_accessible_categories(user_id=None):
-    conn = sqlite3.connect(DATABASE)
+# 分类统计信息的查询列，返回(id, name, 图片数量, 总字节数, 最新上传时间, 封面图片ID, 封面图片路径)
+CATEGORY_STATS_COLUMNS = '''
+    c.id, c.name, COALESCE(s.image_count, 0), COALESCE(s.total_bytes, 0),
+    s.newest_upload, s.cover_image_id, cover.filepath
+'''
+CATEGORY_STATS_JOINS = '''
+    LEFT JOIN category_stats s ON s.category_id = c.id
+    LEFT JOIN images cover ON cover.id = s.cover_image_id
+'''
+
+# 获取用户可访问的分类，with_stats为True时附带统计信息和封面
+def get_user_accessible_categories(user_id=None, with_stats=False):
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     # 如果没有提供用户ID，获取当前登录用户ID
@@ -129,25 +1282,28 @@ def get_user_accessible_categories(user_id=None):
     
     # 默认分类始终对所有用户开放
     categories = []
+    columns = CATEGORY_STATS_COLUMNS if with_stats else 'c.id, c.name'
+    joins = CATEGORY_STATS_JOINS if with_stats else ''
     
     # 如果是管理员或没有登录的用户，只显示默认分类
     if is_admin_logged_in():
         # 管理员可以访问所有分类
-        cursor.execute("SELECT id, name FROM categories")
+        cursor.execute(f"SELECT {columns} FROM categories c {joins} ORDER BY c.id")
         categories = cursor.fetchall()
     elif user_id:
         # 登录用户可以访问默认分类和授权的分类
-        cursor.execute('''
-            SELECT c.id, c.name FROM categories c
+        cursor.execute(f'''
+            SELECT {columns} FROM categories c {joins}
             WHERE c.name = '默认分类' OR EXISTS (
                 SELECT 1 FROM user_category_permissions
                 WHERE user_id = ? AND category_id = c.id
             )
+            ORDER BY c.id
         ''', (user_id,))
         categories = cursor.fetchall()
     else:
         # 未登录用户只能访问默认分类
-        cursor.execute("SELECT id, name FROM categories WHERE name = '默认分类'")
+        cursor.execute(f"SELECT {columns} FROM categories c {joins} WHERE c.name = '默认分类' ORDER BY c.id")
         categories = cursor.fetchall()
     
     conn.close()
@@ -155,7 +1311,7 @@ def get_user_accessible_categories(user_id=None):
 
 # 获取用户信息
 def get_user_by_username(username):
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id, username, password, user_type FROM users WHERE username = ?", (username,))
     user = cursor.fetchone()
@@ -164,7 +1320,7 @@ def get_user_by_username(username):
 
 # 获取所有用户（管理员用）
 def get_all_users():
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id, username, '', user_type FROM users")
     users = cursor.fetchall()
@@ -173,7 +1329,7 @@ def get_all_users():
 
 # 添加用户（管理员用）
 def add_user(username, password, user_type='user'):
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -191,7 +1347,7 @@ def add_user(username, password, user_type='user'):
 
 # 删除用户（管理员用）
 def delete_user(user_id):
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -208,7 +1364,7 @@ def delete_user(user_id):
 
 # 设置用户分类权限（管理员用）
 def set_user_category_permissions(user_id, category_ids):
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -228,59 +1384,153 @@ def set_user_category_permissions(user_id, category_ids):
 
 # 获取用户的分类权限
 def get_user_category_permissions(user_id):
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT category_id FROM user_category_permissions WHERE user_id = ?", (user_id,))
     permissions = [row[0] for row in cursor.fetchall()]
     conn.close()
     return permissions
 
-# 获取所有分类
-def get_categories():
-    conn = sqlite3.connect(DATABASE)
+# 获取所有分类，with_stats为True时附带统计信息和封面
+def get_categories(with_stats=False):
+    conn = get_db_connection()
     cursor = conn.cursor()
-    cursor.execute("SELECT id, name FROM categories")
+    if with_stats:
+        cursor.execute(f"SELECT {CATEGORY_STATS_COLUMNS} FROM categories c {CATEGORY_STATS_JOINS} ORDER BY c.id")
+    else:
+        cursor.execute("SELECT id, name FROM categories")
     categories = cursor.fetchall()
     conn.close()
     return categories
 
+# 将分类统计查询结果转换为模板使用的字典
+def format_category_cards(categories):
+    cards = []
+    for category in categories:
+        cover_url = None
+        if category[6]:
+            cover_url = url_for('serve_uploads', filename=get_upload_rel_path(category[6]))
+        cards.append({
+            'id': category[0],
+            'name': category[1],
+            'image_count': category[2],
+            'total_bytes': category[3],
+            'newest_upload': category[4],
+            'cover_image_id': category[5],
+            'cover_url': cover_url
+        })
+    return cards
+
+# 解析宽高比参数，支持"16:9"、"16x9"和小数形式
+def parse_aspect_ratio(value):
+    if not value:
+        return None
+    try:
+        for separator in (':', 'x', 'X', '/'):
+            if separator in value:
+                width, height = value.split(separator, 1)
+                ratio = float(width) / float(height)
+                break
+        else:
+            ratio = float(value)
+    except (ValueError, ZeroDivisionError):
+        return None
+    return ratio if ratio > 0 else None
+
+# 根据过滤条件生成WHERE子句和参数
+# filters支持：min_width、min_height、aspect（宽高比）、aspect_tolerance（相对误差）、orientation（portrait/landscape/square）
+def build_image_filter(category_id, search_term='', filters=None):
+    conditions = ['category_id = ?']
+    params = [category_id]
+    filters = filters or {}
+    
+    if search_term:
+        conditions.append('filename LIKE ?')
+        params.append(f'%{search_term}%')
+    if filters.get('min_width'):
+        conditions.append('width >= ?')
+        params.append(filters['min_width'])
+    if filters.get('min_height'):
+        conditions.append('height >= ?')
+        params.append(filters['min_height'])
+    if filters.get('aspect'):
+        tolerance = filters.get('aspect_tolerance')
+        if tolerance is None:
+            tolerance = 0.01
+        conditions.append(f'{ASPECT_RATIO_EXPR} BETWEEN ? AND ?')
+        params.extend([filters['aspect'] * (1 - tolerance), filters['aspect'] * (1 + tolerance)])
+    # 方向也通过宽高比表达式判断，以便使用同一个表达式索引
+    orientation = filters.get('orientation')
+    if orientation == 'portrait':
+        conditions.append(f'{ASPECT_RATIO_EXPR} < 1')
+    elif orientation == 'landscape':
+        conditions.append(f'{ASPECT_RATIO_EXPR} > 1')
+    elif orientation == 'square':
+        conditions.append(f'{ASPECT_RATIO_EXPR} = 1')
+    
+    return ' AND '.join(conditions), params
+
 # 获取指定分类的图片
-def get_images_by_category(category_id, page=1, per_page=20, search_term='', sort_direction='desc'):
-    conn = sqlite3.connect(DATABASE)
+# sort_key为None时按sort_index排序，否则按IMAGE_SORT_COLUMNS中的字段排序
+def get_images_by_category(category_id, page=1, per_page=20, search_term='', sort_direction='desc', filters=None, sort_key=None):
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     offset = (page - 1) * per_page
     
-    # 根据排序方向决定ORDER BY子句
-    order_by = "ORDER BY sort_index ASC" if sort_direction == 'asc' else "ORDER BY sort_index DESC"
-    
-    if search_term:
-        query = f"""
-            SELECT id, filename, filepath, upload_time, sort_index
-            FROM images 
-            WHERE category_id = ? AND filename LIKE ? 
-            {order_by} 
-            LIMIT ? OFFSET ?
-        """
-        cursor.execute(query, (category_id, f'%{search_term}%', per_page, offset))
+    # 根据排序字段和方向决定ORDER BY子句
+    direction = 'ASC' if sort_direction == 'asc' else 'DESC'
+    if sort_key not in IMAGE_SORT_COLUMNS:
+        sort_key = None
+    if sort_key:
+        # 以id作为最后的排序列保证分页稳定，索引中隐含rowid，仍可按索引顺序读取
+        columns = IMAGE_SORT_COLUMNS[sort_key] + ('id',)
+        order_by = "ORDER BY " + ', '.join(f"{column} {direction}" for column in columns)
     else:
-        query = f"""
-            SELECT id, filename, filepath, upload_time, sort_index
-            FROM images 
-            WHERE category_id = ? 
-            {order_by} 
-            LIMIT ? OFFSET ?
-        """
-        cursor.execute(query, (category_id, per_page, offset))
+        order_by = f"ORDER BY sort_index {direction}"
     
-    images = cursor.fetchall()
+    where_clause, params = build_image_filter(category_id, search_term, filters)
+    has_filters = where_clause != 'category_id = ?'
     
-    # 获取总数
-    if search_term:
-        cursor.execute("SELECT COUNT(*) FROM images WHERE category_id = ? AND filename LIKE ?", (category_id, f'%{search_term}%'))
-    else:
-        cursor.execute("SELECT COUNT(*) FROM images WHERE category_id = ?", (category_id,))
-    total_count = cursor.fetchone()[0]
+    # 没有过滤条件时从共享的快照中读取（快照中每个分类的图片已按各排序方式排好）
+    if not has_filters and (sort_key is None or sort_key in catalogsnapshot.SORT_KEYS):
+        snapshot = get_catalog_snapshot(cursor)
+        if snapshot is not None:
+            conn.close()
+            total_count = snapshot.count(category_id)
+            return {
+                'images': snapshot.page(category_id, offset, per_page, direction == 'DESC', sort_key),
+                'total_pages': (total_count + per_page - 1) // per_page,
+                'current_page': page,
+                'total_count': total_count
+            }
+    
+    # 先获取总数：没有过滤条件时直接读取分类统计表，否则通过过滤条件对应的索引计数
+    total_count = None
+    if not has_filters:
+        cursor.execute("SELECT image_count FROM category_stats WHERE category_id = ?", (category_id,))
+        row = cursor.fetchone()
+        if row:
+            total_count = row[0]
+    if total_count is None:
+        cursor.execute(f"SELECT COUNT(*) FROM images WHERE {where_clause}", params)
+        total_count = cursor.fetchone()[0]
+    
+    # 匹配的行较多时按排序索引顺序读取，很快就能凑满一页；匹配的行较少时由查询优化器使用过滤条件的索引
+    index_hint = ''
+    if has_filters and total_count > FILTERED_SORT_INDEX_THRESHOLD:
+        index_hint = f"INDEXED BY {IMAGE_SORT_INDEXES[sort_key]}"
+    
+    query = f"""
+        SELECT id, filename, filepath, upload_time, sort_index, file_size, width, height
+        FROM images {index_hint}
+        WHERE {where_clause} 
+        {order_by} 
+        LIMIT ? OFFSET ?
+    """
+    cursor.execute(query, params + [per_page, offset])
+    
+    images = cursor.fetchall()
     
     conn.close()
     
@@ -295,7 +1545,7 @@ def get_images_by_category(category_id, page=1, per_page=20, search_term='', sor
 
 # 获取图片详情
 def get_image_detail(image_id):
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("""
         SELECT images.id, images.filename, images.filepath, images.upload_time, categories.name 
@@ -307,11 +1557,30 @@ def get_image_detail(image_id):
     conn.close()
     return image
 
+# 批量获取图片详情，返回{id: (id, filename, filepath, upload_time, file_size, width, height, category_id, 分类名)}
+def get_image_details(image_ids):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    details = {}
+    for chunk in chunked(image_ids):
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f"""
+            SELECT images.id, images.filename, images.filepath, images.upload_time, images.file_size,
+                   images.width, images.height, images.category_id, categories.name
+            FROM images
+            JOIN categories ON images.category_id = categories.id
+            WHERE images.id IN ({placeholders})
+        """, chunk)
+        for row in cursor.fetchall():
+            details[row[0]] = row
+    conn.close()
+    return details
+
 # 为指定分类的图片更新排序索引
 def update_sort_index_for_category(category_id, cursor=None, conn=None):
     # 如果没有提供连接和游标，创建新的
     if conn is None or cursor is None:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db_connection()
         cursor = conn.cursor()
         need_commit = True
     else:
@@ -339,46 +1608,101 @@ def update_sort_index_for_category(category_id, cursor=None, conn=None):
         conn.close()
 
 # 扫描文件夹并更新数据库
-def scan_folder_and_update_db(folder_path, category_id, cursor=None, conn=None):
-    # 如果没有提供连接和游标，创建新的
-    if conn is None or cursor is None:
-        conn = sqlite3.connect(DATABASE)
-        cursor = conn.cursor()
-        need_commit = True
-    else:
-        need_commit = False
+# 读取图片元数据（可能很慢，尤其是对象存储和网络文件夹）时不持有事务；
+# 新增和补充的记录每SCAN_WRITE_BATCH_SIZE条在一个短事务中写入，避免扫描期间长时间占用数据库写锁
+def scan_folder_and_update_db(folder_path, category_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    
+    scan_start = time.perf_counter()
     
-    # 获取当前数据库中该分类的所有图片
-    cursor.execute("SELECT filepath FROM images WHERE category_id = ?", (category_id,))
-    db_files = set([row[0] for row in cursor.fetchall()])
+    # 获取当前数据库中该分类的所有图片（路径 -> 是否缺少元数据），以及已记录的内容摘要
+    cursor.execute(
+        "SELECT filepath, file_size IS NULL OR width IS NULL, content_hash FROM images WHERE category_id = ?",
+        (category_id,)
+    )
+    db_files = {}
+    known_hashes = set()
+    for filepath, needs_metadata, content_hash in cursor.fetchall():
+        db_files[filepath] = needs_metadata
+        if content_hash:
+            known_hashes.add(content_hash)
+    # 正在移动的文件（原路径和目标路径）由移动任务处理，扫描时既不添加也不删除
+    cursor.execute("SELECT source_path, target_path FROM image_moves")
+    moving = {path for row in cursor.fetchall() for path in row}
+    
+    # 待写入的新记录和待补充元数据的旧记录
+    new_rows = []
+    updated_rows = []
+    
+    def flush():
+        if new_rows:
+            # 托管目录中的文件（如从备份恢复的）按文件名中的摘要记录
+            cursor.executemany(
+                "INSERT INTO images (filename, filepath, category_id, file_size, width, height, content_hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                new_rows
+            )
+        if updated_rows:
+            cursor.executemany(
+                "UPDATE images SET file_size = ?, width = ?, height = ? WHERE filepath = ? AND category_id = ?",
+                updated_rows
+            )
+        conn.commit()
+        del new_rows[:]
+        del updated_rows[:]
     
     # 扫描文件夹中的所有图片
     folder_files = set()
-    for root, dirs, files in os.walk(folder_path):
-        for file in files:
+    inserted_count = 0
+    deleted_count = 0
+    try:
+        for file_path, file in get_storage().walk(folder_path):
             if allowed_file(file):
-                file_path = os.path.join(root, file)
                 folder_files.add(file_path)
+                if file_path in moving:
+                    continue
                 
                 # 如果文件不在数据库中，添加它
+                # 托管目录中摘要已有记录的文件不再添加：正在迁移的图片先记录摘要再复制文件，记录的路径稍后才改为新位置
                 if file_path not in db_files:
-                    cursor.execute(
-                        "INSERT INTO images (filename, filepath, category_id) VALUES (?, ?, ?)",
-                        (file, file_path, category_id)
-                    )
-    
-    # 删除数据库中有但文件夹中不存在的文件记录
-    for file_path in db_files:
-        if file_path not in folder_files:
-            cursor.execute("DELETE FROM images WHERE filepath = ?", (file_path,))
-    
-    # 更新排序索引
-    update_sort_index_for_category(category_id, cursor, conn)
-    
-    # 只有在需要时才提交和关闭连接
-    if need_commit:
+                    if get_managed_hash(file_path) in known_hashes:
+                        continue
+                    file_size, width, height = read_image_metadata(file_path)
+                    new_rows.append((file, file_path, category_id, file_size, width, height, get_managed_hash(file_path)))
+                    inserted_count += 1
+                # 补充旧记录缺失的文件大小和尺寸
+                elif db_files[file_path]:
+                    file_size, width, height = read_image_metadata(file_path)
+                    updated_rows.append((file_size, width, height, file_path, category_id))
+                
+                if len(new_rows) + len(updated_rows) >= SCAN_WRITE_BATCH_SIZE:
+                    flush()
+        flush()
+        
+        # 删除数据库中有但文件夹中不存在的文件记录
+        missing = [
+            (file_path, category_id) for file_path in db_files
+            if file_path not in folder_files and file_path not in moving
+        ]
+        for start in range(0, len(missing), SCAN_WRITE_BATCH_SIZE):
+            cursor.executemany(
+                "DELETE FROM images WHERE filepath = ? AND category_id = ?",
+                missing[start:start + SCAN_WRITE_BATCH_SIZE]
+            )
+            conn.commit()
+        deleted_count = len(missing)
+        
+        # 更新排序索引
+        update_sort_index_for_category(category_id, cursor, conn)
         conn.commit()
+    finally:
         conn.close()
+    
+    # 记录扫描吞吐量
+    metrics.inc('wallpaper_scan_files_total', len(folder_files), result='seen')
+    metrics.inc('wallpaper_scan_files_total', inserted_count, result='inserted')
+    metrics.inc('wallpaper_scan_files_total', deleted_count, result='deleted')
+    metrics.observe('wallpaper_scan_duration_seconds', time.perf_counter() - scan_start)
 
 # 上传图片API
 @app.route('/admin/upload_image', methods=['POST'])
@@ -395,7 +1719,7 @@ def upload_image():
             return jsonify({'success': False, 'message': '请选择分类'})
             
         # 获取分类文件夹路径
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT folder_path FROM categories WHERE id = ?", (category_id,))
         category = cursor.fetchone()
@@ -408,30 +1732,35 @@ def upload_image():
         uploaded_count = 0
         
         # 保存上传的文件
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db_connection()
         cursor = conn.cursor()
         
         for file in files:
             if file and allowed_file(file.filename):
-                # 生成唯一文件名
                 filename = file.filename
-                filepath = os.path.join(folder_path, filename)
-                
-                # 如果文件已存在，添加时间戳
-                counter = 1
-                name, ext = os.path.splitext(filename)
-                while os.path.exists(filepath):
-                    filename = f"{name}_{counter}{ext}"
+                content_hash = None
+                if app.config['MANAGED_UPLOAD_LAYOUT']:
+                    filepath, content_hash = save_managed_upload(file, folder_path)
+                else:
+                    # 生成唯一文件名
                     filepath = os.path.join(folder_path, filename)
-                    counter += 1
                     
-                # 保存文件
-                file.save(filepath)
+                    # 如果文件已存在，添加时间戳
+                    counter = 1
+                    name, ext = os.path.splitext(filename)
+                    while get_storage().exists(filepath):
+                        filename = f"{name}_{counter}{ext}"
+                        filepath = os.path.join(folder_path, filename)
+                        counter += 1
+                        
+                    # 保存文件
+                    get_storage().save(filepath, file.stream)
                 
                 # 更新数据库
+                file_size, width, height = read_image_metadata(filepath)
                 cursor.execute(
-                    "INSERT INTO images (filename, filepath, category_id) VALUES (?, ?, ?)",
-                    (filename, filepath, category_id)
+                    "INSERT INTO images (filename, filepath, category_id, file_size, width, height, content_hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (filename, filepath, category_id, file_size, width, height, content_hash)
                 )
                 
                 uploaded_count += 1
@@ -441,6 +1770,8 @@ def upload_image():
         
         # 更新该分类的排序索引
         update_sort_index_for_category(category_id)
+        schedule_palette_indexing()
+        schedule_animation_transcoding()
         
         if uploaded_count == 0:
             return jsonify({'success': False, 'message': '没有有效的图片文件被上传'})
@@ -468,7 +1799,7 @@ def get_category_images(category_id):
         
     try:
         # 检查分类是否存在
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT id, name FROM categories WHERE id = ?", (category_id,))
         category = cursor.fetchone()
@@ -517,22 +1848,7 @@ def get_category_images(category_id):
                 image_url = url_for('serve_uploads', filename=rel_path)
                 
                 # 处理时间戳，转换为UTC+8时间
-                upload_time = img[3]
-                if isinstance(upload_time, str):
-                    # 如果是字符串形式的时间戳，尝试解析
-                    try:
-                        # 尝试解析SQLite的时间戳格式
-                        dt = datetime.strptime(upload_time, '%Y-%m-%d %H:%M:%S')
-                        # 设置为UTC+8时区
-                        utc8_tz = pytz.timezone('Asia/Shanghai')
-                        # 假设数据库中的时间是UTC时间，需要转换
-                        dt_utc = pytz.utc.localize(dt)
-                        dt_utc8 = dt_utc.astimezone(utc8_tz)
-                        # 格式化输出为UTC+8时间
-                        upload_time = dt_utc8.strftime('%Y-%m-%d %H:%M:%S')
-                    except ValueError:
-                        # 如果解析失败，保持原格式
-                        pass
+                upload_time = format_upload_time(img[3])
                 
                 formatted_images.append({
                     'id': img[0],
@@ -591,7 +1907,7 @@ def delete_category(category_id):
         return jsonify({'success': False, 'message': '默认分类不能删除'})
         
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db_connection()
         cursor = conn.cursor()
         
         # 获取分类信息
@@ -601,22 +1917,98 @@ def delete_category(category_id):
         if not category:
             conn.close()
             return jsonify({'success': False, 'message': '分类不存在'})
-            
-        # 先删除该分类下的所有图片记录
-        cursor.execute("DELETE FROM images WHERE category_id = ?", (category_id,))
         
-        # 然后删除分类记录（不删除实际文件夹）
+        # 在一个很短的事务中删除分类记录和访问权限，分类立即从所有页面消失（不删除实际文件夹）；
+        # 图片记录可能有几十万条，由后台任务分批删除，避免长时间占用写锁
+        cursor.execute("SELECT image_count FROM category_stats WHERE category_id = ?", (category_id,))
+        row = cursor.fetchone()
+        image_count = row[0] if row else 0
+        cursor.execute(
+            "INSERT OR REPLACE INTO category_deletions (category_id, name, folder_path, image_count) VALUES (?, ?, ?, ?)",
+            (category_id, category[0], category[1], image_count)
+        )
+        cursor.execute("DELETE FROM user_category_permissions WHERE category_id = ?", (category_id,))
         cursor.execute("DELETE FROM categories WHERE id = ?", (category_id,))
         conn.commit()
         conn.close()
         
-        return jsonify({'success': True, 'message': '分类删除成功'})
+        job = background_jobs.submit('category_delete', delete_category_job, category_id, total=image_count)
+        return jsonify({
+            'success': True,
+            'message': f'分类已删除，{image_count} 条图片记录将在后台清理',
+            'job_id': job.id
+        })
     except Exception as e:
         return jsonify({'success': False, 'message': f'删除失败: {str(e)}'})
 
+# 后台任务：分批删除已删除分类的图片记录，每批单独提交，每CATEGORY_DELETE_BATCHES_PER_RUN批后重新排队；最后删除分类的统计数据和缓存
+# 只删除数据库记录和派生文件（缩略图、转码结果等），不删除原图
+def delete_category_job(job, category_id):
+    for _ in range(CATEGORY_DELETE_BATCHES_PER_RUN):
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT id, filepath FROM images WHERE category_id = ? ORDER BY id LIMIT ?",
+                (category_id, CATEGORY_DELETE_BATCH_SIZE)
+            )
+            rows = cursor.fetchall()
+            if rows:
+                ids = [row[0] for row in rows]
+                placeholders = ','.join('?' * len(ids))
+                cursor.execute(f"DELETE FROM images WHERE id IN ({placeholders})", ids)
+                cursor.execute(
+                    "UPDATE category_deletions SET deleted_count = deleted_count + ? WHERE category_id = ?",
+                    (len(ids), category_id)
+                )
+            else:
+                cursor.execute("DELETE FROM category_stats WHERE category_id = ?", (category_id,))
+                cursor.execute("DELETE FROM image_date_buckets WHERE category_id = ?", (category_id,))
+                cursor.execute("DELETE FROM user_category_permissions WHERE category_id = ?", (category_id,))
+                cursor.execute("DELETE FROM category_deletions WHERE category_id = ?", (category_id,))
+            conn.commit()
+        finally:
+            conn.close()
+        if not rows:
+            break
+        
+        for image_id, filepath in rows:
+            try:
+                for hook in derived_file_cleanup_hooks:
+                    hook(image_id, filepath)
+            except Exception as e:
+                job.fail(f"{filepath}: {e}")
+        job.advance(len(rows))
+        time.sleep(CATEGORY_DELETE_PAUSE)
+    else:
+        # 还没有删除完，稍后继续（任务ID和进度不变）
+        return RESCHEDULE
+    
+    # 删除该分类的概览拼图缓存
+    shutil.rmtree(os.path.join(SPRITE_FOLDER, str(category_id)), ignore_errors=True)
+
+# 继续删除上次运行时没有删除完的分类
+def resume_category_deletions():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT category_id, image_count - deleted_count FROM category_deletions ORDER BY category_id")
+    pending = cursor.fetchall()
+    conn.close()
+    for category_id, remaining in pending:
+        background_jobs.submit('category_delete', delete_category_job, category_id, total=max(remaining, 0))
+
+# 正在后台删除的分类及进度，用于管理面板
+def get_category_deletions():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT category_id, name, image_count, deleted_count FROM category_deletions ORDER BY category_id")
+    deletions = cursor.fetchall()
+    conn.close()
+    return deletions
+
 # 修改用户密码函数
 def change_user_password(user_id, new_password):
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db_connection()
     cursor = conn.cursor()
     
     try:
@@ -640,7 +2032,7 @@ def verify_admin_password(username, current_password):
     """验证管理员密码"""
     try:
         # 连接数据库
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db_connection()
         cursor = conn.cursor()
         
         # 查询管理员用户
@@ -662,7 +2054,7 @@ def verify_admin_password(username, current_password):
 # 首页路由
 @app.route('/')
 def index():
-    categories = get_user_accessible_categories()
+    categories = format_category_cards(get_user_accessible_categories(with_stats=True))
     return render_template('index.html', categories=categories)
 
 # 测试页脚对齐路由
@@ -674,7 +2066,7 @@ def test_footer():
 @app.route('/category/<int:category_id>')
 def category(category_id):
     # 获取分类信息
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id, name FROM categories WHERE id = ?", (category_id,))
     category = cursor.fetchone()
@@ -773,9 +2165,26 @@ def admin_dashboard():
     if not is_admin_logged_in():
         return redirect(url_for('admin_login'))
         
-    categories = get_categories()
+    categories = get_categories(with_stats=True)
     users = get_all_users()
-    return render_template('admin_dashboard.html', categories=categories, users=users)
+    return render_template('admin_dashboard.html', categories=categories, users=users, io_health=get_io_health(),
+                           category_deletions=get_category_deletions(), integrity_status=get_integrity_status())
+
+# 当前进程中各分类文件夹的访问状况（只包含访问过的文件夹），附带使用该文件夹的分类名
+def get_io_health():
+    if io_guard is None:
+        return []
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT name, folder_path FROM categories ORDER BY id")
+    names = {}
+    for name, folder_path in cursor.fetchall():
+        names.setdefault(os.path.abspath(folder_path), []).append(name)
+    conn.close()
+    health = io_guard.health()
+    for item in health:
+        item['categories'] = names.get(item['root'], [])
+    return health
 
 # 添加用户路由（管理员用）
 @app.route('/admin/add_user', methods=['POST'])
@@ -802,7 +2211,7 @@ def admin_delete_user(user_id):
         return jsonify({'success': False, 'message': '请先登录'})
         
     # 不允许删除管理员账户
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT user_type FROM users WHERE id = ?", (user_id,))
     user_type = cursor.fetchone()
@@ -854,7 +2263,7 @@ def admin_change_admin_password():
             return jsonify({'success': False, 'message': '当前密码不正确'})
         
         # 获取管理员用户ID
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute('SELECT id FROM users WHERE username = ? AND user_type = ?', (username, 'admin'))
         user_id = cursor.fetchone()[0]
@@ -925,7 +2334,7 @@ def admin_change_user_password():
         return jsonify({'success': False, 'message': '密码长度至少8位'})
     
     # 不允许修改管理员账户密码通过此接口
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT user_type FROM users WHERE id = ?", (user_id,))
     user_type = cursor.fetchone()
@@ -974,22 +2383,18 @@ def add_category():
         return jsonify({'success': False, 'message': '分类名称和文件夹路径不能为空'})
     
     # 验证文件夹路径是否存在
-    if not os.path.exists(folder_path):
+    if not get_storage().folder_exists(folder_path):
         print(f"文件夹不存在: {folder_path}")
         return jsonify({'success': False, 'message': '指定的文件夹路径不存在'})
     
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db_connection()
     cursor = conn.cursor()
     try:
         print(f"执行SQL插入 - name: {name}, folder_path: {folder_path}")
         cursor.execute("INSERT INTO categories (name, folder_path) VALUES (?, ?)", (name, folder_path))
         category_id = cursor.lastrowid
         print(f"插入成功，分类ID: {category_id}")
-        # 扫描文件夹并更新数据库 - 使用同一个数据库连接
-        scan_folder_and_update_db(folder_path, category_id, cursor, conn)
         conn.commit()
-        print("分类添加成功")
-        return jsonify({'success': True, 'message': '分类添加成功'})
     except sqlite3.IntegrityError:
         print("SQL完整性错误，分类名称或文件夹路径已存在")
         conn.rollback()
@@ -1001,6 +2406,18 @@ def add_category():
     finally:
         conn.close()
         print("数据库连接已关闭")
+    
+    try:
+        # 扫描文件夹并更新数据库（扫描分批提交，读取图片时不持有写锁）
+        scan_folder_and_update_db(folder_path, category_id)
+    except Exception as e:
+        # 分类已经添加，已写入的图片记录保留，可以稍后重新扫描
+        print(f"扫描文件夹异常: {str(e)}")
+        return jsonify({'success': False, 'message': f'分类已添加，但扫描文件夹失败: {str(e)}'})
+    schedule_palette_indexing()
+    schedule_animation_transcoding()
+    print("分类添加成功")
+    return jsonify({'success': True, 'message': '分类添加成功'})
 
 # 删除分类路由已在上方实现
 
@@ -1023,7 +2440,7 @@ def admin_upload():
     
     if file and allowed_file(file.filename):
         # 获取分类的文件夹路径
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT folder_path FROM categories WHERE id = ?", (category_id,))
         category = cursor.fetchone()
@@ -1036,28 +2453,33 @@ def admin_upload():
         
         # 保存文件
         filename = file.filename
-        file_path = os.path.join(folder_path, filename)
-        
-        # 如果文件已存在，添加UTC+8时间戳避免覆盖
-        if os.path.exists(file_path):
-            # 设置为UTC+8时区
-            utc8_tz = pytz.timezone('Asia/Shanghai')
-            timestamp = datetime.now(utc8_tz).strftime('%Y%m%d%H%M%S')
-            name, ext = os.path.splitext(filename)
-            filename = f"{name}_{timestamp}{ext}"
+        content_hash = None
+        if app.config['MANAGED_UPLOAD_LAYOUT']:
+            file_path, content_hash = save_managed_upload(file, folder_path)
+        else:
             file_path = os.path.join(folder_path, filename)
-        
-        file.save(file_path)
+            
+            # 如果文件已存在，添加UTC+8时间戳避免覆盖
+            if get_storage().exists(file_path):
+                timestamp = datetime.now(DISPLAY_TIMEZONE).strftime('%Y%m%d%H%M%S')
+                name, ext = os.path.splitext(filename)
+                filename = f"{name}_{timestamp}{ext}"
+                file_path = os.path.join(folder_path, filename)
+            
+            get_storage().save(file_path, file.stream)
         
         # 更新数据库
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db_connection()
         cursor = conn.cursor()
+        file_size, width, height = read_image_metadata(file_path)
         cursor.execute(
-            "INSERT INTO images (filename, filepath, category_id) VALUES (?, ?, ?)",
-            (filename, file_path, category_id)
+            "INSERT INTO images (filename, filepath, category_id, file_size, width, height, content_hash) VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (filename, file_path, category_id, file_size, width, height, content_hash)
         )
         conn.commit()
         conn.close()
+        schedule_palette_indexing()
+        schedule_animation_transcoding()
         
         return jsonify({'success': True, 'message': '图片上传成功'})
     
@@ -1069,7 +2491,7 @@ def scan_folder(category_id):
     if not is_admin_logged_in():
         return jsonify({'success': False, 'message': '请先登录'})
     
-    conn = sqlite3.connect(DATABASE)
+    conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT folder_path FROM categories WHERE id = ?", (category_id,))
     category = cursor.fetchone()
@@ -1080,6 +2502,8 @@ def scan_folder(category_id):
     
     try:
         scan_folder_and_update_db(category[0], category_id)
+        schedule_palette_indexing()
+        schedule_animation_transcoding()
         return jsonify({'success': True, 'message': '文件夹扫描完成'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'扫描失败: {str(e)}'})
@@ -1092,10 +2516,30 @@ def api_images(category_id):
     search_term = request.args.get('search', '', type=str)
     view_mode = request.args.get('view_mode', 'waterfall', type=str)
     sort_direction = request.args.get('sort', 'desc', type=str)  # 默认为降序
+    response_format = request.args.get('format', '', type=str)  # compact为列式紧凑格式
+    
+    # sort为asc/desc时表示按sort_index排序的方向；为size/resolution/upload_time时表示排序字段，方向由order指定
+    sort_key = None
+    if sort_direction in IMAGE_SORT_COLUMNS:
+        sort_key = sort_direction
+        sort_direction = request.args.get('order', 'desc', type=str)
+    
+    # 分辨率、宽高比和方向过滤条件
+    filters = {
+        'min_width': request.args.get('min_width', 0, type=int),
+        'min_height': request.args.get('min_height', 0, type=int),
+        'aspect': parse_aspect_ratio(request.args.get('aspect', '', type=str)),
+        'aspect_tolerance': request.args.get('aspect_tolerance', 0.01, type=float),
+        'orientation': request.args.get('orientation', '', type=str)
+    }
+    # 误差不能为负数、NaN或无穷大；为0时只匹配完全相同的宽高比
+    if not 0 <= filters['aspect_tolerance'] < float('inf'):
+        return jsonify({'success': False, 'message': 'aspect_tolerance必须是不小于0的数'})
     
     try:
+        auth_start = time.perf_counter()
         # 检查分类是否存在
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute("SELECT id, name FROM categories WHERE id = ?", (category_id,))
         category = cursor.fetchone()
@@ -1125,68 +2569,35 @@ def api_images(category_id):
             
             if not has_permission:
                 return jsonify({'success': False, 'message': '您没有权限访问该分类'})
+        add_phase_timing('auth', time.perf_counter() - auth_start)
         
-        result = get_images_by_category(category_id, page, per_page, search_term, sort_direction)
+        with timed_phase('query'):
+            result = get_images_by_category(category_id, page, per_page, search_term, sort_direction, filters, sort_key)
 
         # 格式化图片数据
         formatted_images = []
+        compact = response_format == 'compact'
+        # 获取uploads目录的绝对路径
+        uploads_abs_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
         for img in result['images']:
             # 数据库返回的顺序是: id, filename, filepath, upload_time
-            # 获取uploads目录的绝对路径
-            uploads_abs_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'uploads'))
-            
-            # 检查文件是否在uploads目录内
-            if os.path.commonpath([uploads_abs_path]) == os.path.commonpath([uploads_abs_path, img[2]]):
-                # 对于uploads目录内的文件，计算相对路径
-                rel_path = os.path.relpath(img[2], uploads_abs_path)
-            else:
-                # 对于不在uploads目录内的文件，直接使用文件名
-                rel_path = os.path.basename(img[2])
-                
-            # 将Windows路径分隔符替换为URL路径分隔符
-            rel_path = rel_path.replace('\\', '/')
-            # 生成正确的图片URL路径
-            image_url = url_for('serve_uploads', filename=rel_path)
+            rel_path = get_upload_rel_path(img[2], uploads_abs_path)
+            # 生成正确的图片URL路径（紧凑格式只返回编码后的相对路径，由客户端拼接公共前缀）
+            image_url = urllib.parse.quote(rel_path) if compact else url_for('serve_uploads', filename=rel_path)
             
             # 处理时间戳，转换为UTC+8时间
-            upload_time = img[3]
-            if isinstance(upload_time, str):
-                # 如果是字符串形式的时间戳，尝试解析
-                try:
-                    # 尝试解析SQLite的时间戳格式
-                    dt = datetime.strptime(upload_time, '%Y-%m-%d %H:%M:%S')
-                    # 设置为UTC+8时区
-                    utc8_tz = pytz.timezone('Asia/Shanghai')
-                    # 假设数据库中的时间是UTC时间，需要转换
-                    dt_utc = pytz.utc.localize(dt)
-                    dt_utc8 = dt_utc.astimezone(utc8_tz)
-                    # 格式化输出为UTC+8时间
-                    upload_time = dt_utc8.strftime('%Y-%m-%d %H:%M:%S')
-                except ValueError:
-                    # 如果解析失败，保持原格式
-                    pass
-            
-            # 获取图片实际尺寸和文件大小
-            width = None
-            height = None
-            size = None
+            upload_time = format_upload_time(img[3])
             
-            # 尝试获取文件大小
-            try:
-                # 获取原始文件的绝对路径
-                original_file_path = img[2]  # 这是数据库中存储的原始文件路径
-                if os.path.exists(original_file_path):
-                    size = os.path.getsize(original_file_path)  # 获取文件大小（字节）
-            except Exception as e:
-                print(f"获取文件大小失败: {e}")
+            # 图片尺寸和文件大小优先使用入库时保存的元数据
+            size = img[5]
+            width = img[6]
+            height = img[7]
             
-            # 尝试获取图片尺寸
-            try:
-                if Image and os.path.exists(original_file_path):
-                    with Image.open(original_file_path) as img_obj:
-                        width, height = img_obj.size
-            except Exception as e:
-                print(f"获取图片尺寸失败: {e}")
+            # 旧记录缺少元数据时才读取文件
+            if size is None or width is None:
+                meta_start = time.perf_counter()
+                size, width, height = read_image_metadata(img[2])
+                add_phase_timing('image_meta', time.perf_counter() - meta_start)
             
             formatted_images.append({
                 'id': img[0],
@@ -1198,14 +2609,28 @@ def api_images(category_id):
                 'size': size
             })
         
-        return jsonify({
+        payload = {
             'success': True,
             'images': formatted_images,
             'total_pages': result['total_pages'],
             'current_page': result['current_page'],
             'total_count': result['total_count'],
             'view_mode': view_mode
-        })
+        }
+        if request.args.get('facets', 0, type=int):
+            # 该分类中各标签的图片数（不考虑搜索和尺寸过滤条件）
+            with timed_phase('facets'):
+                snapshot = get_tag_snapshot()
+                payload['facets'] = format_facets(snapshot.facet_counts(snapshot.category_bitmap([category_id])))
+        if compact:
+            # 列式格式：每个字段一个数组，避免每行重复键名和URL前缀
+            payload['format'] = 'compact'
+            payload['url_prefix'] = request.script_root + '/uploads/'
+            payload['images'] = to_columns(formatted_images, COMPACT_IMAGE_COLUMNS, {'filepath': 'path'})
+        
+        with timed_phase('serialize'):
+            response = json_response(payload)
+        return response
     except Exception as e:
         return jsonify({'success': False, 'message': f'获取图片失败: {str(e)}'})
 
@@ -1221,22 +2646,7 @@ def api_image_detail(image_id):
     relative_path = relative_path.replace('\\', '/')
     
     # 处理时间戳，转换为UTC+8时间
-    upload_time = image[2]
-    if isinstance(upload_time, str):
-        # 如果是字符串形式的时间戳，尝试解析
-        try:
-            # 尝试解析SQLite的时间戳格式
-            dt = datetime.strptime(upload_time, '%Y-%m-%d %H:%M:%S')
-            # 设置为UTC+8时区
-            utc8_tz = pytz.timezone('Asia/Shanghai')
-            # 假设数据库中的时间是UTC时间，需要转换
-            dt_utc = pytz.utc.localize(dt)
-            dt_utc8 = dt_utc.astimezone(utc8_tz)
-            # 格式化输出为UTC+8时间
-            upload_time = dt_utc8.strftime('%Y-%m-%d %H:%M:%S')
-        except ValueError:
-            # 如果解析失败，保持原格式
-            pass
+    upload_time = format_upload_time(image[2])
     
     return jsonify({
         'success': True,
@@ -1245,10 +2655,59 @@ def api_image_detail(image_id):
             'filename': image[1],
             'filepath': relative_path,
             'upload_time': upload_time,
-            'category': image[3]
+            'category': image[3],
+            # 动图可用的转码结果，原图地址加上 ?variant=<名称> 即可请求
+            'variants': get_animation_variants(image[0], image[2])
         }
     })
 
+# 批量获取图片详情API，例如 /api/images/detail?ids=1,2,3
+# 按请求的顺序返回，不存在或没有权限访问的图片放在missing中
+@app.route('/api/images/detail')
+def api_image_details():
+    image_ids = parse_id_list(request.args.get('ids', '', type=str))
+    if not image_ids:
+        return jsonify({'success': False, 'message': '请提供图片ID列表'})
+    if len(image_ids) > MAX_DETAIL_IDS:
+        return jsonify({'success': False, 'message': f'一次最多查询 {MAX_DETAIL_IDS} 张图片'})
+    
+    start = time.perf_counter()
+    category_ids = get_accessible_category_ids()
+    add_phase_timing('auth', time.perf_counter() - start)
+    
+    with timed_phase('query'):
+        details = get_image_details(image_ids)
+        image_tags = get_image_tags(list(details))
+    
+    with timed_phase('serialize'):
+        images = []
+        missing = []
+        for image_id in image_ids:
+            row = details.get(image_id)
+            if not row or row[7] not in category_ids:
+                missing.append(image_id)
+                continue
+            images.append({
+                'id': row[0],
+                'filename': row[1],
+                'filepath': url_for('serve_uploads', filename=get_upload_rel_path(row[2])),
+                'upload_time': format_upload_time(row[3]),
+                'size': row[4],
+                'width': row[5],
+                'height': row[6],
+                'category_id': row[7],
+                'category': row[8],
+                'tags': image_tags.get(row[0], [])
+            })
+        response = json_response({'success': True, 'images': images, 'missing': missing})
+    
+    # 结果与登录状态有关，只允许浏览器缓存；客户端可用ETag重新验证
+    response.cache_control.private = True
+    response.cache_control.max_age = 60
+    response.vary.add('Cookie')
+    response.add_etag()
+    return response.make_conditional(request)
+
 # 删除图片API
 @app.route('/api/images/<int:image_id>', methods=['DELETE'])
 def delete_image(image_id):
@@ -1262,24 +2721,1749 @@ def delete_image(image_id):
         file_path = image[2]
         
         # 删除数据库中的记录
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db_connection()
         cursor = conn.cursor()
         cursor.execute("DELETE FROM images WHERE id = ?", (image_id,))
         conn.commit()
         conn.close()
         
-        # 尝试删除实际文件
-        if os.path.exists(file_path):
-            try:
-                os.remove(file_path)
-            except Exception as e:
-                print(f"删除文件失败: {e}")
+        # 尝试删除实际文件（托管目录中仍被其他图片使用的文件保留）
+        try:
+            if not is_file_referenced(file_path):
+                get_storage().delete(file_path)
+            for hook in derived_file_cleanup_hooks:
+                hook(image_id, file_path)
+        except Exception as e:
+            print(f"删除文件失败: {e}")
                 # 文件删除失败不影响数据库删除操作
         
         return jsonify({'success': True, 'message': '图片删除成功'})
     except Exception as e:
         return jsonify({'success': False, 'message': f'删除失败: {str(e)}'})
 
+# 将列表按固定大小分批
+def chunked(items, size=SQL_IN_CHUNK_SIZE):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+# 解析ID列表，去重并保持顺序，返回None表示格式错误
+def parse_id_list(raw_ids):
+    if isinstance(raw_ids, str):
+        raw_ids = [part for part in raw_ids.split(',') if part.strip()]
+    if not isinstance(raw_ids, (list, tuple)):
+        return None
+    ids = []
+    seen = set()
+    for raw_id in raw_ids:
+        try:
+            image_id = int(raw_id)
+        except (TypeError, ValueError):
+            return None
+        if image_id not in seen:
+            seen.add(image_id)
+            ids.append(image_id)
+    return ids
+
+# 批量删除图片记录（单个事务），返回被删除的(id, filepath)列表
+def bulk_delete_images(image_ids):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        deleted = []
+        for chunk in chunked(image_ids):
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f"SELECT id, filepath FROM images WHERE id IN ({placeholders})", chunk)
+            deleted.extend(cursor.fetchall())
+            cursor.execute(f"DELETE FROM images WHERE id IN ({placeholders})", chunk)
+        conn.commit()
+        return deleted
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+# 批量将图片移动到其他分类（单个事务），返回需要移动的(id, 原路径, 新路径)列表
+def bulk_move_images(image_ids, target_category_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        cursor.execute("SELECT folder_path FROM categories WHERE id = ?", (target_category_id,))
+        category = cursor.fetchone()
+        if not category:
+            conn.rollback()
+            return None
+        folder_path = category[0]
+        
+        # 正在移动的图片不重复移动
+        rows = []
+        for chunk in chunked(image_ids):
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(
+                f"SELECT id, filename, filepath, content_hash FROM images WHERE id IN ({placeholders}) AND category_id != ? "
+                f"AND id NOT IN (SELECT image_id FROM image_moves)",
+                chunk + [target_category_id]
+            )
+            rows.extend(cursor.fetchall())
+        cursor.execute("SELECT target_path FROM image_moves")
+        claimed = {row[0] for row in cursor.fetchall()}
+        
+        # 为每个文件在目标文件夹中预留不冲突的文件名（其他移动任务预留的也不使用）
+        moves = []
+        updates = []
+        for image_id, filename, filepath, content_hash in rows:
+            # 托管的文件按摘要放到目标文件夹中的对应位置，文件名不会冲突
+            if content_hash:
+                new_filename = filename
+                new_path = get_managed_path(folder_path, content_hash, os.path.splitext(filepath)[1])
+            else:
+                new_filename, new_path = get_free_move_target(folder_path, filename, filepath, claimed)
+                claimed.add(new_path)
+            if new_path == filepath:
+                # 文件位置不变（如两个分类使用同一个文件夹），直接更新分类
+                updates.append((target_category_id, new_filename, image_id))
+            else:
+                moves.append((image_id, target_category_id, new_filename, filepath, new_path))
+        
+        cursor.executemany("UPDATE images SET category_id = ?, filename = ? WHERE id = ?", updates)
+        cursor.executemany(
+            "INSERT INTO image_moves (image_id, category_id, filename, source_path, target_path) VALUES (?, ?, ?, ?, ?)",
+            moves
+        )
+        if updates:
+            update_sort_index_for_category(target_category_id, cursor, conn)
+        conn.commit()
+        return len(updates), [move[0] for move in moves]
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+
+# 在目标文件夹中选择不冲突的文件名，返回(文件名, 路径)；claimed为已预留的路径
+def get_free_move_target(folder_path, filename, filepath, claimed=()):
+    new_filename = filename
+    new_path = os.path.join(folder_path, new_filename)
+    counter = 1
+    name, ext = os.path.splitext(filename)
+    while new_path in claimed or (new_path != filepath and get_storage().exists(new_path)):
+        new_filename = f"{name}_{counter}{ext}"
+        new_path = os.path.join(folder_path, new_filename)
+        counter += 1
+    return new_filename, new_path
+
+# 后台任务：删除图片文件及其派生文件
+def remove_image_files_job(job, files):
+    for image_id, file_path in files:
+        try:
+            if not is_file_referenced(file_path):
+                get_storage().delete(file_path)
+            for hook in derived_file_cleanup_hooks:
+                hook(image_id, file_path)
+            job.advance()
+        except Exception as e:
+            job.fail(f"{file_path}: {e}")
+
+# 后台任务：把图片文件移动到新分类的文件夹，image_ids为image_moves中的图片
+# 每张图片先复制（同一文件系统上为硬链接）到目标位置，不覆盖已有文件；每批复制完成后更新图片记录，再删除原文件。
+# 任何时刻图片记录中的路径都指向存在的文件，中断后由resume_image_moves从记录的进度继续
+def move_image_files_job(job, image_ids):
+    for batch in chunked(image_ids, IMAGE_MOVE_BATCH_SIZE):
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        placeholders = ','.join('?' * len(batch))
+        cursor.execute(
+            f"SELECT image_id, category_id, filename, source_path, target_path, copied FROM image_moves "
+            f"WHERE image_id IN ({placeholders}) ORDER BY image_id",
+            batch
+        )
+        moves = cursor.fetchall()
+        conn.close()
+        
+        # 1. 复制到目标位置，每张图片复制后立即记录，重新开始时不会把自己复制的文件当作冲突
+        copied = []
+        for image_id, category_id, filename, source_path, target_path, done in moves:
+            try:
+                if not done:
+                    filename, target_path = copy_move_target(image_id, filename, source_path, target_path)
+                copied.append((image_id, category_id, filename, source_path, target_path))
+            except Exception as e:
+                job.fail(f"{source_path}: {e}")
+                finish_image_moves([image_id])
+                job.advance()
+        
+        # 2. 在一个事务中更新图片记录；期间被删除的图片不更新，删除复制的文件
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        moved = []
+        orphaned = []
+        for image_id, category_id, filename, source_path, target_path in copied:
+            cursor.execute(
+                "UPDATE images SET category_id = ?, filename = ?, filepath = ? WHERE id = ? AND filepath = ?",
+                (category_id, filename, target_path, image_id, source_path)
+            )
+            if cursor.rowcount:
+                moved.append((image_id, source_path))
+            else:
+                cursor.execute("SELECT filepath FROM images WHERE id = ?", (image_id,))
+                row = cursor.fetchone()
+                if row and row[0] == target_path:
+                    # 上次运行时已更新
+                    moved.append((image_id, source_path))
+                else:
+                    orphaned.append(target_path)
+        for category_id in {move[1] for move in copied}:
+            update_sort_index_for_category(category_id, cursor, conn)
+        conn.commit()
+        conn.close()
+        
+        # 3. 删除原文件（托管目录中仍被其他图片使用的文件保留）和按原路径生成的派生文件
+        for target_path in orphaned:
+            if not is_file_referenced(target_path):
+                get_storage().delete(target_path)
+        for image_id, source_path in moved:
+            try:
+                if not is_file_referenced(source_path):
+                    get_storage().delete(source_path)
+                for hook in derived_file_cleanup_hooks:
+                    hook(image_id, source_path)
+            except Exception as e:
+                job.fail(f"{source_path}: {e}")
+        finish_image_moves([move[0] for move in copied])
+        job.advance(len(copied))
+
+# 把一张图片的文件复制到预留的目标位置并记录，返回(文件名, 目标路径)
+# 预留后目标位置出现了其他文件（如同时上传的同名图片）时改用新的文件名，不覆盖
+def copy_move_target(image_id, filename, source_path, target_path):
+    store = get_storage()
+    while True:
+        try:
+            store.copy(source_path, target_path, overwrite=False)
+            break
+        except FileExistsError:
+            # 托管的文件按摘要命名，已存在的文件内容相同
+            if get_managed_hash(target_path):
+                break
+        # 先预留新的文件名再复制，复制后扫描目标文件夹时不会把它当作新图片
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            cursor.execute("SELECT target_path FROM image_moves")
+            claimed = {row[0] for row in cursor.fetchall()}
+            filename, target_path = get_free_move_target(os.path.dirname(target_path), filename, source_path, claimed)
+            cursor.execute("UPDATE image_moves SET filename = ?, target_path = ? WHERE image_id = ?",
+                           (filename, target_path, image_id))
+            conn.commit()
+        finally:
+            conn.close()
+    conn = get_db_connection()
+    try:
+        conn.execute("UPDATE image_moves SET copied = 1 WHERE image_id = ?", (image_id,))
+        conn.commit()
+    finally:
+        conn.close()
+    return filename, target_path
+
+# 删除已完成（或失败）的移动记录
+def finish_image_moves(image_ids):
+    conn = get_db_connection()
+    try:
+        for chunk in chunked(image_ids):
+            conn.execute(f"DELETE FROM image_moves WHERE image_id IN ({','.join('?' * len(chunk))})", chunk)
+        conn.commit()
+    finally:
+        conn.close()
+
+# 继续移动上次运行时没有完成的图片
+def resume_image_moves():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT image_id FROM image_moves ORDER BY image_id")
+    image_ids = [row[0] for row in cursor.fetchall()]
+    conn.close()
+    if image_ids:
+        background_jobs.submit('bulk_move', move_image_files_job, image_ids, total=len(image_ids))
+
+# 批量操作图片API（删除、移动到分类）
+@app.route('/api/images/bulk', methods=['POST'])
+def bulk_images():
+    if not is_admin_logged_in():
+        return jsonify({'success': False, 'message': '需要管理员权限'})
+    
+    data = request.get_json(silent=True)
+    if data:
+        action = data.get('action')
+        raw_ids = data.get('ids')
+        target_category_id = data.get('category_id')
+    else:
+        action = request.form.get('action')
+        raw_ids = request.form.getlist('ids[]') or request.form.get('ids', '')
+        target_category_id = request.form.get('category_id')
+    
+    image_ids = parse_id_list(raw_ids)
+    if not image_ids:
+        return jsonify({'success': False, 'message': '请提供有效的图片ID列表'})
+    if len(image_ids) > MAX_BULK_IDS:
+        return jsonify({'success': False, 'message': f'一次最多操作 {MAX_BULK_IDS} 张图片'})
+    
+    try:
+        if action == 'delete':
+            deleted = bulk_delete_images(image_ids)
+            job = background_jobs.submit('bulk_delete', remove_image_files_job, deleted, total=len(deleted))
+            return jsonify({
+                'success': True,
+                'message': f'已删除 {len(deleted)} 张图片，文件将在后台清理',
+                'affected': len(deleted),
+                'job_id': job.id
+            })
+        elif action == 'move':
+            try:
+                target_category_id = int(target_category_id)
+            except (TypeError, ValueError):
+                return jsonify({'success': False, 'message': '请选择目标分类'})
+            result = bulk_move_images(image_ids, target_category_id)
+            if result is None:
+                return jsonify({'success': False, 'message': '分类不存在'})
+            updated, moves = result
+            job = background_jobs.submit('bulk_move', move_image_files_job, moves, total=len(moves))
+            return jsonify({
+                'success': True,
+                'message': f'已移动 {updated + len(moves)} 张图片，文件移动完成后图片显示在新分类中',
+                'affected': updated + len(moves),
+                'job_id': job.id
+            })
+        else:
+            return jsonify({'success': False, 'message': '不支持的操作'})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'批量操作失败: {str(e)}'})
+
+# 查询后台任务进度API
+@app.route('/api/jobs/<job_id>')
+def api_job_status(job_id):
+    if not is_admin_logged_in():
+        return jsonify({'success': False, 'message': '需要管理员权限'})
+    
+    job = background_jobs.get(job_id)
+    if not job:
+        return jsonify({'success': False, 'message': '任务不存在'})
+    return jsonify({'success': True, 'job': job.to_dict()})
+
+# 如果有待提取主色调的图片，提交后台任务（同一时间只有一个提取任务）
+# after_id为上一个任务处理到的图片id，重新排队的任务从这里继续；没有安装Pillow时不提交
+def schedule_palette_indexing(after_id=0):
+    global palette_job_active
+    if imaging.image_module() is None:
+        return None
+    with palette_job_lock:
+        if palette_job_active:
+            return None
+        palette_job_active = True
+    return background_jobs.submit('palette_index', index_palettes_job, after_id)
+
+# 后台任务：为尚未提取主色调的图片提取主色调
+# 文件夹不可用、访问超时或文件不存在的图片保持未处理，下次提交提取任务（上传、扫描或应用启动）时重试；
+# 只有读取到文件但无法解析的图片标记为已处理
+def index_palettes_job(job, after_id=0):
+    global palette_job_active
+    processed = 0
+    last_id = after_id
+    try:
+        while processed < PALETTE_IMAGES_PER_JOB:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT id, filepath FROM images WHERE palette_version IS NULL AND id > ? ORDER BY id LIMIT ?",
+                (last_id, PALETTE_BATCH_SIZE)
+            )
+            rows = cursor.fetchall()
+            conn.close()
+            if not rows:
+                break
+            
+            # 先在事务外读取图片，再一次性写入，尽量缩短持有写锁的时间
+            color_rows = []
+            done_ids = []
+            for image_id, filepath in rows:
+                try:
+                    # 本地文件在所属分类文件夹的I/O保护下读取和解码
+                    colors = guarded_io(filepath, palette.extract_palette, get_storage().image_source(filepath))
+                except OSError as e:
+                    job.fail(f"{filepath}: {str(e) or '文件夹访问超时'}")
+                    continue
+                done_ids.append(image_id)
+                if colors is None:
+                    job.fail(f"{filepath}: 无法提取主色调")
+                    continue
+                for slot, (l, a, b, weight) in enumerate(colors):
+                    color_rows.append((palette.lab_bucket((l, a, b)), image_id, slot, l, a, b, weight))
+            last_id = rows[-1][0]
+            
+            if done_ids:
+                conn = get_db_connection()
+                cursor = conn.cursor()
+                placeholders = ','.join('?' * len(done_ids))
+                cursor.execute(f"DELETE FROM image_colors WHERE image_id IN ({placeholders})", done_ids)
+                cursor.executemany("INSERT OR REPLACE INTO image_colors VALUES (?, ?, ?, ?, ?, ?, ?)", color_rows)
+                # 无法解析的图片同样标记为已处理，避免反复重试
+                cursor.execute(f"UPDATE images SET palette_version = ? WHERE id IN ({placeholders})", [PALETTE_VERSION] + done_ids)
+                conn.commit()
+                conn.close()
+            
+            processed += len(rows)
+            job.advance(len(rows))
+    finally:
+        with palette_job_lock:
+            palette_job_active = False
+    
+    # 还有剩余（或任务运行期间新增）的图片时重新排队，跳过的图片不在这里重试
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM images WHERE palette_version IS NULL AND id > ? LIMIT 1", (last_id,))
+    pending = cursor.fetchone()
+    conn.close()
+    if pending:
+        schedule_palette_indexing(last_id)
+
+# 动图转码结果的本地路径
+def get_animation_path(image_id, variant):
+    return os.path.join(ANIMATION_FOLDER, f"{image_id}{ANIMATION_VARIANTS[variant][0]}")
+
+# 返回图片已有的转码结果名称（只检查GIF）
+def get_animation_variants(image_id, filepath):
+    if not filepath.lower().endswith('.gif'):
+        return []
+    return [variant for variant in ANIMATION_VARIANTS if os.path.exists(get_animation_path(image_id, variant))]
+
+# 发送动图的转码结果：variant参数指定mp4、webp或poster时发送对应的结果；
+# variant=auto（页面上显示图片时使用）在客户端的Accept中明确包含image/webp时发送动画WebP。
+# 没有variant参数时不协商，原图地址始终返回原文件（下载时得到的就是原图）。
+# 没有对应的转码结果时返回None，由调用者发送原图
+def serve_animation_variant(image_id):
+    variant = request.args.get('variant', '', type=str)
+    if variant == 'auto':
+        # image/*和*/*不算支持WebP（不支持WebP的旧浏览器也会发送）
+        if not any(value == 'image/webp' and quality > 0 for value, quality in request.accept_mimetypes):
+            return None
+        variant = 'webp'
+    elif variant not in ANIMATION_VARIANTS:
+        return None
+    path = get_animation_path(image_id, variant)
+    if not os.path.exists(path):
+        return None
+    # 与原图共用发送中字节数的上限，响应发送完毕后释放额度
+    file_size = os.path.getsize(path)
+    limiter = get_in_flight_limiter()
+    if not limiter.acquire(file_size):
+        return reject_response(503, '服务器繁忙，请稍后再试', 1, 'originals', 'in_flight_bytes')
+    try:
+        response = send_from_directory(ANIMATION_FOLDER, os.path.basename(path), mimetype=ANIMATION_VARIANTS[variant][1])
+    except Exception:
+        limiter.release(file_size)
+        raise
+    # 直接传递的文件响应在发送完毕时不会调用call_on_close注册的函数
+    response.direct_passthrough = False
+    response.call_on_close(lambda: limiter.release(file_size))
+    if app.config.get('VIEW_COUNTING_ENABLED') and variant != 'poster':
+        view_counter.record(image_id)
+    metrics.inc('wallpaper_served_bytes_total', file_size)
+    if request.args.get('variant') == 'auto':
+        response.vary.add('Accept')
+    return response
+
+# 删除图片的转码结果（图片仍在数据库中时只是移动了位置，内容不变，保留转码结果）
+def remove_animation_variants(image_id, filepath):
+    paths = [get_animation_path(image_id, variant) for variant in ANIMATION_VARIANTS]
+    if not any(os.path.exists(path) for path in paths):
+        return
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM images WHERE id = ?", (image_id,))
+    exists = cursor.fetchone()
+    conn.close()
+    if exists:
+        return
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+derived_file_cleanup_hooks.append(remove_animation_variants)
+
+# 如果有待转码的GIF，提交后台任务（同一时间只有一个转码任务）
+def schedule_animation_transcoding():
+    global animation_job_active
+    if not app.config['ANIMATION_VARIANTS_ENABLED']:
+        return None
+    with animation_job_lock:
+        if animation_job_active:
+            return None
+        animation_job_active = True
+    return background_jobs.submit('animation', transcode_animations_job)
+
+# 转码一张GIF，返回保留的转码结果名称列表；不是动图时不转码，转码结果不比原图小时不保留
+def transcode_animation(image_id, filepath):
+    store = get_storage()
+    original_size = store.stat(filepath)[0]
+    # 对象存储中的图片一次读入内存（BytesIO），每次使用前回到开头
+    source = store.image_source(filepath)
+    def rewind():
+        if not isinstance(source, str):
+            source.seek(0)
+        return source
+    
+    if not animation.is_animated(rewind()):
+        return []
+    
+    created = []
+    def keep_if_smaller(variant):
+        target = get_animation_path(image_id, variant)
+        if os.path.getsize(target) < original_size:
+            created.append(variant)
+        else:
+            os.remove(target)
+    
+    animation.transcode_webp(rewind(), get_animation_path(image_id, 'webp'))
+    keep_if_smaller('webp')
+    
+    ffmpeg = animation.find_ffmpeg() if app.config['ANIMATION_MP4_ENABLED'] else None
+    if ffmpeg:
+        local_path, temp_path = source, None
+        if not isinstance(source, str):
+            # ffmpeg需要本地文件，对象存储中的图片先写入临时文件
+            with tempfile.NamedTemporaryFile(suffix='.gif', delete=False) as f:
+                f.write(source.getvalue())
+            local_path = temp_path = f.name
+        try:
+            animation.transcode_mp4(local_path, get_animation_path(image_id, 'mp4'), ffmpeg)
+            keep_if_smaller('mp4')
+        except Exception as e:
+            print(f"转为MP4失败 {filepath}: {e}")
+        finally:
+            if temp_path:
+                os.remove(temp_path)
+    
+    if created:
+        animation.render_poster(rewind(), get_animation_path(image_id, 'poster'))
+        created.append('poster')
+    return created
+
+# 后台任务：转码尚未处理的GIF
+def transcode_animations_job(job):
+    global animation_job_active
+    processed = 0
+    try:
+        while processed < ANIMATION_IMAGES_PER_JOB:
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT id, filepath FROM images WHERE animation_version IS NULL AND filepath LIKE '%.gif' ORDER BY id LIMIT ?",
+                (ANIMATION_BATCH_SIZE,)
+            )
+            rows = cursor.fetchall()
+            conn.close()
+            if not rows:
+                break
+            
+            for image_id, filepath in rows:
+                try:
+                    transcode_animation(image_id, filepath)
+                except Exception as e:
+                    job.fail(f"{filepath}: {e}")
+            
+            # 转码失败的图片同样标记为已处理，避免反复重试
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            ids = [row[0] for row in rows]
+            placeholders = ','.join('?' * len(ids))
+            cursor.execute(f"UPDATE images SET animation_version = ? WHERE id IN ({placeholders})", [ANIMATION_VERSION] + ids)
+            conn.commit()
+            conn.close()
+            
+            processed += len(rows)
+            job.advance(len(rows))
+    finally:
+        with animation_job_lock:
+            animation_job_active = False
+    
+    # 还有剩余（或任务运行期间新增）的GIF时重新排队
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT 1 FROM images WHERE animation_version IS NULL AND filepath LIKE '%.gif' LIMIT 1")
+    pending = cursor.fetchone()
+    conn.close()
+    if pending:
+        schedule_animation_transcoding()
+
+# 一致性检查：本进程的检查线程、租约的持有者标识，以及按文件数和字节数限速的限速器
+integrity_sweeper = None
+integrity_owner = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+integrity_throttles = None
+
+def get_integrity_throttles():
+    global integrity_throttles
+    if integrity_throttles is None:
+        integrity_throttles = (
+            integrity.Throttle(app.config['INTEGRITY_FILES_PER_SECOND']),
+            integrity.Throttle(app.config['INTEGRITY_BYTES_PER_SECOND'])
+        )
+    return integrity_throttles
+
+# 获取或续期一致性检查的租约，其他进程持有未过期的租约时返回False；调用者负责提交
+def claim_integrity_lease(cursor):
+    now = time.time()
+    cursor.execute(
+        "UPDATE integrity_checkpoint SET owner = ?, lease_until = ? "
+        "WHERE id = 1 AND (owner IS NULL OR owner = ? OR lease_until < ?)",
+        (integrity_owner, now + INTEGRITY_LEASE_SECONDS, integrity_owner, now)
+    )
+    return cursor.rowcount > 0
+
+# 检查一张图片的文件，返回(结果, 数据)：
+# ('ok', None)、('baseline', 修改时间)、('repair', (大小, 宽, 高, 修改时间))、('issue', (问题, 说明))
+# 文件夹暂时不可用（断路或超时）时抛出异常，由调用者稍后重试
+def check_image_file(filepath, file_size, file_mtime, content_hash):
+    file_throttle, byte_throttle = get_integrity_throttles()
+    store = get_storage()
+    file_throttle.consume()
+    try:
+        size, mtime = store.stat(filepath)
+    except (iohealth.FolderUnavailable, TimeoutError):
+        raise
+    except FileNotFoundError:
+        return 'issue', ('missing', None)
+    except OSError as e:
+        return 'issue', ('unreadable', str(e))
+    
+    result = 'ok', None
+    if size != file_size or (file_mtime is not None and abs(mtime - file_mtime) > 0.001):
+        # 文件被替换或修改过，重新读取尺寸；文件夹不可用时异常直接抛出，不记为无法读取
+        byte_throttle.consume(min(size, METADATA_HEAD_BYTES))
+        width = height = None
+        if imaging.image_module() is not None:
+            width, height = read_image_dimensions(filepath, size)
+            if width is None:
+                return 'issue', ('unreadable', '无法读取图片尺寸')
+        result = 'repair', (size, width, height, mtime)
+    elif file_mtime is None:
+        # 第一次检查，只记录修改时间
+        result = 'baseline', mtime
+    
+    if content_hash and app.config['INTEGRITY_VERIFY_HASH']:
+        try:
+            actual_hash = integrity.hash_file(store.open, filepath, byte_throttle)
+        except (iohealth.FolderUnavailable, TimeoutError):
+            raise
+        except OSError as e:
+            return 'issue', ('unreadable', str(e))
+        if actual_hash != content_hash:
+            return 'issue', ('hash_mismatch', f"实际摘要 {actual_hash}")
+    return result
+
+# 检查下一批图片并保存检查点，返回下次调用前等待的秒数（由检查线程反复调用）
+def check_integrity_batch():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("SELECT last_id, next_pass_at FROM integrity_checkpoint WHERE id = 1")
+        last_id, next_pass_at = cursor.fetchone()
+        if last_id == 0 and time.time() < next_pass_at:
+            return min(next_pass_at - time.time(), INTEGRITY_LEASE_SECONDS)
+        claimed = claim_integrity_lease(cursor)
+        if claimed and last_id == 0:
+            # 开始新的一轮
+            cursor.execute(
+                "UPDATE integrity_checkpoint SET pass_started_at = CURRENT_TIMESTAMP, checked = 0, repaired = 0, flagged = 0 "
+                "WHERE id = 1"
+            )
+        conn.commit()
+        if not claimed:
+            # 其他进程正在检查
+            return INTEGRITY_LEASE_SECONDS / 2
+        
+        # 正在后台删除的分类（分类记录已删除）中的图片不检查
+        cursor.execute('''
+            SELECT i.id, i.filepath, i.file_size, i.file_mtime, i.content_hash
+            FROM images i JOIN categories c ON c.id = i.category_id
+            WHERE i.id > ? ORDER BY i.id LIMIT ?
+        ''', (last_id, INTEGRITY_BATCH_SIZE))
+        rows = cursor.fetchall()
+        
+        if not rows:
+            # 一轮检查完成，INTEGRITY_PASS_INTERVAL秒后从头开始下一轮
+            cursor.execute(
+                "UPDATE integrity_checkpoint SET last_id = 0, passes = passes + 1, pass_finished_at = CURRENT_TIMESTAMP, "
+                "next_pass_at = ? WHERE id = 1 AND owner = ?",
+                (time.time() + app.config['INTEGRITY_PASS_INTERVAL'], integrity_owner)
+            )
+            conn.commit()
+            return 0
+    finally:
+        conn.close()
+    
+    # 在事务外检查文件，再把本批的结果和检查点一起写入
+    baselines = []
+    repairs = []
+    issues = []
+    ok_ids = []
+    checked_id = last_id
+    lease_renew_at = time.monotonic() + INTEGRITY_LEASE_SECONDS / 2
+    for image_id, filepath, file_size, file_mtime, content_hash in rows:
+        if time.monotonic() >= lease_renew_at:
+            # 检查较慢（如校验大文件的摘要）时在中途续期
+            conn = get_db_connection()
+            claimed = claim_integrity_lease(conn.cursor())
+            conn.commit()
+            conn.close()
+            if not claimed:
+                return INTEGRITY_LEASE_SECONDS / 2
+            lease_renew_at = time.monotonic() + INTEGRITY_LEASE_SECONDS / 2
+        try:
+            result, data = check_image_file(filepath, file_size, file_mtime, content_hash)
+        except (iohealth.FolderUnavailable, TimeoutError) as e:
+            # 文件夹暂时不可用（断路器断开后立即失败），记为问题后继续检查其他文件夹中的图片，下一轮再检查
+            result, data = 'issue', ('unavailable', str(e) or '文件夹访问超时')
+        checked_id = image_id
+        if result == 'issue':
+            issues.append((image_id, data[0], data[1]))
+            continue
+        ok_ids.append(image_id)
+        if result == 'baseline':
+            baselines.append((data, image_id, filepath))
+        elif result == 'repair':
+            repairs.append(data + (image_id, filepath))
+    
+    if checked_id == last_id:
+        return 0
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        if not claim_integrity_lease(cursor):
+            # 租约已过期并被其他进程接手，放弃本批结果
+            conn.rollback()
+            return INTEGRITY_LEASE_SECONDS / 2
+        # 检查期间图片被移动时（路径不同）不更新，下一轮再检查
+        cursor.executemany("UPDATE images SET file_mtime = ? WHERE id = ? AND filepath = ?", baselines)
+        # 文件内容变化后重新提取主色调和转码动图
+        cursor.executemany('''
+            UPDATE images SET file_size = ?, width = ?, height = ?, file_mtime = ?, palette_version = NULL, animation_version = NULL
+            WHERE id = ? AND filepath = ?
+        ''', repairs)
+        cursor.executemany('''
+            INSERT INTO integrity_issues (image_id, issue, detail) VALUES (?, ?, ?)
+            ON CONFLICT (image_id) DO UPDATE SET issue = excluded.issue, detail = excluded.detail
+        ''', issues)
+        for ids in chunked(ok_ids):
+            cursor.execute(f"DELETE FROM integrity_issues WHERE image_id IN ({','.join('?' * len(ids))})", ids)
+        cursor.execute(
+            "UPDATE integrity_checkpoint SET last_id = ?, checked = checked + ?, repaired = repaired + ?, flagged = flagged + ? "
+            "WHERE id = 1",
+            (checked_id, len(ok_ids) + len(issues), len(repairs), len(issues))
+        )
+        conn.commit()
+    finally:
+        conn.close()
+    
+    if repairs:
+        # 原来的转码结果对应旧的文件内容
+        for image_id in {row[4] for row in repairs}:
+            for variant in ANIMATION_VARIANTS:
+                try:
+                    os.remove(get_animation_path(image_id, variant))
+                except FileNotFoundError:
+                    pass
+        schedule_palette_indexing()
+        schedule_animation_transcoding()
+    return 0
+
+# 启动本进程的一致性检查线程（INTEGRITY_SWEEP_ENABLED为False时不启动）
+def start_integrity_sweeper():
+    global integrity_sweeper
+    if not app.config['INTEGRITY_SWEEP_ENABLED']:
+        return None
+    if integrity_sweeper is None:
+        integrity_sweeper = integrity.Sweeper(check_integrity_batch)
+    integrity_sweeper.start()
+    return integrity_sweeper
+
+# 一致性检查的进度和发现的问题（最近发现的limit个），用于管理面板和状态接口
+def get_integrity_status(limit=20):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT last_id, checked, repaired, flagged, passes, pass_started_at, pass_finished_at, next_pass_at, owner, lease_until
+        FROM integrity_checkpoint WHERE id = 1
+    ''')
+    (last_id, checked, repaired, flagged, passes, pass_started_at, pass_finished_at,
+     next_pass_at, owner, lease_until) = cursor.fetchone()
+    cursor.execute("SELECT MAX(id) FROM images")
+    max_id = cursor.fetchone()[0] or 0
+    cursor.execute("SELECT issue, COUNT(*) FROM integrity_issues GROUP BY issue")
+    issue_counts = dict(cursor.fetchall())
+    cursor.execute('''
+        SELECT ii.image_id, ii.issue, ii.detail, ii.detected_at, i.filename, i.filepath, c.name
+        FROM integrity_issues ii
+        JOIN images i ON i.id = ii.image_id
+        LEFT JOIN categories c ON c.id = i.category_id
+        ORDER BY ii.detected_at DESC, ii.image_id DESC LIMIT ?
+    ''', (limit,))
+    issues = [{
+        'image_id': image_id,
+        'issue': issue,
+        'detail': detail,
+        'detected_at': format_upload_time(detected_at),
+        'filename': filename,
+        'filepath': filepath,
+        'category': category_name
+    } for image_id, issue, detail, detected_at, filename, filepath, category_name in cursor.fetchall()]
+    conn.close()
+    now = time.time()
+    return {
+        'enabled': app.config['INTEGRITY_SWEEP_ENABLED'],
+        'running': bool(owner) and lease_until > now and (last_id > 0 or next_pass_at <= now),
+        'last_id': last_id,
+        'max_id': max_id,
+        'progress': round(min(last_id / max_id, 1.0), 4) if max_id else 0,
+        'checked': checked,
+        'repaired': repaired,
+        'flagged': flagged,
+        'passes': passes,
+        'pass_started_at': format_upload_time(pass_started_at),
+        'pass_finished_at': format_upload_time(pass_finished_at),
+        'next_pass_in': max(int(next_pass_at - now), 0) if last_id == 0 else 0,
+        'issue_counts': issue_counts,
+        'issues': issues
+    }
+
+# 一致性检查状态API（管理员用），limit为返回的问题数（最多500）
+@app.route('/api/admin/integrity')
+def api_integrity_status():
+    if not is_admin_logged_in():
+        return jsonify({'success': False, 'message': '需要管理员权限'})
+    limit = min(max(request.args.get('limit', 20, type=int), 0), 500)
+    return jsonify({'success': True, 'integrity': get_integrity_status(limit)})
+
+# 按颜色搜索：在相邻的颜色桶中查找候选图片，按与目标颜色的距离（结合该颜色在图片中的占比）排序
+def search_images_by_color(lab, category_ids, limit=50):
+    if not category_ids:
+        return []
+    category_list = ','.join(str(int(category_id)) for category_id in category_ids)
+    params = {'l': lab[0], 'a': lab[1], 'b': lab[2], 'limit': limit}
+    
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    results = []
+    # 先搜索相邻的桶，结果不够时扩大范围
+    for radius in (1, 2):
+        bucket_list = ','.join(str(bucket) for bucket in palette.neighbor_buckets(lab, radius))
+        cursor.execute(f'''
+            SELECT c.image_id,
+                   MIN(((c.l - :l) * (c.l - :l) + (c.a - :a) * (c.a - :a) + (c.b - :b) * (c.b - :b))
+                       * (1.5 - c.weight)) AS score
+            FROM image_colors c
+            JOIN images i ON i.id = c.image_id
+            WHERE c.bucket IN ({bucket_list}) AND i.category_id IN ({category_list})
+            GROUP BY c.image_id
+            ORDER BY score
+            LIMIT :limit
+        ''', params)
+        results = cursor.fetchall()
+        if len(results) >= limit:
+            break
+    conn.close()
+    return results
+
+# 处理时间戳，将数据库中的UTC时间转换为UTC+8时间
+def format_upload_time(upload_time):
+    if isinstance(upload_time, str):
+        try:
+            dt = datetime.strptime(upload_time, '%Y-%m-%d %H:%M:%S')
+            # 数据库中的时间是UTC时间
+            return dt.replace(tzinfo=timezone.utc).astimezone(DISPLAY_TIMEZONE).strftime('%Y-%m-%d %H:%M:%S')
+        except ValueError:
+            # 如果解析失败，保持原格式
+            pass
+    return upload_time
+
+# 按颜色搜索图片API，例如 /api/search?color=%232a6fdb
+@app.route('/api/search')
+def api_search():
+    rgb = palette.parse_hex_color(request.args.get('color', '', type=str))
+    if rgb is None:
+        return jsonify({'success': False, 'message': '请提供有效的颜色，例如 #2a6fdb'})
+    
+    limit = request.args.get('limit', 50, type=int)
+    limit = min(max(limit, 1), 100)
+    
+    category_ids = get_accessible_category_ids()
+    category_id = request.args.get('category', type=int)
+    if category_id is not None:
+        if category_id not in category_ids:
+            return jsonify({'success': False, 'message': '您没有权限访问该分类'})
+        category_ids = {category_id}
+    
+    try:
+        with timed_phase('query'):
+            matches = search_images_by_color(palette.rgb_to_lab(rgb), category_ids, limit)
+        
+        images = []
+        if matches:
+            ids = [match[0] for match in matches]
+            placeholders = ','.join('?' * len(ids))
+            conn = get_db_connection()
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT id, filename, filepath, upload_time, file_size, width, height, category_id
+                FROM images WHERE id IN ({placeholders})
+            ''', ids)
+            rows = {row[0]: row for row in cursor.fetchall()}
+            conn.close()
+            
+            # 按匹配程度排序返回
+            for image_id in ids:
+                row = rows.get(image_id)
+                if not row:
+                    continue
+                images.append({
+                    'id': row[0],
+                    'filename': row[1],
+                    'filepath': url_for('serve_uploads', filename=get_upload_rel_path(row[2])),
+                    'upload_time': format_upload_time(row[3]),
+                    'size': row[4],
+                    'width': row[5],
+                    'height': row[6],
+                    'category_id': row[7]
+                })
+        
+        return json_response({'success': True, 'color': '#%02x%02x%02x' % rgb, 'images': images})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'搜索失败: {str(e)}'})
+
+# 计算拼图文件名：包含该页图片的id和文件大小的摘要，图片增删、排序变化或文件被替换后文件名随之改变，旧拼图自然失效
+def get_sprite_name(category_id, page, per_page, sort_direction, rows):
+    digest = hashlib.sha1(','.join(f"{row[0]}:{row[5]}" for row in rows).encode()).hexdigest()[:16]
+    return f"{category_id}/{sort_direction}-{per_page}-{page}-{digest}.jpg"
+
+# 后台任务：生成拼图，并删除同一页的旧拼图
+def build_sprite_job(job, sprite_name, file_paths):
+    try:
+        sprite_path = os.path.join(SPRITE_FOLDER, sprite_name)
+        failed = sprites.render_sprite(file_paths, sprite_path, open_file=open_thumbnail_source)
+        for file_path in failed:
+            job.fail(f"{file_path}: 无法生成缩略图")
+        job.advance(len(file_paths) - len(failed))
+        
+        folder, current_name = os.path.split(sprite_path)
+        prefix = current_name.rsplit('-', 1)[0] + '-'
+        for name in os.listdir(folder):
+            if name.startswith(prefix) and name != current_name:
+                try:
+                    os.remove(os.path.join(folder, name))
+                except OSError:
+                    pass
+    finally:
+        with sprite_jobs_lock:
+            pending_sprites.pop(sprite_name, None)
+
+# 生成缩略图使用的文件：已转码的动图使用本地保存的封面，不需要读取整个GIF
+def get_thumbnail_source_path(image_id, filepath):
+    if filepath.lower().endswith('.gif'):
+        poster = get_animation_path(image_id, 'poster')
+        if os.path.exists(poster):
+            return poster
+    return filepath
+
+# 打开生成缩略图的文件：封面在本地，其他图片从存储后端读取
+def open_thumbnail_source(file_path):
+    if os.path.dirname(file_path) == ANIMATION_FOLDER:
+        return file_path
+    return get_storage().image_source(file_path)
+
+# 提交拼图生成任务，同一拼图正在生成时返回已有的任务
+def schedule_sprite_build(sprite_name, file_paths):
+    # 提交和登记都在锁内完成，任务结束时的清理会等待登记完成
+    with sprite_jobs_lock:
+        job = pending_sprites.get(sprite_name)
+        if job is None:
+            job = background_jobs.submit('sprite', build_sprite_job, sprite_name, file_paths, total=len(file_paths))
+            pending_sprites[sprite_name] = job
+    return job
+
+# 分类概览拼图API：返回一页图片的拼图地址和每个缩略图的偏移量
+# 拼图尚未生成时提交后台任务并返回ready=false，偏移量不依赖拼图文件，可以先行布局
+@app.route('/api/sprites/<int:category_id>')
+def api_sprites(category_id):
+    if category_id not in get_accessible_category_ids():
+        return jsonify({'success': False, 'message': '您没有权限访问该分类'})
+    
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = request.args.get('per_page', 100, type=int)
+    per_page = min(max(per_page, 1), SPRITE_MAX_PER_PAGE)
+    sort_direction = 'asc' if request.args.get('sort', 'desc', type=str) == 'asc' else 'desc'
+    
+    try:
+        result = get_images_by_category(category_id, page, per_page, '', sort_direction)
+        rows = result['images']
+        
+        sprite_url = None
+        ready = False
+        job_id = None
+        if rows:
+            sprite_name = get_sprite_name(category_id, page, per_page, sort_direction, rows)
+            sprite_url = url_for('serve_sprite', filename=sprite_name)
+            ready = os.path.exists(os.path.join(SPRITE_FOLDER, sprite_name))
+            if not ready:
+                job_id = schedule_sprite_build(sprite_name, [get_thumbnail_source_path(row[0], row[2]) for row in rows]).id
+        
+        sprite_width, sprite_height = sprites.sprite_size(len(rows))
+        tiles = []
+        for row, (x, y) in zip(rows, sprites.tile_offsets(len(rows))):
+            tiles.append({
+                'id': row[0],
+                'filename': row[1],
+                'filepath': url_for('serve_uploads', filename=get_upload_rel_path(row[2])),
+                'x': x,
+                'y': y
+            })
+        
+        return json_response({
+            'success': True,
+            'ready': ready,
+            'job_id': job_id,
+            'sprite_url': sprite_url,
+            'sprite_width': sprite_width,
+            'sprite_height': sprite_height,
+            'tile_width': sprites.TILE_WIDTH,
+            'tile_height': sprites.TILE_HEIGHT,
+            'tiles': tiles,
+            'total_pages': result['total_pages'],
+            'current_page': result['current_page'],
+            'total_count': result['total_count']
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取拼图失败: {str(e)}'})
+
+# 提供拼图文件：文件名包含内容摘要，可以长期缓存
+@app.route('/sprites/<path:filename>')
+def serve_sprite(filename):
+    category_part = filename.split('/', 1)[0]
+    if not category_part.isdigit() or int(category_part) not in get_accessible_category_ids():
+        return "无权访问", 403
+    response = send_from_directory(SPRITE_FOLDER, filename, max_age=365 * 24 * 3600)
+    # 拼图属于有访问权限的分类，只允许浏览器缓存，不允许共享缓存（CDN、代理）保存后发给其他用户
+    response.cache_control.public = False
+    response.cache_control.private = True
+    response.cache_control.immutable = True
+    response.vary.add('Cookie')
+    return response
+
+# 分类概览页面：用拼图显示整个分类
+@app.route('/category/<int:category_id>/overview')
+def category_overview(category_id):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    cursor.execute("SELECT id, name FROM categories WHERE id = ?", (category_id,))
+    category = cursor.fetchone()
+    conn.close()
+    
+    if not category:
+        return "分类不存在", 404
+    if category_id not in get_accessible_category_ids():
+        if not is_user_logged_in() and not is_admin_logged_in():
+            return redirect(url_for('user_login'))
+        return "您没有权限访问该分类", 403
+    
+    return render_template('category_overview.html', category_id=category_id, category_name=category[1])
+
+# 时间段之后的第一个键（按字符串比较，day >= 该键即比时间段更早的日期之后的所有日期）
+def next_timeline_key(key):
+    if len(key) == 4:
+        return str(int(key) + 1)
+    if len(key) == 7:
+        year, month = int(key[:4]), int(key[5:])
+        return f"{year + 1}-01" if month == 12 else f"{year}-{month + 1:02d}"
+    return (datetime.strptime(key, '%Y-%m-%d') + timedelta(days=1)).strftime('%Y-%m-%d')
+
+# 时间段键（页面显示的日期）转换为数据库中的UTC时间字符串
+def timeline_key_to_utc(key):
+    local = datetime.strptime((key + '-01-01')[:10], '%Y-%m-%d')
+    return (local - timedelta(hours=TIMELINE_UTC_OFFSET_HOURS)).strftime('%Y-%m-%d %H:%M:%S')
+
+# 时间轴API：按年、月或日返回分类中各时间段的图片数，从新到旧排列
+# within限定范围（如 within=2025 返回2025年各月）；offset为该时间段第一张图片在按上传时间降序排列的列表中的位置，
+# page为 /api/images/<分类ID>?sort=upload_time&order=desc&per_page=<per_page> 中对应的页码
+@app.route('/api/timeline/<int:category_id>')
+def api_timeline(category_id):
+    if category_id not in get_accessible_category_ids():
+        return jsonify({'success': False, 'message': '您没有权限访问该分类'})
+    
+    granularity = request.args.get('granularity', 'month', type=str)
+    within = request.args.get('within', '', type=str)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+    if granularity not in TIMELINE_GRANULARITIES:
+        return jsonify({'success': False, 'message': 'granularity只能是year、month或day'})
+    key_length = TIMELINE_GRANULARITIES[granularity]
+    if within and (not TIMELINE_KEY_PATTERN.match(within) or len(within) >= key_length):
+        return jsonify({'success': False, 'message': 'within格式错误'})
+    
+    lower = within
+    upper = next_timeline_key(within) if within else '~'
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        # 范围之后（更新）的图片数，作为第一个时间段的位置
+        cursor.execute(
+            "SELECT COALESCE(SUM(image_count), 0) FROM image_date_buckets WHERE category_id = ? AND day >= ?",
+            (category_id, upper)
+        )
+        offset = cursor.fetchone()[0]
+        cursor.execute('''
+            SELECT substr(day, 1, ?), SUM(image_count) FROM image_date_buckets
+            WHERE category_id = ? AND day >= ? AND day < ?
+            GROUP BY 1 ORDER BY 1 DESC
+        ''', (key_length, category_id, lower, upper))
+        buckets = []
+        for key, count in cursor.fetchall():
+            buckets.append({'key': key, 'count': count, 'offset': offset, 'page': offset // per_page + 1})
+            offset += count
+    finally:
+        conn.close()
+    
+    return json_response({'success': True, 'granularity': granularity, 'within': within, 'per_page': per_page, 'buckets': buckets})
+
+# 时间轴跳转API：返回指定日期（年、月或日）或其之前最近的一张图片，以及它在按上传时间降序排列的列表中的位置和页码
+@app.route('/api/timeline/<int:category_id>/jump')
+def api_timeline_jump(category_id):
+    if category_id not in get_accessible_category_ids():
+        return jsonify({'success': False, 'message': '您没有权限访问该分类'})
+    
+    key = request.args.get('to', '', type=str)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+    if not TIMELINE_KEY_PATTERN.match(key):
+        return jsonify({'success': False, 'message': '日期格式应为YYYY、YYYY-MM或YYYY-MM-DD'})
+    try:
+        end_key = next_timeline_key(key)
+        end_time = timeline_key_to_utc(end_key)
+    except ValueError:
+        return jsonify({'success': False, 'message': '日期无效'})
+    
+    conn = get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT COALESCE(SUM(image_count), 0) FROM image_date_buckets WHERE category_id = ? AND day >= ?",
+            (category_id, end_key)
+        )
+        offset = cursor.fetchone()[0]
+        # 使用(category_id, upload_time)索引定位该时间段内（或之前）最新的图片
+        cursor.execute('''
+            SELECT id, upload_time FROM images WHERE category_id = ? AND upload_time < ?
+            ORDER BY upload_time DESC, id DESC LIMIT 1
+        ''', (category_id, end_time))
+        image = cursor.fetchone()
+    finally:
+        conn.close()
+    
+    if not image:
+        return jsonify({'success': False, 'message': '该日期之前没有图片'})
+    return json_response({
+        'success': True,
+        'image_id': image[0],
+        'upload_time': format_upload_time(image[1]),
+        'offset': offset,
+        'page': offset // per_page + 1,
+        'index_in_page': offset % per_page,
+        'per_page': per_page
+    })
+
+# 动态的分页游标：上一页最后一张图片的(上传时间, ID)，编码为URL安全的字符串
+def encode_feed_cursor(upload_time, image_id):
+    return base64.urlsafe_b64encode(f"{upload_time}|{image_id}".encode('utf-8')).decode('ascii').rstrip('=')
+
+# 解析分页游标，格式错误时返回None
+def decode_feed_cursor(value):
+    try:
+        text = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4)).decode('utf-8')
+        upload_time, image_id = text.rsplit('|', 1)
+        return upload_time, int(image_id)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+# 按(上传时间, ID)降序分批读取图片，before为游标位置（不包含），每批读取的行数从batch_size起逐批加倍
+# 指定分类时使用分类的上传时间索引，否则使用全局的上传时间索引；没有上传时间的图片不在动态中出现
+def iter_feed_rows(conn, before, batch_size, category_id=None):
+    if category_id is None:
+        index, conditions, params = 'idx_images_upload_time', [], []
+    else:
+        index, conditions, params = 'idx_images_category_upload_time', ['category_id = ?'], [category_id]
+    while True:
+        where = conditions + ['upload_time IS NOT NULL']
+        if before is not None:
+            where.append('(upload_time, id) < (?, ?)')
+        rows = conn.execute(f"""
+            SELECT id, filename, filepath, upload_time, file_size, width, height, category_id
+            FROM images INDEXED BY {index}
+            WHERE {' AND '.join(where)}
+            ORDER BY upload_time DESC, id DESC
+            LIMIT ?
+        """, params + (list(before) if before is not None else []) + [batch_size]).fetchall()
+        yield from rows
+        if len(rows) < batch_size:
+            return
+        before = (rows[-1][3], rows[-1][0])
+        batch_size = min(batch_size * 2, FEED_MAX_BATCH)
+
+# 返回可访问分类中按上传时间从新到旧排列、位于游标之后的最多limit张图片
+# 每项为(id, filename, filepath, upload_time, file_size, width, height, category_id)
+def get_feed_page(category_ids, before, limit):
+    conn = get_db_connection()
+    try:
+        counts = dict(conn.execute("SELECT category_id, image_count FROM category_stats WHERE image_count > 0").fetchall())
+        accessible = sorted(category_id for category_id in category_ids if counts.get(category_id))
+        if not accessible:
+            return []
+        visible = sum(counts[category_id] for category_id in accessible)
+        total = sum(counts.values())
+        if visible >= total * FEED_GLOBAL_SCAN_MIN_SHARE:
+            # 平均每读取 total / visible 行得到一张可访问的图片
+            allowed = set(accessible)
+            batch_size = min(max(-(-limit * total // visible), FEED_MIN_BATCH), FEED_MAX_BATCH)
+            rows = (row for row in iter_feed_rows(conn, before, batch_size) if row[7] in allowed)
+        else:
+            # 每个分类先读取一小批，需要时再继续读取，总读取量约为limit加上每个分类的第一批
+            batch_size = min(max(-(-limit // len(accessible)), FEED_MIN_BATCH), limit)
+            rows = heapq.merge(
+                *(iter_feed_rows(conn, before, batch_size, category_id) for category_id in accessible),
+                key=lambda row: (row[3], row[0]), reverse=True
+            )
+        return list(itertools.islice(rows, limit))
+    finally:
+        conn.close()
+
+# 最新图片动态：返回当前用户所有可访问分类中最新上传的图片，从新到旧排列
+# 使用游标分页：下一页请求传入上一页返回的next_cursor（before参数），没有更多图片时next_cursor为null
+@app.route('/api/feed')
+def api_feed():
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+    before = None
+    raw_cursor = request.args.get('before', '', type=str)
+    if raw_cursor:
+        before = decode_feed_cursor(raw_cursor)
+        if before is None:
+            return jsonify({'success': False, 'message': '分页游标格式错误'})
+    
+    try:
+        with timed_phase('query'):
+            # 多读取一张，用于判断是否还有下一页
+            rows = get_feed_page(get_accessible_category_ids(), before, per_page + 1)
+        has_more = len(rows) > per_page
+        rows = rows[:per_page]
+        images = [{
+            'id': row[0],
+            'filename': row[1],
+            'filepath': url_for('serve_uploads', filename=get_upload_rel_path(row[2])),
+            'upload_time': format_upload_time(row[3]),
+            'size': row[4],
+            'width': row[5],
+            'height': row[6],
+            'category_id': row[7]
+        } for row in rows]
+        
+        with timed_phase('serialize'):
+            return json_response({
+                'success': True,
+                'images': images,
+                'next_cursor': encode_feed_cursor(rows[-1][3], rows[-1][0]) if has_more else None
+            })
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'查询失败: {str(e)}'})
+
+# 读取图片目录的版本号
+def get_catalog_version(cursor):
+    cursor.execute("SELECT version FROM catalog_version WHERE id = 1")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+# 从数据库加载标签位图快照
+def load_tag_snapshot():
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    snapshot = tagindex.TagSnapshot.load(cursor)
+    conn.close()
+    return snapshot
+
+# 后台任务：更新标签位图快照，只应用catalog_changes中快照之后的变化，变化记录不完整时重新加载（不会用旧数据覆盖更新的快照）
+def rebuild_tag_index_job(job):
+    global tag_snapshot, tag_rebuild_pending
+    try:
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor()
+            snapshot = tag_snapshot.load_changes(cursor) if tag_snapshot is not None else None
+            if snapshot is None:
+                snapshot = tagindex.TagSnapshot.load(cursor)
+            # 清理较早的变化记录
+            cursor.execute("DELETE FROM catalog_changes WHERE version <= ?", (snapshot.version - CATALOG_CHANGES_RETAINED,))
+            conn.commit()
+        finally:
+            conn.close()
+        with tag_index_lock:
+            if tag_snapshot is None or snapshot.version >= tag_snapshot.version:
+                tag_snapshot = snapshot
+    finally:
+        with tag_index_lock:
+            tag_rebuild_pending = False
+
+# 返回当前的标签位图快照：首次使用时同步加载；数据库有变化时在后台更新，更新完成前继续使用旧快照
+def get_tag_snapshot():
+    global tag_snapshot, tag_rebuild_pending
+    snapshot = tag_snapshot
+    if snapshot is None:
+        with tag_index_lock:
+            if tag_snapshot is None:
+                tag_snapshot = load_tag_snapshot()
+            return tag_snapshot
+    
+    conn = get_db_connection()
+    version = get_catalog_version(conn.cursor())
+    conn.close()
+    if version != snapshot.version:
+        with tag_index_lock:
+            if not tag_rebuild_pending:
+                tag_rebuild_pending = True
+                background_jobs.submit('tag_index', rebuild_tag_index_job)
+    return snapshot
+
+# 映射指针文件指向的图片列表快照，与当前进程已映射的快照相同时直接返回
+def load_catalog_snapshot():
+    global catalog_snapshot
+    folder = app.config['CATALOG_SNAPSHOT_FOLDER']
+    name = catalogsnapshot.read_pointer(folder)
+    if name is None:
+        return None
+    snapshot = catalog_snapshot
+    path = os.path.join(folder, name)
+    if snapshot is not None and snapshot.path == path:
+        return snapshot
+    try:
+        snapshot = catalogsnapshot.CatalogSnapshot(path)
+    except (OSError, ValueError) as e:
+        print(f"加载图片列表快照失败: {e}")
+        return None
+    # 旧快照不主动关闭，正在使用它的请求结束后由垃圾回收释放映射
+    with catalog_snapshot_lock:
+        if catalog_snapshot is None or snapshot.version >= catalog_snapshot.version:
+            catalog_snapshot = snapshot
+    return snapshot
+
+# 后台任务：重建图片列表快照；多个进程通过锁文件保证同时只有一个进程重建
+def rebuild_catalog_snapshot_job(job):
+    global catalog_snapshot_pending, catalog_snapshot_built_at
+    folder = app.config['CATALOG_SNAPSHOT_FOLDER']
+    lock_path = os.path.join(folder, 'rebuild.lock')
+    try:
+        os.makedirs(folder, exist_ok=True)
+        try:
+            if time.time() - os.path.getmtime(lock_path) > CATALOG_SNAPSHOT_LOCK_TIMEOUT:
+                os.remove(lock_path)
+        except OSError:
+            pass
+        try:
+            os.close(os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+        except FileExistsError:
+            # 其他进程正在重建
+            return
+        try:
+            conn = get_db_connection()
+            try:
+                cursor = conn.cursor()
+                # 等待锁期间其他进程可能已经发布了最新的快照
+                snapshot = load_catalog_snapshot()
+                if snapshot is None or snapshot.version != get_listing_version(cursor):
+                    catalogsnapshot.write_snapshot(cursor, folder)
+            finally:
+                conn.close()
+            load_catalog_snapshot()
+        finally:
+            os.remove(lock_path)
+    finally:
+        with catalog_snapshot_lock:
+            catalog_snapshot_pending = False
+            catalog_snapshot_built_at = time.time()
+
+# 读取图片列表的版本号
+def get_listing_version(cursor):
+    cursor.execute("SELECT version FROM listing_version WHERE id = 1")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+# 返回与数据库一致的图片列表快照；未启用、没有快照或快照已过期时返回None（过期时提交后台重建）
+def get_catalog_snapshot(cursor):
+    global catalog_snapshot_pending
+    if not app.config['CATALOG_SNAPSHOT_ENABLED']:
+        return None
+    version = get_listing_version(cursor)
+    snapshot = catalog_snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    # 其他进程可能已经发布了新的快照
+    snapshot = load_catalog_snapshot()
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+    with catalog_snapshot_lock:
+        interval = app.config['CATALOG_SNAPSHOT_REBUILD_INTERVAL']
+        if not catalog_snapshot_pending and time.time() - catalog_snapshot_built_at >= interval:
+            catalog_snapshot_pending = True
+            background_jobs.submit('catalog_snapshot', rebuild_catalog_snapshot_job)
+    return None
+
+def format_facets(counts):
+    return [{'name': name, 'count': count} for name, count in counts]
+
+# 检查并整理标签名列表，格式错误时返回None
+def parse_tag_names(raw_tags):
+    if isinstance(raw_tags, str):
+        raw_tags = raw_tags.split(',')
+    if not isinstance(raw_tags, (list, tuple)):
+        return None
+    names = []
+    seen = set()
+    for raw_tag in raw_tags:
+        if not isinstance(raw_tag, str):
+            return None
+        name = raw_tag.strip()
+        if not name or len(name) > MAX_TAG_LENGTH or INVALID_TAG_CHARS & set(name):
+            return None
+        if name.lower() not in seen:
+            seen.add(name.lower())
+            names.append(name)
+    return names
+
+# 批量添加或移除图片标签（单个事务），返回(标签ID, 标签名)列表和实际存在的图片ID
+# 内存中的快照与事务开始前的数据库一致时直接增量更新，否则等待后台重建
+def bulk_update_tags(action, tag_names, image_ids):
+    global tag_snapshot
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    try:
+        cursor.execute("BEGIN IMMEDIATE")
+        version_before = get_catalog_version(cursor)
+        
+        existing_ids = []
+        for chunk in chunked(image_ids):
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f"SELECT id FROM images WHERE id IN ({placeholders})", chunk)
+            existing_ids.extend(row[0] for row in cursor.fetchall())
+        
+        tags = []
+        for name in tag_names:
+            if action == 'add':
+                cursor.execute("INSERT OR IGNORE INTO tags (name) VALUES (?)", (name,))
+            cursor.execute("SELECT id, name FROM tags WHERE name = ?", (name,))
+            tag = cursor.fetchone()
+            if not tag:
+                continue
+            tags.append(tag)
+            if action == 'add':
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO image_tags (tag_id, image_id) VALUES (?, ?)",
+                    [(tag[0], image_id) for image_id in existing_ids]
+                )
+            else:
+                for chunk in chunked(existing_ids):
+                    placeholders = ','.join('?' * len(chunk))
+                    cursor.execute(f"DELETE FROM image_tags WHERE tag_id = ? AND image_id IN ({placeholders})", [tag[0]] + chunk)
+        
+        version_after = get_catalog_version(cursor)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    
+    with tag_index_lock:
+        if tag_snapshot is not None and tag_snapshot.version == version_before:
+            changed = tagindex.Bitmap.from_ids(existing_ids)
+            snapshot = tag_snapshot
+            for tag_id, name in tags:
+                snapshot = snapshot.with_tag_changes(version_after, tag_id, name, changed, action)
+            tag_snapshot = snapshot
+    return tags, existing_ids
+
+# 批量获取图片的标签，返回{图片ID: [标签名, ...]}
+def get_image_tags(image_ids):
+    conn = get_db_connection()
+    cursor = conn.cursor()
+    result = {}
+    for chunk in chunked(image_ids):
+        placeholders = ','.join('?' * len(chunk))
+        cursor.execute(f'''
+            SELECT image_tags.image_id, tags.name FROM image_tags
+            JOIN tags ON tags.id = image_tags.tag_id
+            WHERE image_tags.image_id IN ({placeholders})
+            ORDER BY tags.name
+        ''', chunk)
+        for image_id, name in cursor.fetchall():
+            result.setdefault(image_id, []).append(name)
+    conn.close()
+    return result
+
+# 批量添加/移除标签API，例如 {"action": "add", "tags": ["风景", "4K"], "ids": [1, 2, 3]}
+@app.route('/api/tags/bulk', methods=['POST'])
+def api_tags_bulk():
+    if not is_admin_logged_in():
+        return jsonify({'success': False, 'message': '需要管理员权限'})
+    
+    data = request.get_json(silent=True)
+    if not data:
+        return jsonify({'success': False, 'message': '无效的请求数据'})
+    action = data.get('action')
+    if action not in ('add', 'remove'):
+        return jsonify({'success': False, 'message': '不支持的操作'})
+    tag_names = parse_tag_names(data.get('tags'))
+    if not tag_names:
+        return jsonify({'success': False, 'message': f'标签名不能为空，不能超过 {MAX_TAG_LENGTH} 个字符，且不能包含引号和括号'})
+    image_ids = parse_id_list(data.get('ids'))
+    if not image_ids:
+        return jsonify({'success': False, 'message': '请提供图片ID列表'})
+    if len(image_ids) > MAX_BULK_IDS:
+        return jsonify({'success': False, 'message': f'一次最多操作 {MAX_BULK_IDS} 张图片'})
+    
+    try:
+        tags, existing_ids = bulk_update_tags(action, tag_names, image_ids)
+        return jsonify({
+            'success': True,
+            'message': f'已为 {len(existing_ids)} 张图片{"添加" if action == "add" else "移除"}标签',
+            'tags': [tag[1] for tag in tags],
+            'count': len(existing_ids)
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'操作失败: {str(e)}'})
+
+# 标签列表API：返回当前用户可访问的图片中各标签的图片数
+@app.route('/api/tags')
+def api_tags():
+    snapshot = get_tag_snapshot()
+    scope = snapshot.category_bitmap(get_accessible_category_ids())
+    limit = min(max(request.args.get('limit', 200, type=int), 1), 1000)
+    return json_response({'success': True, 'tags': format_facets(snapshot.facet_counts(scope, limit))})
+
+# 按标签查询图片API，例如 /api/tags/images?q=nature AND dark NOT anime&category=2
+# 结果按图片ID从新到旧排列，同时返回结果中各标签的图片数（分面统计）
+@app.route('/api/tags/images')
+def api_tag_images():
+    query = request.args.get('q', '', type=str)
+    page = max(request.args.get('page', 1, type=int), 1)
+    per_page = min(max(request.args.get('per_page', 20, type=int), 1), 100)
+    facet_limit = min(max(request.args.get('facets', 50, type=int), 0), 200)
+    
+    category_ids = get_accessible_category_ids()
+    category_id = request.args.get('category', type=int)
+    if category_id is not None:
+        if category_id not in category_ids:
+            return jsonify({'success': False, 'message': '您没有权限访问该分类'})
+        category_ids = {category_id}
+    
+    try:
+        with timed_phase('query'):
+            snapshot = get_tag_snapshot()
+            scope = snapshot.category_bitmap(category_ids)
+            result = tagindex.evaluate_query(query, snapshot, scope) if query.strip() else scope
+            total_count = len(result)
+            page_ids = result.page_desc((page - 1) * per_page, per_page)
+        
+        with timed_phase('facets'):
+            facets = format_facets(snapshot.facet_counts(result, facet_limit)) if facet_limit else []
+        
+        details = get_image_details(page_ids) if page_ids else {}
+        images = []
+        for image_id in page_ids:
+            row = details.get(image_id)
+            # 快照可能还包含刚刚删除的图片
+            if not row:
+                continue
+            images.append({
+                'id': row[0],
+                'filename': row[1],
+                'filepath': url_for('serve_uploads', filename=get_upload_rel_path(row[2])),
+                'upload_time': format_upload_time(row[3]),
+                'size': row[4],
+                'width': row[5],
+                'height': row[6],
+                'category_id': row[7]
+            })
+        
+        with timed_phase('serialize'):
+            return json_response({
+                'success': True,
+                'images': images,
+                'total_count': total_count,
+                'total_pages': (total_count + per_page - 1) // per_page,
+                'current_page': page,
+                'facets': facets
+            })
+    except tagindex.TagQueryError as e:
+        return jsonify({'success': False, 'message': str(e)})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'查询失败: {str(e)}'})
+
+# 获取当前用户可访问的分类ID集合
+def get_accessible_category_ids():
+    return {category[0] for category in get_user_accessible_categories()}
+
+# 按id分批读取分类下的图片(id, filename, filepath)，每批使用新的连接，适合在流式响应中遍历大分类
+def iter_category_images(category_id, batch_size=500):
+    last_id = 0
+    while True:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT id, filename, filepath FROM images WHERE category_id = ? AND id > ? ORDER BY id LIMIT ?",
+            (category_id, last_id, batch_size)
+        )
+        rows = cursor.fetchall()
+        conn.close()
+        for row in rows:
+            yield row
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1][0]
+
+# 计算图片在压缩包中的路径：位于分类文件夹内时保留子目录结构
+def get_archive_name(filepath, folder_path, prefix=''):
+    abs_folder = os.path.abspath(folder_path)
+    abs_file = os.path.abspath(filepath)
+    if os.path.commonpath([abs_folder]) == os.path.commonpath([abs_folder, abs_file]):
+        name = os.path.relpath(abs_file, abs_folder)
+    else:
+        name = os.path.basename(filepath)
+    name = name.replace('\\', '/')
+    return f"{prefix}/{name}" if prefix else name
+
+# 压缩包中跳过无法读取的文件
+def log_zip_error(filepath, error):
+    print(f"打包文件失败: {filepath}: {error}")
+
+# 按分类或图片ID列表下载ZIP压缩包（边读边发送，不生成临时文件）
+@app.route('/api/download.zip', methods=['GET', 'POST'])
+def download_zip():
+    category_id = request.args.get('category', type=int)
+    data = request.get_json(silent=True) if request.method == 'POST' else None
+    if data:
+        raw_ids = data.get('ids')
+    else:
+        raw_ids = request.values.get('ids', '')
+    
+    accessible_ids = get_accessible_category_ids()
+    
+    if category_id is not None:
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        cursor.execute("SELECT name, folder_path FROM categories WHERE id = ?", (category_id,))
+        category = cursor.fetchone()
+        conn.close()
+        
+        if not category:
+            return jsonify({'success': False, 'message': '分类不存在'})
+        if category_id not in accessible_ids:
+            if not is_user_logged_in() and not is_admin_logged_in():
+                return jsonify({'success': False, 'message': '请先登录'})
+            return jsonify({'success': False, 'message': '您没有权限访问该分类'})
+        
+        folder_path = category[1]
+        entries = (
+            (get_archive_name(filepath, folder_path), filepath)
+            for _, _, filepath in iter_category_images(category_id)
+        )
+        archive_name = f"{category[0]}.zip"
+    else:
+        image_ids = parse_id_list(raw_ids)
+        if not image_ids:
+            return jsonify({'success': False, 'message': '请提供分类或图片ID列表'})
+        if len(image_ids) > MAX_BULK_IDS:
+            return jsonify({'success': False, 'message': f'一次最多下载 {MAX_BULK_IDS} 张图片'})
+        
+        # 一次查出所有图片及其分类，只保留有权限访问的分类中的图片
+        rows = []
+        conn = get_db_connection()
+        cursor = conn.cursor()
+        for chunk in chunked(image_ids):
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f'''
+                SELECT images.filepath, images.category_id, categories.name, categories.folder_path
+                FROM images
+                JOIN categories ON images.category_id = categories.id
+                WHERE images.id IN ({placeholders})
+            ''', chunk)
+            rows.extend(row for row in cursor.fetchall() if row[1] in accessible_ids)
+        conn.close()
+        
+        if not rows:
+            return jsonify({'success': False, 'message': '没有可下载的图片'})
+        entries = [(get_archive_name(row[0], row[3], row[2]), row[0]) for row in rows]
+        archive_name = 'images.zip'
+    
+    def generate():
+        for chunk in zipstream.stream_zip(entries, on_error=log_zip_error, storage=get_storage()):
+            metrics.inc('wallpaper_served_bytes_total', len(chunk))
+            yield chunk
+    
+    response = app.response_class(generate(), mimetype='application/zip')
+    response.headers['Content-Disposition'] = f"attachment; filename*=UTF-8''{urllib.parse.quote(archive_name)}"
+    return response
+
+# 由本服务转发对象存储中的原图：只发送一个GET请求，大小取自响应头，边下载边发送，不把整个文件读入内存
+# 请求单个字节范围（Range）时原样转给对象存储并返回206；多个范围或带If-Range的请求返回整个文件
+def send_remote_original(store, image_id, filepath, negotiated):
+    byte_range = None
+    if (request.range and request.range.units == 'bytes' and len(request.range.ranges) == 1
+            and 'If-Range' not in request.headers):
+        byte_range = request.range.to_header()
+    try:
+        reader, content_range, total = store.open_range(filepath, byte_range)
+    except storage.RangeNotSatisfiable as e:
+        response = app.response_class(status=416)
+        if e.size is not None:
+            response.headers['Content-Range'] = f"bytes */{e.size}"
+        return response
+    length = content_range[1] - content_range[0] + 1 if content_range else total
+    
+    # 发送中的字节数超过上限时拒绝请求，响应发送完毕后释放额度
+    limiter = get_in_flight_limiter()
+    if not limiter.acquire(length):
+        reader.close()
+        return reject_response(503, '服务器繁忙，请稍后再试', 1, 'originals', 'in_flight_bytes')
+    
+    def generate():
+        while True:
+            chunk = reader.read(storage.CHUNK_SIZE)
+            if not chunk:
+                break
+            metrics.inc('wallpaper_served_bytes_total', len(chunk))
+            yield chunk
+    
+    def close():
+        reader.close()
+        limiter.release(length)
+    
+    # 从文件开头读取时才计为一次浏览
+    if app.config.get('VIEW_COUNTING_ENABLED') and (content_range is None or content_range[0] == 0):
+        view_counter.record(image_id)
+    mime_type = mimetypes.guess_type(filepath)[0] or 'application/octet-stream'
+    response = app.response_class(generate(), status=206 if content_range else 200, mimetype=mime_type)
+    response.headers['Content-Length'] = str(length)
+    response.headers['Accept-Ranges'] = 'bytes'
+    if content_range:
+        response.headers['Content-Range'] = f"bytes {content_range[0]}-{content_range[1]}/{total if total is not None else '*'}"
+    response.call_on_close(close)
+    if negotiated:
+        response.vary.add('Accept')
+    return response
+
 # 提供图片文件服务
 @app.route('/uploads/<path:filename>')
 def serve_uploads(filename):
@@ -1292,27 +4476,68 @@ def serve_uploads(filename):
         file_basename = os.path.basename(decoded_filename)
         
         # 从数据库中查找文件的实际路径
-        conn = sqlite3.connect(DATABASE)
+        conn = get_db_connection()
         cursor = conn.cursor()
         
-        # 尝试通过文件名匹配（处理所有位置的文件）
-        cursor.execute("SELECT filepath FROM images WHERE filename = ?", (file_basename,))
-        image = cursor.fetchone()
+        # 托管目录中的文件按内容摘要查找，其他文件通过文件名匹配（处理所有位置的文件）
+        # 按文件名匹配时优先返回未托管的文件，迁移到托管目录之前的旧地址仍然可以访问
+        content_hash = get_managed_hash(file_basename)
+        if content_hash:
+            cursor.execute("SELECT id, filepath FROM images WHERE content_hash = ? LIMIT ?",
+                           (content_hash, SERVE_LOOKUP_CANDIDATES))
+        else:
+            cursor.execute(
+                "SELECT id, filepath FROM images WHERE filename = ? ORDER BY content_hash IS NOT NULL LIMIT ?",
+                (file_basename, SERVE_LOOKUP_CANDIDATES)
+            )
+        candidates = cursor.fetchall()
+        # 相同内容或同名的文件可能在多个分类中，优先选择地址中的路径与之对应的记录
+        image = next((row for row in candidates if get_upload_rel_path(row[1]) == decoded_filename),
+                     candidates[0] if candidates else None)
         
         conn.close()
         
         if image:
             # 获取文件的实际路径
-            actual_filepath = image[0]
+            actual_filepath = image[1]
+            store = get_storage()
+            
+            # GIF动图按variant参数发送转码结果（保存在本地），variant=auto时原图响应同样按Accept区分缓存
+            is_gif = actual_filepath.lower().endswith('.gif')
+            negotiated = is_gif and request.args.get('variant') == 'auto'
+            if is_gif:
+                response = serve_animation_variant(image[0])
+                if response is not None:
+                    return response
+            
+            # 对象存储中的原图重定向到预签名地址，不查询对象是否存在，也不经过本服务转发
+            if store.remote and app.config['S3_PRESIGNED_REDIRECT']:
+                expires = app.config['S3_PRESIGN_EXPIRES']
+                if app.config.get('VIEW_COUNTING_ENABLED'):
+                    view_counter.record(image[0])
+                response = redirect(store.presigned_url(actual_filepath, expires), 302)
+                # 浏览器可以在签名过期前复用该重定向
+                response.headers['Cache-Control'] = f"private, max-age={max(expires // 2, 0)}"
+                if negotiated:
+                    response.vary.add('Accept')
+                return response
+            if store.remote:
+                return send_remote_original(store, image[0], actual_filepath, negotiated)
             
             # 验证文件是否存在
-            if not os.path.exists(actual_filepath):
+            if not store.exists(actual_filepath):
                 raise FileNotFoundError(f"文件不存在: {actual_filepath}")
             
             # 获取文件所在的目录和文件名
             directory = os.path.dirname(actual_filepath)
             file_name = os.path.basename(actual_filepath)
             
+            # 发送中的字节数超过上限时拒绝请求，响应发送完毕后释放额度
+            file_size = get_file_size(actual_filepath) or 0
+            limiter = get_in_flight_limiter()
+            if not limiter.acquire(file_size):
+                return reject_response(503, '服务器繁忙，请稍后再试', 1, 'originals', 'in_flight_bytes')
+            
             # 直接读取文件内容并返回，避免send_from_directory可能的路径问题
             try:
                 # 根据文件扩展名设置正确的MIME类型
@@ -1321,19 +4546,37 @@ def serve_uploads(filename):
                 if mime_type is None:
                     mime_type = 'application/octet-stream'
                 
-                with open(actual_filepath, 'rb') as f:
-                    response = app.response_class(
-                        response=f.read(),
-                        status=200,
-                        mimetype=mime_type
-                    )
-                    return response
+                data = store.read(actual_filepath)
+                metrics.inc('wallpaper_served_bytes_total', len(data))
+                if app.config.get('VIEW_COUNTING_ENABLED'):
+                    view_counter.record(image[0])
+                response = app.response_class(
+                    response=data,
+                    status=200,
+                    mimetype=mime_type
+                )
+                response.call_on_close(lambda: limiter.release(file_size))
+                if negotiated:
+                    response.vary.add('Accept')
+                return response
+            except (iohealth.FolderUnavailable, TimeoutError):
+                limiter.release(file_size)
+                raise
             except Exception as e:
+                limiter.release(file_size)
                 # 如果直接读取也失败，返回错误图片
                 return send_from_directory('../static/images', 'error.webp'), 500
         else:
             # 如果在数据库中找不到文件，返回错误图片
             return send_from_directory('../static/images', 'error.webp'), 404
+    except (iohealth.FolderUnavailable, TimeoutError):
+        # 分类文件夹无响应或断路器已断开：立即返回占位图片，客户端稍后重试
+        metrics.inc('wallpaper_requests_rejected_total', budget='originals', reason='folder_unavailable')
+        response = send_from_directory('../static/images', 'error.webp')
+        response.status_code = 503
+        response.headers['Retry-After'] = str(app.config['IO_BREAKER_RESET'])
+        response.headers['Cache-Control'] = 'no-store'
+        return response
     except FileNotFoundError:
         # 如果文件不存在，返回错误图片
         return send_from_directory('../static/images', 'error.webp'), 404
@@ -1341,16 +4584,86 @@ def serve_uploads(filename):
         # 处理其他异常
         return send_from_directory('../static/images', 'error.webp'), 500
 
-# 提供静态文件服务
-@app.route('/static/<path:filename>')
+# 读取静态文件清单（build_static.py生成），文件修改后自动重新加载
+def get_static_manifest():
+    try:
+        mtime = os.path.getmtime(STATIC_MANIFEST)
+    except OSError:
+        return {}
+    if static_manifest_cache['mtime'] != mtime:
+        with open(STATIC_MANIFEST, 'r', encoding='utf-8') as f:
+            static_manifest_cache['manifest'] = json.load(f)
+        static_manifest_cache['mtime'] = mtime
+    return static_manifest_cache['manifest']
+
+# 模板中引用静态文件：有构建结果时返回带摘要的地址，否则返回原地址
+@app.template_global()
+def static_url(path):
+    hashed = get_static_manifest().get(path)
+    if hashed:
+        return url_for('static', filename='dist/' + hashed)
+    return url_for('static', filename=path)
+
+# 发送带摘要的静态文件：内容不会改变，允许长期缓存，并优先发送预压缩的版本
+def send_fingerprinted_static(filename):
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    accept = request.accept_encodings
+    response = None
+    for encoding, suffix in PRECOMPRESSED_SUFFIXES:
+        if accept[encoding] and os.path.isfile(os.path.join(STATIC_DIST_FOLDER, filename + suffix)):
+            response = send_from_directory(STATIC_DIST_FOLDER, filename + suffix, mimetype=mimetype, max_age=STATIC_MAX_AGE)
+            response.headers['Content-Encoding'] = encoding
+            break
+    if response is None:
+        response = send_from_directory(STATIC_DIST_FOLDER, filename, mimetype=mimetype, max_age=STATIC_MAX_AGE)
+    response.vary.add('Accept-Encoding')
+    response.cache_control.immutable = True
+    return response
+
+# 提供静态文件服务（替换Flask自带的static端点，两者的URL规则相同）
+@app.endpoint('static')
 def serve_static(filename):
+    if filename.startswith('dist/'):
+        return send_fingerprinted_static(filename[len('dist/'):])
     return send_from_directory('../static', filename)
 
-if __name__ == '__main__':
-    init_db()
-    
-    # 获取默认分类ID并扫描文件夹
-    conn = sqlite3.connect(DATABASE)
+# 是否允许当前请求读取指标：来源地址在METRICS_ALLOWED_IPS中，或带有正确的METRICS_TOKEN
+def is_metrics_request_allowed():
+    token = app.config.get('METRICS_TOKEN')
+    authorization = request.headers.get('Authorization', '')
+    if token and authorization.startswith('Bearer '):
+        if hmac.compare_digest(authorization[len('Bearer '):].strip().encode('utf-8'), token.encode('utf-8')):
+            return True
+    address = ratelimit.client_ip(request.remote_addr, request.headers.get('X-Forwarded-For'),
+                                  app.config['TRUSTED_PROXY_COUNT'])
+    try:
+        address = ipaddress.ip_address(address or '')
+    except ValueError:
+        return False
+    for allowed in app.config.get('METRICS_ALLOWED_IPS') or []:
+        try:
+            if address in ipaddress.ip_network(allowed, strict=False):
+                return True
+        except ValueError:
+            continue
+    return False
+
+# Prometheus指标接口
+@app.route('/metrics')
+def metrics_endpoint():
+    if not app.config.get('METRICS_ENABLED'):
+        return "Not Found", 404
+    if not is_metrics_request_allowed():
+        return "无权访问", 403
+    return app.response_class(
+        response=metrics.render_latest(),
+        status=200,
+        mimetype='text/plain; version=0.0.4'
+    )
+
+# 启动时扫描默认分类文件夹，之后为尚未提取主色调的图片提取主色调
+def startup_scan_job(job=None):
+    conn = get_db_connection()
     cursor = conn.cursor()
     cursor.execute("SELECT id, folder_path FROM categories WHERE name = '默认分类'")
     default_category = cursor.fetchone()
@@ -1359,5 +4672,24 @@ if __name__ == '__main__':
     if default_category:
         scan_folder_and_update_db(default_category[1], default_category[0])
     
+    schedule_palette_indexing()
+    schedule_animation_transcoding()
+    # 预先加载标签位图，避免第一个标签查询等待加载
+    get_tag_snapshot()
+
+# 启动前的准备工作：初始化数据库，并扫描默认分类（DEFER_STARTUP_SCAN为True时在后台扫描，不阻塞服务器启动）
+def prepare_startup():
+    init_db()
+    resume_category_deletions()
+    resume_image_moves()
+    start_integrity_sweeper()
+    if app.config.get('DEFER_STARTUP_SCAN'):
+        background_jobs.submit('startup_scan', startup_scan_job)
+    else:
+        startup_scan_job()
+
+if __name__ == '__main__':
+    prepare_startup()
+    
     # 开放所有IP访问，设置host为0.0.0.0
     app.run(debug=False, host='0.0.0.0')
\ No newline at end of file
@@ -0,0 +1,108 @@
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+# 图片列表过滤/排序查询的性能测试
+# 用法：python benchmark_filters.py [行数]，默认生成50万条图片记录，在临时数据库中运行，不影响正式数据
+
+import app
+
+ROW_COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 500000
+CATEGORY_COUNT = 5
+REPEAT = 20
+
+# 常见的壁纸分辨率
+RESOLUTIONS = [
+    (1920, 1080), (2560, 1440), (3840, 2160), (1080, 1920), (1440, 2560),
+    (1366, 768), (2560, 1080), (3440, 1440), (1280, 1280), (1170, 2532)
+]
+
+# 要测试的查询：(名称, 参数)
+CASES = [
+    ('默认排序', {}),
+    ('默认排序第500页', {'page': 500}),
+    ('只看3840x2160', {'filters': {'min_width': 3840, 'min_height': 2160}}),
+    ('只看竖屏', {'filters': {'orientation': 'portrait'}}),
+    ('16:9宽高比', {'filters': {'aspect': 16 / 9}}),
+    ('按大小降序', {'sort_key': 'size'}),
+    ('按分辨率降序', {'sort_key': 'resolution'}),
+    ('按上传时间升序', {'sort_key': 'upload_time', 'sort_direction': 'asc'}),
+    ('竖屏+按大小降序', {'sort_key': 'size', 'filters': {'orientation': 'portrait'}}),
+    ('21:9+按分辨率降序', {'sort_key': 'resolution', 'filters': {'aspect': 21 / 9, 'aspect_tolerance': 0.02}}),
+]
+
+
+def seed(database):
+    conn = app.get_db_connection()
+    cursor = conn.cursor()
+    for index in range(2, CATEGORY_COUNT + 1):
+        cursor.execute("INSERT INTO categories (name, folder_path) VALUES (?, ?)", (f'分类{index}', f'/bench/{index}'))
+
+    rng = random.Random(42)
+    rows = []
+    for index in range(ROW_COUNT):
+        category_id = index % CATEGORY_COUNT + 1
+        width, height = rng.choice(RESOLUTIONS)
+        upload_time = '2025-%02d-%02d %02d:%02d:%02d' % (
+            rng.randint(1, 12), rng.randint(1, 28), rng.randint(0, 23), rng.randint(0, 59), rng.randint(0, 59))
+        rows.append((f'img{index}.jpg', f'/bench/{category_id}/img{index}.jpg', category_id, upload_time,
+                     index // CATEGORY_COUNT + 1, rng.randint(100000, 20000000), width, height))
+    cursor.executemany('''
+        INSERT INTO images (filename, filepath, category_id, upload_time, sort_index, file_size, width, height)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+    conn.commit()
+    conn.close()
+
+
+def run_case(kwargs):
+    filters = kwargs.get('filters')
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        result = app.get_images_by_category(
+            1, kwargs.get('page', 1), 20, '', kwargs.get('sort_direction', 'desc'), filters, kwargs.get('sort_key'))
+    elapsed = (time.perf_counter() - start) / REPEAT
+    return elapsed, result
+
+
+def query_plan(kwargs):
+    # 通过回调记录get_images_by_category实际执行的列表查询，再查看其查询计划
+    statements = []
+    conn = app.get_db_connection()
+    original_connect = app.get_db_connection
+    app.get_db_connection = lambda: _traced_connection(statements)
+    try:
+        app.get_images_by_category(1, 1, 20, '', kwargs.get('sort_direction', 'desc'), kwargs.get('filters'), kwargs.get('sort_key'))
+    finally:
+        app.get_db_connection = original_connect
+    sql = [statement for statement in statements if 'LIMIT' in statement][0]
+    cursor = conn.cursor()
+    cursor.execute("EXPLAIN QUERY PLAN " + sql)
+    plan = '; '.join(row[3] for row in cursor.fetchall())
+    conn.close()
+    return plan
+
+
+def _traced_connection(statements):
+    conn = sqlite3.connect(app.DATABASE)
+    conn.set_trace_callback(statements.append)
+    return conn
+
+
+if __name__ == '__main__':
+    with tempfile.TemporaryDirectory() as temp_dir:
+        app.DATABASE = os.path.join(temp_dir, 'benchmark.db')
+        app.init_db()
+
+        print(f"正在生成 {ROW_COUNT} 条图片记录...")
+        start = time.perf_counter()
+        seed(app.DATABASE)
+        print(f"生成完成，耗时 {time.perf_counter() - start:.1f} 秒\n")
+
+        for name, kwargs in CASES:
+            elapsed, result = run_case(kwargs)
+            print(f"{name}: {elapsed * 1000:.2f} ms/次，共 {result['total_count']} 条")
+            print(f"    查询计划: {query_plan(kwargs)}")
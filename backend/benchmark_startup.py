@@ -0,0 +1,108 @@
+import os
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+# 启动速度测试：导入app模块的耗时，以及从启动进程到第一个请求返回的时间（time to first request）
+# 用法：python benchmark_startup.py [默认分类中的图片数]，默认300张，在临时目录中运行，不影响正式数据
+
+IMAGE_COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 300
+REPEAT = 5
+TIMEOUT = 60
+
+BACKEND_FOLDER = os.path.dirname(os.path.abspath(__file__))
+
+IMPORT_CODE = '''
+import sys, time
+start = time.perf_counter()
+import app
+print(time.perf_counter() - start, int('PIL' in sys.modules))
+'''
+
+SERVER_CODE = '''
+import sys
+sys.path.insert(0, {backend!r})
+import app
+app.DATABASE = {database!r}
+app.app.config['DEFER_STARTUP_SCAN'] = {defer!r}
+app.prepare_startup()
+app.app.run(host='127.0.0.1', port={port!r})
+'''
+
+
+def measure_import():
+    timings = []
+    pil_loaded = False
+    for _ in range(REPEAT):
+        output = subprocess.check_output([sys.executable, '-c', IMPORT_CODE], cwd=BACKEND_FOLDER)
+        elapsed, pil = output.decode().split()
+        timings.append(float(elapsed))
+        pil_loaded = pil_loaded or pil == '1'
+    return statistics.median(timings), pil_loaded
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def create_images(folder, count):
+    from PIL import Image
+    os.makedirs(folder, exist_ok=True)
+    for index in range(count):
+        Image.new('RGB', (320, 180), (index % 256, index * 7 % 256, index * 13 % 256)).save(
+            os.path.join(folder, f'img{index:05d}.jpg'), 'JPEG')
+
+
+def measure_first_request(work_dir, defer):
+    port = free_port()
+    code = SERVER_CODE.format(backend=BACKEND_FOLDER, database=os.path.join(work_dir, 'wallpaper.db'),
+                              defer=defer, port=port)
+    start = time.perf_counter()
+    process = subprocess.Popen([sys.executable, '-c', code], cwd=os.path.join(work_dir, 'backend'),
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < TIMEOUT:
+            try:
+                with urllib.request.urlopen(f'http://127.0.0.1:{port}/', timeout=1) as response:
+                    if response.status == 200:
+                        return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.01)
+        return None
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def run_mode(defer):
+    # 默认分类的文件夹为 ../uploads/default（相对于运行目录）
+    work_dir = tempfile.mkdtemp(prefix='wallpaper-startup-')
+    try:
+        os.makedirs(os.path.join(work_dir, 'backend'))
+        create_images(os.path.join(work_dir, 'uploads', 'default'), IMAGE_COUNT)
+        cold = measure_first_request(work_dir, defer)
+        warm = measure_first_request(work_dir, defer)
+        return cold, warm
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def format_seconds(value):
+    return '超时' if value is None else f'{value * 1000:.0f} ms'
+
+
+if __name__ == '__main__':
+    elapsed, pil_loaded = measure_import()
+    print(f"导入app模块: {elapsed * 1000:.1f} ms（中位数，{REPEAT}次），导入时加载Pillow: {'是' if pil_loaded else '否'}")
+
+    print(f"\n默认分类中有 {IMAGE_COUNT} 张图片")
+    for name, defer in (('启动时同步扫描', False), ('启动后在后台扫描', True)):
+        cold, warm = run_mode(defer)
+        print(f"{name}: 首次启动到第一个请求 {format_seconds(cold)}，再次启动 {format_seconds(warm)}")
@@ -0,0 +1,62 @@
+import random
+import sys
+import time
+
+# 标签位图查询的性能测试
+# 用法：python benchmark_tags.py [图片数]，默认100万张图片、200个标签，只在内存中运行，不访问数据库
+
+import tagindex
+
+IMAGE_COUNT = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+TAG_COUNT = 200
+CATEGORY_COUNT = 5
+REPEAT = 50
+
+# 几个常用标签使用较高的密度，其余标签较稀疏
+DENSE_TAGS = {'nature': 0.3, 'dark': 0.2, 'anime': 0.1, '4k': 0.4}
+
+QUERIES = [
+    'nature AND dark NOT anime',
+    '(4k OR dark) nature',
+    'NOT anime',
+    'tag17 OR tag42 OR tag99',
+]
+
+
+def build_snapshot():
+    rng = random.Random(42)
+    ids = range(1, IMAGE_COUNT + 1)
+    tags = {}
+    names = {}
+    densities = dict(DENSE_TAGS)
+    for index in range(TAG_COUNT - len(DENSE_TAGS)):
+        densities[f'tag{index}'] = rng.uniform(0.0005, 0.02)
+    for tag_id, (name, density) in enumerate(densities.items(), 1):
+        names[name] = (tag_id, name)
+        tags[tag_id] = tagindex.Bitmap.from_ids(rng.sample(ids, int(IMAGE_COUNT * density)))
+    categories = {
+        category_id: tagindex.Bitmap.from_ids(range(category_id, IMAGE_COUNT + 1, CATEGORY_COUNT))
+        for category_id in range(1, CATEGORY_COUNT + 1)
+    }
+    return tagindex.TagSnapshot(0, tags, names, categories)
+
+
+def timed(func):
+    start = time.perf_counter()
+    for _ in range(REPEAT):
+        result = func()
+    return (time.perf_counter() - start) / REPEAT * 1000, result
+
+
+if __name__ == '__main__':
+    print(f"正在生成 {IMAGE_COUNT} 张图片、{TAG_COUNT} 个标签的位图...")
+    start = time.perf_counter()
+    snapshot = build_snapshot()
+    print(f"生成完成，耗时 {time.perf_counter() - start:.1f} 秒\n")
+
+    scope = snapshot.category_bitmap(range(1, CATEGORY_COUNT + 1))
+    for query in QUERIES:
+        elapsed, result = timed(lambda: tagindex.evaluate_query(query, snapshot, scope))
+        page_ms, _ = timed(lambda: result.page_desc(1000, 20))
+        facet_ms, _ = timed(lambda: snapshot.facet_counts(result))
+        print(f"{query}: 查询 {elapsed:.2f} ms，共 {len(result)} 张；第51页 {page_ms:.2f} ms；分面统计 {facet_ms:.2f} ms")
@@ -0,0 +1,122 @@
+import gzip
+import hashlib
+import json
+import os
+import re
+import shutil
+
+# 静态文件构建脚本
+# 为static目录下的文件生成带内容摘要的文件名（如 css/style.3f2a9c1b.css），写入static/dist，
+# 同时生成预压缩的 .gz 和 .br（安装了brotli时）文件，并把原路径到新路径的对应关系写入manifest.json。
+# 模板通过 static_url() 引用静态文件，运行本脚本后会自动使用带摘要的文件并长期缓存。
+# 用法：python build_static.py
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+STATIC_FOLDER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'static')
+DIST_FOLDER = os.path.join(STATIC_FOLDER, 'dist')
+MANIFEST_PATH = os.path.join(DIST_FOLDER, 'manifest.json')
+
+# 需要处理的文件类型，以及值得预压缩的类型（图片和woff2本身已经压缩过）
+ASSET_EXTENSIONS = {'.css', '.js', '.woff2', '.woff', '.ttf', '.svg', '.webp', '.png', '.jpg', '.jpeg', '.gif', '.ico'}
+COMPRESS_EXTENSIONS = {'.css', '.js', '.ttf', '.svg'}
+# Font Awesome中只在开发时使用的源文件目录
+EXCLUDE_DIRS = {'dist', 'less', 'scss', 'svgs', 'sprites', 'metadata'}
+# 小于该大小的文件不生成压缩版本
+MIN_COMPRESS_SIZE = 500
+
+CSS_URL_PATTERN = re.compile(r'url\(\s*([\'"]?)([^\'")]+)\1\s*\)')
+
+
+def iter_assets():
+    """按原路径（相对于static，使用/分隔）遍历需要处理的文件"""
+    for current_dir, dirnames, filenames in os.walk(STATIC_FOLDER):
+        dirnames[:] = sorted(name for name in dirnames if name not in EXCLUDE_DIRS)
+        for filename in sorted(filenames):
+            if os.path.splitext(filename)[1].lower() in ASSET_EXTENSIONS:
+                full_path = os.path.join(current_dir, filename)
+                yield os.path.relpath(full_path, STATIC_FOLDER).replace(os.sep, '/')
+
+
+def fingerprint(rel_path, data):
+    """在扩展名前插入内容摘要"""
+    digest = hashlib.sha256(data).hexdigest()[:10]
+    base, ext = os.path.splitext(rel_path)
+    return f"{base}.{digest}{ext}"
+
+
+def rewrite_css_urls(rel_path, text, manifest):
+    """把CSS中引用的相对路径替换为带摘要的文件，保留查询参数和锚点"""
+    css_dir = os.path.dirname(rel_path)
+
+    def replace(match):
+        quote, url = match.group(1), match.group(2)
+        if url.startswith(('data:', 'http:', 'https:', '//', '/', '#')):
+            return match.group(0)
+        path, suffix = re.match(r'([^?#]*)(.*)', url).groups()
+        target = os.path.normpath(os.path.join(css_dir, path)).replace(os.sep, '/')
+        hashed = manifest.get(target)
+        if not hashed:
+            return match.group(0)
+        new_url = os.path.relpath(hashed, css_dir or '.').replace(os.sep, '/')
+        return f"url({quote}{new_url}{suffix}{quote})"
+
+    return CSS_URL_PATTERN.sub(replace, text)
+
+
+def write_asset(hashed_path, data):
+    target = os.path.join(DIST_FOLDER, hashed_path)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    with open(target, 'wb') as f:
+        f.write(data)
+
+    if os.path.splitext(hashed_path)[1].lower() not in COMPRESS_EXTENSIONS or len(data) < MIN_COMPRESS_SIZE:
+        return
+    compressed = gzip.compress(data, compresslevel=9, mtime=0)
+    if len(compressed) < len(data):
+        with open(target + '.gz', 'wb') as f:
+            f.write(compressed)
+    if brotli is not None:
+        compressed = brotli.compress(data, quality=11)
+        if len(compressed) < len(data):
+            with open(target + '.br', 'wb') as f:
+                f.write(compressed)
+
+
+def build():
+    if os.path.exists(DIST_FOLDER):
+        shutil.rmtree(DIST_FOLDER)
+    os.makedirs(DIST_FOLDER)
+
+    # CSS中会引用字体和图片，所以先处理其他文件，再改写CSS中的路径并计算摘要
+    assets = list(iter_assets())
+    stylesheets = [path for path in assets if path.endswith('.css')]
+    manifest = {}
+    for rel_path in assets:
+        if rel_path in stylesheets:
+            continue
+        with open(os.path.join(STATIC_FOLDER, rel_path), 'rb') as f:
+            data = f.read()
+        manifest[rel_path] = fingerprint(rel_path, data)
+        write_asset(manifest[rel_path], data)
+
+    for rel_path in stylesheets:
+        with open(os.path.join(STATIC_FOLDER, rel_path), 'r', encoding='utf-8') as f:
+            data = rewrite_css_urls(rel_path, f.read(), manifest).encode('utf-8')
+        manifest[rel_path] = fingerprint(rel_path, data)
+        write_asset(manifest[rel_path], data)
+
+    with open(MANIFEST_PATH, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2, sort_keys=True)
+    return manifest
+
+
+if __name__ == '__main__':
+    print(f"正在处理静态文件: {os.path.abspath(STATIC_FOLDER)}")
+    if brotli is None:
+        print("未安装brotli，只生成gzip压缩版本")
+    manifest = build()
+    print(f"已生成 {len(manifest)} 个文件，清单: {os.path.abspath(MANIFEST_PATH)}")
@@ -0,0 +1,250 @@
+import mmap
+import os
+import struct
+import tempfile
+import uuid
+
+# 图片目录的二进制快照，供多个工作进程通过mmap共享
+# 快照文件只读，所有进程映射同一个文件，操作系统只在内存中保存一份；更新时写入新文件，再原子地替换指针文件（current），
+# 各进程发现指针变化后映射新文件，旧文件在不再使用后删除。
+#
+# 文件结构（小端序）：
+#   文件头      HEADER
+#   分类目录    每个分类一项 DIRECTORY_ENTRY：分类ID、图片数、记录的位置、各排序方式的排列数组的位置
+#   图片记录    每个分类的图片按(sort_index, id)升序排列，每张图片一条定长记录 RECORD，字符串保存为字符串表中的(位置, 长度)
+#   排列数组    每个分类、每种排序方式一个uint32数组，按该排序方式升序列出记录的序号
+#   字符串表    文件名、路径和上传时间的UTF-8字节
+# 降序分页从数组末尾倒序读取，读取一页只需要解析这一页的记录。
+
+MAGIC = b'WPCATLG1'
+FORMAT_VERSION = 1
+HEADER = struct.Struct('<8sIIqQQ')  # 标识、格式版本、分类数、列表版本（listing_version）、字符串表位置、字符串表长度
+# 支持的排序方式（与app.py中IMAGE_SORT_COLUMNS的列一致，最后按id排序），浏览次数和热度经常变化，不放入快照
+SORT_KEYS = ('size', 'resolution', 'upload_time')
+DIRECTORY_ENTRY = struct.Struct('<qIQ' + 'Q' * len(SORT_KEYS))
+RECORD = struct.Struct('<qqqiiIIIIII')  # id、sort_index、file_size、width、height、文件名/路径/上传时间的(位置, 长度)
+INDEX = struct.Struct('<I')
+
+# NULL值的表示
+NULL_INT64 = -(1 << 63)
+NULL_INT32 = -(1 << 31)
+NULL_LENGTH = 0xFFFFFFFF
+
+POINTER_NAME = 'current'
+
+
+def _nullable(value, null):
+    return null if value is None else value
+
+
+def _sort_value(value):
+    # SQLite中NULL排在最前面
+    return (0, 0) if value is None else (1, value)
+
+
+def _sort_functions():
+    def size(row):
+        return (_sort_value(row[5]), _sort_value(row[6]), _sort_value(row[7]), row[0])
+
+    def resolution(row):
+        pixels = row[6] * row[7] if row[6] is not None and row[7] is not None else None
+        return (_sort_value(pixels), _sort_value(row[6]), _sort_value(row[7]), row[0])
+
+    def upload_time(row):
+        return (_sort_value(row[3]), row[0])
+
+    return {'size': size, 'resolution': resolution, 'upload_time': upload_time}
+
+
+def _listing_version(cursor):
+    cursor.execute("SELECT version FROM listing_version WHERE id = 1")
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+
+def write_snapshot(cursor, folder, attempts=3):
+    """
+    读取数据库中的全部图片，写入新的快照文件并更新指针，返回(快照文件路径, 列表版本)
+    不在一个长事务中读取（会长时间阻塞写入）：每条查询各自是一个短的读事务，读取完成后再检查列表版本（listing_version），
+    期间列表发生过变化时丢弃结果重试，attempts次都发生变化时返回None
+    cursor所在的连接上不能有未完成的事务
+    """
+    os.makedirs(folder, exist_ok=True)
+    for _ in range(attempts):
+        result = _write_snapshot_file(cursor, folder)
+        if result is not None:
+            return result
+    return None
+
+
+def _write_snapshot_file(cursor, folder):
+    version = _listing_version(cursor)
+    cursor.execute("SELECT category_id, COUNT(*) FROM images WHERE category_id IS NOT NULL GROUP BY category_id ORDER BY category_id")
+    counts = cursor.fetchall()
+
+    # 先计算各部分的位置，再按顺序写入
+    directory = []
+    position = HEADER.size + DIRECTORY_ENTRY.size * len(counts)
+    for category_id, count in counts:
+        records_offset = position
+        position += RECORD.size * count
+        sort_offsets = []
+        for _ in SORT_KEYS:
+            sort_offsets.append(position)
+            position += INDEX.size * count
+        directory.append((category_id, count, records_offset, sort_offsets))
+    strings_offset = position
+
+    name = f"catalog-{version}-{uuid.uuid4().hex[:8]}.bin"
+    temp_path = os.path.join(folder, name + '.tmp')
+    sort_functions = _sort_functions()
+    complete = False
+    try:
+        with open(temp_path, 'wb') as output, tempfile.TemporaryFile() as strings:
+            output.write(b'\0' * (HEADER.size + DIRECTORY_ENTRY.size * len(counts)))
+            strings_length = 0
+
+            def add_string(value):
+                nonlocal strings_length
+                if value is None:
+                    return 0, NULL_LENGTH
+                data = str(value).encode('utf-8')
+                strings.write(data)
+                strings_length += len(data)
+                return strings_length - len(data), len(data)
+
+            for category_id, count, _, _ in directory:
+                cursor.execute('''
+                    SELECT id, filename, filepath, upload_time, sort_index, file_size, width, height
+                    FROM images WHERE category_id = ? ORDER BY sort_index
+                ''', (category_id,))
+                # sort_index相同时按id排序（排序索引中sort_index后面还有其他列，不能由数据库按id排序），输入已基本有序，排序很快
+                rows = cursor.fetchall()
+                rows.sort(key=lambda row: (_sort_value(row[4]), row[0]))
+                if len(rows) != count:
+                    # 读取期间数据发生变化
+                    return None
+                records = bytearray()
+                for image_id, filename, filepath, upload_time, sort_index, file_size, width, height in rows:
+                    records += RECORD.pack(
+                        image_id, _nullable(sort_index, NULL_INT64), _nullable(file_size, NULL_INT64),
+                        _nullable(width, NULL_INT32), _nullable(height, NULL_INT32),
+                        *add_string(filename), *add_string(filepath), *add_string(upload_time)
+                    )
+                output.write(records)
+                # 排序用的行与记录中的列顺序一致：(id, 文件名, 路径, 上传时间, sort_index, 大小, 宽, 高)
+                for sort_key in SORT_KEYS:
+                    order = sorted(range(len(rows)), key=lambda index: sort_functions[sort_key](rows[index]))
+                    output.write(struct.pack(f'<{len(order)}I', *order))
+
+            # 列表版本没有变化说明各条查询读到的是同一时刻的数据
+            if _listing_version(cursor) != version:
+                return None
+
+            strings.seek(0)
+            while True:
+                data = strings.read(1024 * 1024)
+                if not data:
+                    break
+                output.write(data)
+
+            output.seek(0)
+            output.write(HEADER.pack(MAGIC, FORMAT_VERSION, len(directory), version, strings_offset, strings_length))
+            for category_id, count, records_offset, sort_offsets in directory:
+                output.write(DIRECTORY_ENTRY.pack(category_id, count, records_offset, *sort_offsets))
+        complete = True
+    finally:
+        if not complete and os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    path = os.path.join(folder, name)
+    os.replace(temp_path, path)
+    publish(folder, name)
+    return path, version
+
+
+def publish(folder, name):
+    """原子地把指针文件指向新的快照，并删除更早的快照（保留上一个，正在使用它的进程稍后会切换）"""
+    pointer_path = os.path.join(folder, POINTER_NAME)
+    previous = read_pointer(folder)
+    temp_path = pointer_path + f'.{uuid.uuid4().hex[:8]}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        f.write(name)
+    os.replace(temp_path, pointer_path)
+    for entry in os.listdir(folder):
+        if entry.startswith('catalog-') and entry not in (name, previous):
+            try:
+                os.remove(os.path.join(folder, entry))
+            except OSError:
+                # Windows上仍被映射的文件无法删除，下次更新时再试
+                pass
+
+
+def read_pointer(folder):
+    try:
+        with open(os.path.join(folder, POINTER_NAME), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except OSError:
+        return None
+
+
+class CatalogSnapshot(object):
+    """映射到内存的只读快照，分页时只解析需要的记录"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, format_version, category_count, self.version, self._strings_offset, _ = HEADER.unpack_from(self._mmap, 0)
+        if magic != MAGIC or format_version != FORMAT_VERSION:
+            raise ValueError('不支持的快照文件格式')
+        self.path = path
+        self.categories = {}
+        for index in range(category_count):
+            entry = DIRECTORY_ENTRY.unpack_from(self._mmap, HEADER.size + DIRECTORY_ENTRY.size * index)
+            category_id, count, records_offset = entry[:3]
+            self.categories[category_id] = (count, records_offset, dict(zip(SORT_KEYS, entry[3:])))
+
+    def count(self, category_id):
+        entry = self.categories.get(category_id)
+        return entry[0] if entry else 0
+
+    def _string(self, offset, length):
+        if length == NULL_LENGTH:
+            return None
+        start = self._strings_offset + offset
+        return self._mmap[start:start + length].decode('utf-8')
+
+    def _record(self, records_offset, index):
+        (image_id, sort_index, file_size, width, height,
+         name_offset, name_length, path_offset, path_length, time_offset, time_length) = RECORD.unpack_from(
+            self._mmap, records_offset + RECORD.size * index)
+        return (
+            image_id,
+            self._string(name_offset, name_length),
+            self._string(path_offset, path_length),
+            self._string(time_offset, time_length),
+            None if sort_index == NULL_INT64 else sort_index,
+            None if file_size == NULL_INT64 else file_size,
+            None if width == NULL_INT32 else width,
+            None if height == NULL_INT32 else height
+        )
+
+    def page(self, category_id, offset, limit, descending=True, sort_key=None):
+        """
+        返回一页图片，格式与get_images_by_category相同：(id, 文件名, 路径, 上传时间, sort_index, 大小, 宽, 高)
+        sort_key为None时按sort_index排序，否则为SORT_KEYS之一
+        """
+        entry = self.categories.get(category_id)
+        if not entry:
+            return []
+        count, records_offset, sort_offsets = entry
+        positions = range(offset, min(offset + limit, count))
+        if descending:
+            positions = [count - 1 - position for position in positions]
+        if sort_key is None:
+            return [self._record(records_offset, position) for position in positions]
+        order_offset = sort_offsets[sort_key]
+        return [
+            self._record(records_offset, INDEX.unpack_from(self._mmap, order_offset + INDEX.size * position)[0])
+            for position in positions
+        ]
@@ -0,0 +1,289 @@
+import difflib
+import io
+import os
+import random
+import re
+import sqlite3
+import sys
+import tempfile
+
+# 查询计划回归检查
+# 在临时数据库中生成测试数据，通过测试客户端调用页面、API和管理接口，记录实际执行的每条SQL，
+# 用 EXPLAIN QUERY PLAN 查看查询计划：
+#   1. 大表（images等）出现没有使用索引的全表扫描（SCAN images）时失败，确实需要全表扫描的语句写在ALLOWED_SCANS中并注明原因；
+#   2. 与保存的快照（query_plans.txt）不一致时失败并显示差异，查询计划的变化可以在代码评审中看到。
+# 用法：python check_query_plans.py          检查
+#       python check_query_plans.py --update 修改查询或索引后更新快照
+
+import app
+
+SNAPSHOT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'query_plans.txt')
+
+IMAGE_COUNT = 5000
+CATEGORY_COUNT = 4
+
+# 不允许全表扫描的表
+LARGE_TABLES = {'images', 'image_colors', 'image_tags'}
+
+# 允许全表扫描的语句（规范化后的SQL中包含的片段 -> 原因）
+ALLOWED_SCANS = {
+}
+
+# 只检查读写数据的语句
+CHECKED_STATEMENT = re.compile(r'^\s*(SELECT|WITH|UPDATE|DELETE|INSERT\s+(OR\s+\w+\s+)?INTO\s+\w+\s*(\([^)]*\))?\s*SELECT)', re.I)
+
+
+def normalize(sql):
+    """把SQL中的常量替换为?，合并IN列表，便于去重和生成稳定的快照"""
+    sql = re.sub(r"'(?:[^']|'')*'", '?', sql)
+    sql = re.sub(r'(?<![\w.])-?\d+(\.\d+)?(e[-+]?\d+)?(?![\w.])', '?', sql, flags=re.I)
+    sql = re.sub(r'\?(\s*,\s*\?)+', '?, ...', sql)
+    return ' '.join(sql.split())
+
+
+def seed(upload_folder):
+    """生成分类、图片、用户权限、标签和主色调数据"""
+    conn = app.get_db_connection()
+    cursor = conn.cursor()
+    for index in range(2, CATEGORY_COUNT + 1):
+        folder = os.path.join(upload_folder, f'category{index}')
+        os.makedirs(folder, exist_ok=True)
+        cursor.execute("INSERT INTO categories (name, folder_path) VALUES (?, ?)", (f'分类{index}', folder))
+
+    rng = random.Random(42)
+    rows = []
+    for index in range(IMAGE_COUNT):
+        category_id = index % CATEGORY_COUNT + 1
+        width, height = rng.choice([(1920, 1080), (3840, 2160), (1080, 1920), (2560, 1440)])
+        upload_time = '2025-%02d-%02d 12:00:00' % (rng.randint(1, 12), rng.randint(1, 28))
+        rows.append((f'img{index}.jpg', f'/plans/{category_id}/img{index}.jpg', category_id, upload_time,
+                     index // CATEGORY_COUNT + 1, rng.randint(100000, 5000000), width, height))
+    cursor.executemany('''
+        INSERT INTO images (filename, filepath, category_id, upload_time, sort_index, file_size, width, height)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ''', rows)
+
+    cursor.execute("INSERT INTO users (username, password, user_type) VALUES ('viewer', 'x', 'user')")
+    user_id = cursor.lastrowid
+    cursor.executemany("INSERT INTO user_category_permissions (user_id, category_id) VALUES (?, ?)",
+                       [(user_id, 2), (user_id, 3)])
+
+    for name in ('nature', 'dark', 'anime'):
+        cursor.execute("INSERT INTO tags (name) VALUES (?)", (name,))
+        tag_id = cursor.lastrowid
+        cursor.executemany("INSERT INTO image_tags (tag_id, image_id) VALUES (?, ?)",
+                           [(tag_id, image_id) for image_id in rng.sample(range(1, IMAGE_COUNT + 1), IMAGE_COUNT // 5)])
+
+    color_rows = []
+    for image_id in range(1, IMAGE_COUNT + 1):
+        l, a, b = rng.uniform(0, 100), rng.uniform(-60, 60), rng.uniform(-60, 60)
+        color_rows.append((app.palette.lab_bucket((l, a, b)), image_id, 0, l, a, b, 1.0))
+    cursor.executemany("INSERT INTO image_colors VALUES (?, ?, ?, ?, ?, ?, ?)", color_rows)
+    cursor.execute("UPDATE images SET palette_version = ?", (app.PALETTE_VERSION,))
+    conn.commit()
+    conn.close()
+    return user_id
+
+
+def make_image_bytes():
+    image_module = app.imaging.image_module()
+    buffer = io.BytesIO()
+    image_module.new('RGB', (32, 18), (40, 90, 160)).save(buffer, 'JPEG')
+    return buffer.getvalue()
+
+
+def snapshot_listing(user):
+    """启用图片列表快照后请求列表：第一次请求提交后台生成快照，之后从快照读取"""
+    app.app.config['CATALOG_SNAPSHOT_ENABLED'] = True
+    try:
+        user.get('/api/images/2')
+        app.background_jobs.join()
+        return user.get('/api/images/2?page=3&sort=size')
+    finally:
+        app.app.config['CATALOG_SNAPSHOT_ENABLED'] = False
+
+
+def integrity_sweep(admin):
+    """不限速地检查两批图片（开始新的一轮并检查第一批，再从检查点继续），然后查看检查状态"""
+    app.integrity_throttles = (app.integrity.Throttle(0), app.integrity.Throttle(0))
+    app.check_integrity_batch()
+    app.check_integrity_batch()
+    return admin.get('/api/admin/integrity')
+
+
+def scenarios(user_id):
+    """(名称, func(admin_client, user_client, guest_client))"""
+    upload = make_image_bytes()
+    return [
+        ('首页和分类列表', lambda admin, user, guest: (guest.get('/'), user.get('/'), user.get('/api/categories'))),
+        ('分类页面', lambda admin, user, guest: user.get('/category/2')),
+        ('图片列表（默认排序）', lambda admin, user, guest: (
+            user.get('/api/images/2'), user.get('/api/images/2?page=20&sort=asc'), user.get('/api/images/2?format=compact'))),
+        ('图片列表（排序和筛选）', lambda admin, user, guest: [
+            user.get(f'/api/images/2?{query}') for query in (
+                'sort=size', 'sort=resolution', 'sort=upload_time&order=asc', 'sort=popular', 'sort=views',
+                'min_width=3840&min_height=2160', 'orientation=portrait', 'aspect=16:9', 'search=img1',
+                'facets=1')]),
+        ('图片列表（共享快照）', lambda admin, user, guest: snapshot_listing(user)),
+        ('分类内图片列表（旧接口）', lambda admin, user, guest: user.get('/api/category/2/images')),
+        ('图片详情', lambda admin, user, guest: (
+            user.get('/api/image/2'), user.get('/api/images/detail?ids=2,6,10,3'))),
+        ('原图', lambda admin, user, guest: (guest.get('/uploads/img10.jpg'), guest.get('/uploads/missing.jpg'))),
+        ('按颜色搜索', lambda admin, user, guest: (
+            user.get('/api/search?color=%232a6fdb'), user.get('/api/search?color=%232a6fdb&category=2'))),
+        ('标签查询', lambda admin, user, guest: (
+            user.get('/api/tags'), user.get('/api/tags/images?q=nature AND dark NOT anime'),
+            user.get('/api/tags/images?q=nature&category=2'))),
+        ('时间轴', lambda admin, user, guest: (
+            user.get('/api/timeline/2?granularity=year'), user.get('/api/timeline/2?granularity=day&within=2025-03'),
+            user.get('/api/timeline/2/jump?to=2025-03'))),
+        ('最新图片动态', lambda admin, user, guest: (
+            admin.get('/api/feed'), user.get('/api/feed?before=' + user.get('/api/feed').get_json()['next_cursor']))),
+        ('分类概览拼图', lambda admin, user, guest: user.get('/api/sprites/2?per_page=20')),
+        ('批量下载', lambda admin, user, guest: user.get('/api/download.zip?ids=2,6').get_data()),
+        ('管理后台', lambda admin, user, guest: (
+            admin.get('/admin/dashboard'), admin.get(f'/admin/get_user_permissions/{user_id}'))),
+        ('上传图片', lambda admin, user, guest: (
+            admin.post('/admin/upload', data={'category_id': '2', 'file': (io.BytesIO(upload), 'new.jpg')},
+                       content_type='multipart/form-data'),
+            admin.post('/admin/upload_image', data={'category_id': '3', 'images[]': [(io.BytesIO(upload), 'new2.jpg')]},
+                       content_type='multipart/form-data'))),
+        ('扫描文件夹', lambda admin, user, guest: admin.post('/admin/scan_folder/2')),
+        ('标签批量修改', lambda admin, user, guest: admin.post(
+            '/api/tags/bulk', json={'action': 'add', 'tags': ['new'], 'ids': [3, 7, 11]})),
+        ('批量移动和删除', lambda admin, user, guest: (
+            admin.post('/api/images/bulk', json={'action': 'move', 'ids': [4, 8], 'category_id': 3}),
+            admin.post('/api/images/bulk', json={'action': 'delete', 'ids': [12, 16]}),
+            admin.delete('/api/images/20'))),
+        ('用户权限', lambda admin, user, guest: admin.post(
+            f'/admin/set_user_permissions/{user_id}', data={'category_ids[]': ['2', '3', '4']})),
+        ('一致性检查', lambda admin, user, guest: integrity_sweep(admin)),
+        ('删除分类', lambda admin, user, guest: admin.post('/admin/delete_category/4')),
+    ]
+
+
+def traced_connection(statements):
+    conn = sqlite3.connect(app.DATABASE, factory=app.MetricsConnection)
+    conn.set_trace_callback(statements.append)
+    return conn
+
+
+def collect_statements(user_id):
+    """按场景记录实际执行的语句 {场景名: [规范化的SQL]}，同时保留每条语句的一个原始版本用于查看查询计划"""
+    app.app.config['TESTING'] = True
+    app.app.config['RATE_LIMIT_ENABLED'] = False
+    admin, user, guest = app.app.test_client(), app.app.test_client(), app.app.test_client()
+    with admin.session_transaction() as session:
+        session['admin_logged_in'] = True
+        session['admin_username'] = 'admin'
+    with user.session_transaction() as session:
+        session['user_logged_in'] = True
+        session['user_username'] = 'viewer'
+
+    original_connect = app.get_db_connection
+    collected = {}
+    examples = {}
+    try:
+        for name, run in scenarios(user_id):
+            statements = []
+            app.get_db_connection = lambda: traced_connection(statements)
+            run(admin, user, guest)
+            app.background_jobs.join()
+            normalized = set()
+            for sql in statements:
+                if not CHECKED_STATEMENT.match(sql):
+                    continue
+                key = normalize(sql)
+                examples.setdefault(key, sql)
+                normalized.add(key)
+            # 后台任务与请求交错执行，按文本排序使快照稳定
+            collected[name] = sorted(normalized)
+    finally:
+        app.get_db_connection = original_connect
+    return collected, examples
+
+
+def explain(conn, sql):
+    """返回缩进格式的查询计划行"""
+    rows = conn.execute("EXPLAIN QUERY PLAN " + sql).fetchall()
+    depth = {0: -1}
+    lines = []
+    for node_id, parent_id, _, detail in rows:
+        depth[node_id] = depth.get(parent_id, -1) + 1
+        lines.append('    ' * depth[node_id] + detail)
+    return lines
+
+
+def find_full_scans(sql, plan):
+    scans = []
+    for line in plan:
+        match = re.match(r'\s*SCAN (\w+)(?: AS \w+)?\s*$', line)
+        if match and match.group(1) in LARGE_TABLES:
+            if not any(fragment in sql for fragment in ALLOWED_SCANS):
+                scans.append(line.strip())
+    return scans
+
+
+def build_report(collected, examples):
+    conn = sqlite3.connect(app.DATABASE)
+    lines = []
+    problems = []
+    try:
+        for name, statements in collected.items():
+            lines.append(f"## {name}")
+            for sql in statements:
+                try:
+                    plan = explain(conn, examples[sql])
+                except sqlite3.Error as e:
+                    # 执行时已删除的临时对象等，无法再次查看查询计划
+                    plan = [f"(无法获取查询计划: {e})"]
+                lines.append(sql)
+                lines.extend('    ' + line for line in plan)
+                for scan in find_full_scans(sql, plan):
+                    problems.append(f"[{name}] {scan}: {sql}")
+            lines.append('')
+    finally:
+        conn.close()
+    return '\n'.join(lines), problems
+
+
+def run():
+    with tempfile.TemporaryDirectory() as temp_dir:
+        app.DATABASE = os.path.join(temp_dir, 'plans.db')
+        app.SPRITE_FOLDER = os.path.join(temp_dir, 'sprites')
+        app.app.config['CATALOG_SNAPSHOT_FOLDER'] = os.path.join(temp_dir, 'catalog')
+        app.app.config['VIEW_COUNTING_ENABLED'] = False
+        app.init_db()
+        user_id = seed(os.path.join(temp_dir, 'uploads'))
+        collected, examples = collect_statements(user_id)
+        return build_report(collected, examples)
+
+
+def main():
+    update = '--update' in sys.argv[1:]
+    report, problems = run()
+
+    if update:
+        with open(SNAPSHOT_PATH, 'w', encoding='utf-8') as f:
+            f.write(report)
+        print(f"已更新查询计划快照: {SNAPSHOT_PATH}")
+    else:
+        try:
+            with open(SNAPSHOT_PATH, 'r', encoding='utf-8') as f:
+                snapshot = f.read()
+        except FileNotFoundError:
+            snapshot = ''
+        if snapshot != report:
+            diff = difflib.unified_diff(snapshot.splitlines(), report.splitlines(), 'query_plans.txt', '当前', lineterm='')
+            print('\n'.join(diff))
+            problems.append("查询计划与快照不一致，确认变化符合预期后运行 python check_query_plans.py --update")
+
+    for problem in problems:
+        print(f"失败: {problem}")
+    if problems:
+        sys.exit(1)
+    print("查询计划检查通过")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,30 @@
+# Pillow的延迟导入
+# Pillow导入较慢，应用、主色调提取、缩略图拼图和动图转码都在首次需要时才通过这里导入，避免拖慢应用启动；
+# 没有安装Pillow时返回None，依赖它的功能不可用，其他功能照常使用。
+
+_image = None
+_image_ops = None
+
+
+def image_module():
+    """返回PIL.Image模块，首次调用时导入；未安装Pillow时返回None"""
+    global _image
+    if _image is None:
+        try:
+            from PIL import Image
+        except ImportError:
+            return None
+        _image = Image
+    return _image
+
+
+def image_ops_module():
+    """返回PIL.ImageOps模块，首次调用时导入；未安装Pillow时返回None"""
+    global _image_ops
+    if _image_ops is None:
+        try:
+            from PIL import ImageOps
+        except ImportError:
+            return None
+        _image_ops = ImageOps
+    return _image_ops
@@ -0,0 +1,75 @@
+import hashlib
+import threading
+import time
+
+# 图片目录与磁盘的一致性检查
+# 后台线程按id顺序分批检查images表中的图片：文件是否存在、大小和修改时间是否与数据库一致（可选校验内容摘要），
+# 每批的检查结果和检查到的位置（检查点）一起提交，应用重启后从检查点继续。
+# 文件访问按Throttle限速，检查得再慢也不影响前台请求。
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+
+class Throttle(object):
+    """按固定速率放行：consume(amount)在必要时等待，使平均速率不超过每秒rate个单位；rate为0或None时不限速"""
+
+    def __init__(self, rate, clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.clock = clock
+        self.sleep = sleep
+        self._next = clock()
+
+    def consume(self, amount=1):
+        if not self.rate:
+            return
+        now = self.clock()
+        if self._next > now:
+            self.sleep(self._next - now)
+            now = self._next
+        self._next = max(self._next, now) + amount / self.rate
+
+
+def hash_file(open_file, path, throttle=None):
+    """计算文件的SHA-256，open_file(path)返回文件对象，每读取一块按字节数限速"""
+    digest = hashlib.sha256()
+    with open_file(path) as f:
+        for data in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            if throttle is not None:
+                throttle.consume(len(data))
+            digest.update(data)
+    return digest.hexdigest()
+
+
+class Sweeper(object):
+    """
+    在后台线程中反复调用check_batch()，它返回下次调用前等待的秒数（0表示立即继续）
+    check_batch抛出异常时等待error_seconds后重试
+    """
+
+    def __init__(self, check_batch, error_seconds=60.0):
+        self.check_batch = check_batch
+        self.error_seconds = error_seconds
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='integrity-sweeper', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def is_running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                delay = self.check_batch()
+            except Exception as e:
+                print(f"一致性检查失败: {e}")
+                delay = self.error_seconds
+            if delay:
+                self._stop.wait(delay)
@@ -0,0 +1,271 @@
+import concurrent.futures
+import io
+import threading
+import time
+
+# 按分类文件夹（根目录）隔离的文件访问
+# 分类文件夹可能位于缓慢或不稳定的网络挂载点上，挂载点无响应时os.stat、open等调用会一直阻塞。
+# IOGuard把每次文件访问交给该根目录自己的有界线程池执行，调用方最多等待timeout秒；
+# 每个根目录同时执行中的调用数有上限，无响应的挂载点只会占满自己的线程池，不会拖垮其他分类。
+# 每个根目录有一个断路器：连续失败（超时、I/O错误或并发已满）达到阈值后断开，断开期间的调用立即失败，
+# 经过reset_seconds后放行一次试探调用，成功则恢复，失败则继续断开。
+
+
+class FolderUnavailable(OSError):
+    """根目录的断路器已断开或并发调用已满，调用没有执行"""
+
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# 延迟的指数滑动平均系数
+LATENCY_ALPHA = 0.2
+
+
+class FolderHealth(object):
+    """一个根目录的访问统计和断路器状态，由IOGuard加锁访问"""
+
+    def __init__(self, root):
+        self.root = root
+        self.state = CLOSED
+        self.calls = 0
+        self.errors = 0
+        self.timeouts = 0
+        self.rejected = 0
+        self.in_flight = 0
+        self.consecutive_failures = 0
+        self.latency_ms = None
+        self.max_latency_ms = 0.0
+        self.opened_at = None
+        self.last_error = None
+        self.last_error_at = None
+        self.probing = False
+
+    def to_dict(self):
+        return {
+            'root': self.root,
+            'state': self.state,
+            'calls': self.calls,
+            'errors': self.errors,
+            'timeouts': self.timeouts,
+            'rejected': self.rejected,
+            'in_flight': self.in_flight,
+            'latency_ms': round(self.latency_ms, 2) if self.latency_ms is not None else None,
+            'max_latency_ms': round(self.max_latency_ms, 2),
+            'last_error': self.last_error,
+            'last_error_at': self.last_error_at
+        }
+
+
+class IOGuard(object):
+    """
+    在线程池中执行文件访问，按根目录统计延迟和错误并断路
+    每个根目录有自己的线程池（首次访问时创建，线程按需启动），max_per_root为其大小，也是同时执行的调用数上限
+    """
+
+    def __init__(self, max_per_root=8, timeout=10.0, failure_threshold=5, reset_seconds=30.0, clock=time.monotonic):
+        self.timeout = timeout
+        self.max_per_root = max_per_root
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.clock = clock
+        self._executors = {}
+        self._folders = {}
+        self._lock = threading.Lock()
+
+    def _admit(self, root):
+        """检查断路器和并发上限，允许调用时返回该根目录的线程池"""
+        with self._lock:
+            health = self._folders.get(root)
+            if health is None:
+                health = self._folders[root] = FolderHealth(root)
+            if health.state == OPEN:
+                if self.clock() - health.opened_at < self.reset_seconds:
+                    health.rejected += 1
+                    raise FolderUnavailable(f"文件夹暂时不可用: {root}")
+                health.state = HALF_OPEN
+            if health.state == HALF_OPEN:
+                # 半开状态只放行一次试探调用
+                if health.probing:
+                    health.rejected += 1
+                    raise FolderUnavailable(f"文件夹暂时不可用: {root}")
+                health.probing = True
+            if health.in_flight >= self.max_per_root:
+                health.rejected += 1
+                self._record_failure(health, '同时进行的访问过多')
+                raise FolderUnavailable(f"文件夹访问过多，可能已无响应: {root}")
+            health.in_flight += 1
+            health.calls += 1
+            executor = self._executors.get(root)
+            if executor is None:
+                executor = self._executors[root] = concurrent.futures.ThreadPoolExecutor(
+                    max_workers=self.max_per_root, thread_name_prefix='io-guard')
+            return executor
+
+    def _record_failure(self, health, message):
+        health.consecutive_failures += 1
+        health.last_error = message
+        health.last_error_at = time.time()
+        health.probing = False
+        if health.state == HALF_OPEN or health.consecutive_failures >= self.failure_threshold:
+            health.state = OPEN
+            health.opened_at = self.clock()
+
+    def _finish(self, root, elapsed, error):
+        """调用在线程池中真正结束（或被取消）时记录结果，超时的调用结束得更晚；elapsed为None表示没有执行"""
+        with self._lock:
+            health = self._folders[root]
+            health.in_flight -= 1
+            if error is None and elapsed is not None:
+                elapsed_ms = elapsed * 1000
+                health.latency_ms = elapsed_ms if health.latency_ms is None else (
+                    health.latency_ms + LATENCY_ALPHA * (elapsed_ms - health.latency_ms))
+                health.max_latency_ms = max(health.max_latency_ms, elapsed_ms)
+
+    def _record(self, root, error):
+        with self._lock:
+            health = self._folders[root]
+            if error is None:
+                health.consecutive_failures = 0
+                health.probing = False
+                health.state = CLOSED
+            else:
+                if isinstance(error, TimeoutError):
+                    health.timeouts += 1
+                else:
+                    health.errors += 1
+                self._record_failure(health, str(error))
+
+    def run(self, root, func, *args):
+        """
+        在线程池中执行func(*args)并返回结果，超时抛出TimeoutError，断路时抛出FolderUnavailable
+        文件不存在（FileNotFoundError）和非I/O异常不计为失败
+        """
+        executor = self._admit(root)
+
+        def call():
+            start = time.perf_counter()
+            error = None
+            try:
+                return func(*args)
+            except OSError as e:
+                error = e
+                raise
+            finally:
+                self._finish(root, time.perf_counter() - start, error)
+
+        future = executor.submit(call)
+        try:
+            result = future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            # 还在排队的调用直接取消；已经开始的调用仍在等待挂载点响应，结束时才会释放并发名额
+            if future.cancel():
+                self._finish(root, None, None)
+            error = TimeoutError(f"文件访问超时（{self.timeout:g}秒）: {root}")
+            self._record(root, error)
+            raise error
+        except FileNotFoundError:
+            self._record(root, None)
+            raise
+        except OSError as e:
+            self._record(root, e)
+            raise
+        except Exception:
+            self._record(root, None)
+            raise
+        self._record(root, None)
+        return result
+
+    def health(self):
+        """返回各根目录的状态，按根目录排序"""
+        with self._lock:
+            folders = [self._folders[root] for root in sorted(self._folders)]
+            now = self.clock()
+            result = []
+            for health in folders:
+                item = health.to_dict()
+                # 断开时间已到但还没有新的调用时，显示为等待试探
+                if health.state == OPEN and now - health.opened_at >= self.reset_seconds:
+                    item['state'] = HALF_OPEN
+                result.append(item)
+            return result
+
+
+class _GuardedFile(io.RawIOBase):
+    """open()返回的文件对象：每次读取和定位都在根目录的保护下执行，读取到一半挂载点无响应时同样超时"""
+
+    def __init__(self, guard, root, inner):
+        self._guard = guard
+        self._root = root
+        self._inner = inner
+        self._timed_out = False
+
+    def _run(self, func, *args):
+        if self._timed_out:
+            # 超时的调用可能还在执行，文件位置不确定，不再继续读取
+            raise TimeoutError(f"文件访问已超时: {self._root}")
+        try:
+            return self._guard.run(self._root, func, *args)
+        except TimeoutError:
+            self._timed_out = True
+            raise
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        # 在线程池中读取到新的bytes再复制，超时后迟到的读取不会写入调用方的缓冲区
+        data = self._run(self._inner.read, len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def seekable(self):
+        return True
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        return self._run(self._inner.seek, offset, whence)
+
+    def tell(self):
+        return self._inner.tell()
+
+    def close(self):
+        if not self.closed:
+            if self._timed_out:
+                # 超时的读取仍占用着文件，在后台关闭，不阻塞调用方
+                threading.Thread(target=self._inner.close, daemon=True).start()
+            else:
+                self._inner.close()
+        super().close()
+
+
+class GuardedStorage(object):
+    """
+    包装本地存储后端，读取类的操作通过IOGuard执行，root_for(path)返回文件所属的根目录
+    open()返回的文件对象之后的读取也受保护；写入、删除和遍历由管理操作和后台任务执行，直接调用原存储后端
+    """
+
+    GUARDED_METHODS = ('stat', 'exists', 'folder_exists', 'read', 'read_range')
+
+    def __init__(self, inner, guard, root_for):
+        self.inner = inner
+        self.guard = guard
+        self.root_for = root_for
+
+    def __getattr__(self, name):
+        attribute = getattr(self.inner, name)
+        if name not in self.GUARDED_METHODS:
+            return attribute
+
+        def guarded(path, *args):
+            return self.guard.run(self.root_for(path), attribute, path, *args)
+        return guarded
+
+    def open(self, path):
+        root = self.root_for(path)
+        inner = self.guard.run(root, self.inner.open, path)
+        return io.BufferedReader(_GuardedFile(self.guard, root, inner), 1024 * 1024)
+
+    def call(self, path, func, *args):
+        """在path所属根目录的保护下执行任意文件访问（如用Pillow读取图片尺寸）"""
+        return self.guard.run(self.root_for(path), func, *args)
@@ -0,0 +1,106 @@
+import queue
+import threading
+import time
+import uuid
+
+# 后台任务队列
+# 单个守护线程按提交顺序执行任务，避免大量文件操作同时占用磁盘；任务状态保存在内存中，可通过任务ID查询进度。
+# 耗时很长的任务可以分段执行：任务函数返回RESCHEDULE时，同一个任务（ID和进度不变）排到队列末尾，先执行其他任务再继续。
+
+RESCHEDULE = object()
+
+
+class Job(object):
+    def __init__(self, kind, total=0):
+        self.id = uuid.uuid4().hex[:16]
+        self.kind = kind
+        self.status = 'queued'
+        self.total = total
+        self.done = 0
+        self.failed = 0
+        self.errors = []
+        self.created_at = time.time()
+        self.finished_at = None
+
+    def advance(self, count=1):
+        """记录完成的步骤数"""
+        self.done += count
+
+    def fail(self, message, count=1):
+        """记录失败的步骤，只保留最近的部分错误信息"""
+        self.failed += count
+        self.errors.append(message)
+        if len(self.errors) > 20:
+            del self.errors[0]
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'kind': self.kind,
+            'status': self.status,
+            'total': self.total,
+            'done': self.done,
+            'failed': self.failed,
+            'errors': list(self.errors),
+            'created_at': self.created_at,
+            'finished_at': self.finished_at
+        }
+
+
+class JobQueue(object):
+    def __init__(self, max_finished=200):
+        self.max_finished = max_finished
+        self._queue = queue.Queue()
+        self._jobs = {}
+        self._finished = []
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def submit(self, kind, target, *args, total=0):
+        """提交任务，target(job, *args)在后台线程中执行（返回RESCHEDULE时稍后再次执行），返回任务对象"""
+        job = Job(kind, total)
+        with self._lock:
+            self._jobs[job.id] = job
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='background-jobs', daemon=True)
+                self._thread.start()
+        self._queue.put((job, target, args))
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self, kind=None):
+        with self._lock:
+            jobs = list(self._jobs.values())
+        return [job for job in jobs if kind is None or job.kind == kind]
+
+    def _run(self):
+        while True:
+            job, target, args = self._queue.get()
+            job.status = 'running'
+            try:
+                if target(job, *args) is RESCHEDULE:
+                    job.status = 'queued'
+                    self._queue.put((job, target, args))
+                    self._queue.task_done()
+                    continue
+                job.status = 'done'
+            except Exception as e:
+                job.fail(str(e))
+                job.status = 'failed'
+            job.finished_at = time.time()
+            self._retire(job)
+            self._queue.task_done()
+
+    def _retire(self, job):
+        # 只保留最近完成的任务记录
+        with self._lock:
+            self._finished.append(job.id)
+            while len(self._finished) > self.max_finished:
+                self._jobs.pop(self._finished.pop(0), None)
+
+    def join(self):
+        """等待队列中的任务全部完成（用于脚本和调试）"""
+        self._queue.join()
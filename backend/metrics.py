@@ -0,0 +1,177 @@
+import threading
+import time
+from bisect import bisect_left
+
+# Prometheus风格的指标收集
+# 每个线程写入自己的分片（shard），热路径上不加锁；只有在线程第一次写入和导出指标时才需要获取锁。
+# 已结束线程的分片会在导出时合并到retired分片中，避免每请求一个线程的服务器无限累积分片。
+
+# 默认的延迟直方图桶（秒）
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# 指标元数据：名称 -> (类型, 帮助文本, 桶)
+_metric_meta = {}
+
+_registry_lock = threading.Lock()
+_live_shards = []
+_local = threading.local()
+
+
+class _Shard(object):
+    __slots__ = ('counters', 'histograms')
+
+    def __init__(self):
+        # (name, labels) -> 数值
+        self.counters = {}
+        # (name, labels) -> [各桶计数列表, 总和]
+        self.histograms = {}
+
+    def merge(self, other):
+        for key, value in list(other.counters.items()):
+            self.counters[key] = self.counters.get(key, 0) + value
+        for key, (counts, total) in list(other.histograms.items()):
+            entry = self.histograms.get(key)
+            if entry is None:
+                self.histograms[key] = [list(counts), total]
+            else:
+                entry[0] = [a + b for a, b in zip(entry[0], counts)]
+                entry[1] += total
+
+
+_retired = _Shard()
+
+
+def _get_shard():
+    shard = getattr(_local, 'shard', None)
+    if shard is None:
+        shard = _Shard()
+        _local.shard = shard
+        with _registry_lock:
+            _live_shards.append((threading.current_thread(), shard))
+    return shard
+
+
+def _label_key(labels):
+    if not labels:
+        return ()
+    return tuple(sorted(labels.items()))
+
+
+def register_counter(name, help_text):
+    _metric_meta[name] = ('counter', help_text, None)
+
+
+def register_gauge(name, help_text):
+    # 仪表值同样按分片累加（+1/-1），导出时求和
+    _metric_meta[name] = ('gauge', help_text, None)
+
+
+def register_histogram(name, help_text, buckets=DEFAULT_BUCKETS):
+    _metric_meta[name] = ('histogram', help_text, tuple(buckets))
+
+
+def inc(name, value=1, **labels):
+    shard = _get_shard()
+    key = (name, _label_key(labels))
+    shard.counters[key] = shard.counters.get(key, 0) + value
+
+
+def dec(name, value=1, **labels):
+    inc(name, -value, **labels)
+
+
+def observe(name, value, **labels):
+    buckets = _metric_meta[name][2]
+    shard = _get_shard()
+    key = (name, _label_key(labels))
+    entry = shard.histograms.get(key)
+    if entry is None:
+        entry = [[0] * (len(buckets) + 1), 0.0]
+        shard.histograms[key] = entry
+    # 只记录落入的那个桶，导出时再做累加
+    entry[0][bisect_left(buckets, value)] += 1
+    entry[1] += value
+
+
+class timer(object):
+    """计时上下文管理器，退出时把耗时记录到直方图中"""
+
+    def __init__(self, name, **labels):
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.elapsed = time.perf_counter() - self.start
+        observe(self.name, self.elapsed, **self.labels)
+        return False
+
+
+def _collect():
+    # 合并已结束线程的分片，并汇总所有存活分片的快照
+    global _live_shards
+    snapshot = _Shard()
+    with _registry_lock:
+        alive = []
+        for thread, shard in _live_shards:
+            if thread.is_alive():
+                alive.append((thread, shard))
+            else:
+                _retired.merge(shard)
+        _live_shards = alive
+        snapshot.merge(_retired)
+        for _, shard in alive:
+            snapshot.merge(shard)
+    return snapshot
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels)
+    if extra:
+        items.append(extra)
+    if not items:
+        return ''
+    return '{' + ','.join('%s="%s"' % (k, _escape(v)) for k, v in items) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+def render_latest():
+    """以Prometheus文本格式（0.0.4）导出所有指标"""
+    snapshot = _collect()
+    by_name = {}
+    for (name, labels), value in snapshot.counters.items():
+        by_name.setdefault(name, []).append((labels, value))
+    for (name, labels), value in snapshot.histograms.items():
+        by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name in sorted(_metric_meta):
+        metric_type, help_text, buckets = _metric_meta[name]
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, metric_type))
+        for labels, value in sorted(by_name.get(name, []), key=lambda item: item[0]):
+            if metric_type == 'histogram':
+                counts, total = value
+                cumulative = 0
+                for bound, count in zip(buckets + (float('inf'),), counts):
+                    cumulative += count
+                    lines.append('%s_bucket%s %d' % (name, _format_labels(labels, ('le', _format_value(float(bound)))), cumulative))
+                lines.append('%s_sum%s %s' % (name, _format_labels(labels), _format_value(total)))
+                lines.append('%s_count%s %d' % (name, _format_labels(labels), cumulative))
+            else:
+                lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+    return '\n'.join(lines) + '\n'
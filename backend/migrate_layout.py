@@ -0,0 +1,200 @@
+import argparse
+import hashlib
+import os
+import time
+
+# 把已有的图片迁移到托管目录结构（<分类文件夹>/ab/cd/<摘要>.<扩展名>，见app.py中的MANAGED_UPLOAD_LAYOUT）
+# 可以在应用运行时执行：每张图片先在数据库中记录内容摘要（认领），再复制（同一文件系统上为硬链接）到新位置，
+# 更新路径后删除原文件。任何时刻数据库中的路径都指向存在的文件；扫描文件夹时看到摘要已有记录的新文件不会重复添加。
+# 每批单独提交，中断后重新运行会从尚未迁移（没有摘要，或已认领但路径还不是托管路径）的图片继续。
+# 默认只迁移uploads目录中的分类（通过上传添加的图片），扫描导入的外部文件夹需要加 --all-folders。
+# 用法（在backend目录中运行）：python migrate_layout.py [--batch-size 200] [--pause 0.2] [--category ID] [--all-folders] [--dry-run]
+
+import app
+
+HASH_CHUNK_SIZE = 1024 * 1024
+# 尚未迁移的图片：没有内容摘要，或已认领（记录了摘要）但路径还不是托管路径（复制或更新路径前中断）
+PENDING_CONDITION = "content_hash IS NULL OR instr(filepath, content_hash) = 0"
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='把已有图片迁移到按内容摘要分目录的托管目录结构')
+    parser.add_argument('--batch-size', type=int, default=200, help='每批迁移的图片数')
+    parser.add_argument('--pause', type=float, default=0.2, help='每批之间暂停的秒数，减少对前台请求的影响')
+    parser.add_argument('--category', type=int, action='append', help='只迁移指定的分类，可重复')
+    parser.add_argument('--all-folders', action='store_true', help='同时迁移不在uploads目录中的分类文件夹')
+    parser.add_argument('--dry-run', action='store_true', help='只列出需要迁移的图片数，不修改文件和数据库')
+    return parser.parse_args()
+
+
+def is_inside(path, folder):
+    path, folder = os.path.abspath(path), os.path.abspath(folder)
+    return os.path.commonpath([path, folder]) == folder
+
+
+def eligible_categories(args):
+    """返回可以迁移的分类 {分类ID: 文件夹路径}"""
+    conn = app.get_db_connection()
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, folder_path FROM categories")
+        categories = dict(cursor.fetchall())
+    finally:
+        conn.close()
+    if args.category:
+        categories = {category_id: folder for category_id, folder in categories.items() if category_id in args.category}
+    if not args.all_folders and not app.get_storage().remote:
+        categories = {category_id: folder for category_id, folder in categories.items()
+                      if is_inside(folder, app.UPLOAD_FOLDER)}
+    return categories
+
+
+def hash_file(store, path):
+    digest = hashlib.sha256()
+    with store.open(path) as f:
+        for data in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            digest.update(data)
+    return digest.hexdigest()
+
+
+def next_batch(categories, last_id, batch_size):
+    conn = app.get_db_connection()
+    try:
+        cursor = conn.cursor()
+        placeholders = ','.join('?' * len(categories))
+        cursor.execute(
+            f"SELECT id, filepath, category_id FROM images WHERE ({PENDING_CONDITION}) AND id > ? "
+            f"AND category_id IN ({placeholders}) ORDER BY id LIMIT ?",
+            [last_id] + list(categories) + [batch_size]
+        )
+        return cursor.fetchall()
+    finally:
+        conn.close()
+
+
+def migrate_batch(rows, categories, store):
+    """迁移一批图片，返回(迁移数, 失败数)"""
+    # 1. 计算摘要，在一个短事务中认领：先记录摘要，扫描文件夹时看到新位置的文件就知道它已有记录
+    hashed = []
+    for image_id, filepath, category_id in rows:
+        try:
+            content_hash = hash_file(store, filepath)
+            target = app.get_managed_path(categories[category_id], content_hash, os.path.splitext(filepath)[1])
+            hashed.append((image_id, filepath, target, content_hash))
+        except Exception as e:
+            print(f"  跳过 {filepath}: {e}")
+    claimed = []
+    conn = app.get_db_connection()
+    try:
+        cursor = conn.cursor()
+        for image_id, filepath, target, content_hash in hashed:
+            # 期间被移动或删除的图片（路径已变化）不迁移
+            cursor.execute(
+                f"UPDATE images SET content_hash = ? WHERE id = ? AND filepath = ? AND ({PENDING_CONDITION})",
+                (content_hash, image_id, filepath)
+            )
+            if cursor.rowcount:
+                claimed.append((image_id, filepath, target, content_hash))
+        conn.commit()
+    finally:
+        conn.close()
+
+    # 2. 复制到新位置，复制失败的图片取消认领
+    copied = []
+    for image_id, filepath, target, content_hash in claimed:
+        try:
+            if not store.exists(target):
+                store.copy(filepath, target)
+            copied.append((image_id, filepath, target, content_hash))
+        except Exception as e:
+            print(f"  跳过 {filepath}: {e}")
+            conn = app.get_db_connection()
+            try:
+                conn.execute("UPDATE images SET content_hash = NULL WHERE id = ? AND filepath = ? AND content_hash = ?",
+                             (image_id, filepath, content_hash))
+                conn.commit()
+            finally:
+                conn.close()
+
+    # 3. 在一个短事务中更新路径；期间被移动或删除的图片（路径已变化）不更新
+    conn = app.get_db_connection()
+    try:
+        cursor = conn.cursor()
+        migrated = []
+        for image_id, filepath, target, content_hash in copied:
+            cursor.execute(
+                "UPDATE images SET filepath = ? WHERE id = ? AND filepath = ? AND content_hash = ?",
+                (target, image_id, filepath, content_hash)
+            )
+            if cursor.rowcount:
+                migrated.append((image_id, filepath, target))
+            elif not app.is_file_referenced(target):
+                store.delete(target)
+        conn.commit()
+    finally:
+        conn.close()
+
+    # 4. 数据库已指向新位置，删除原文件和按原路径生成的派生文件
+    in_use = still_used([filepath for _, filepath, _ in migrated])
+    for image_id, filepath, target in migrated:
+        try:
+            if filepath not in in_use:
+                store.delete(filepath)
+            for hook in app.derived_file_cleanup_hooks:
+                hook(image_id, filepath)
+        except Exception as e:
+            print(f"  删除原文件失败 {filepath}: {e}")
+    return len(migrated), len(rows) - len(migrated)
+
+
+def still_used(filepaths):
+    """返回其中仍被尚未迁移的图片使用的原文件路径（filepath没有索引，每批只查询一次）"""
+    used = set()
+    conn = app.get_db_connection()
+    try:
+        cursor = conn.cursor()
+        for chunk in app.chunked(filepaths):
+            placeholders = ','.join('?' * len(chunk))
+            cursor.execute(f"SELECT filepath FROM images WHERE ({PENDING_CONDITION}) AND filepath IN ({placeholders})", chunk)
+            used.update(row[0] for row in cursor.fetchall())
+    finally:
+        conn.close()
+    return used
+
+
+def main():
+    args = parse_args()
+    app.init_db()
+    store = app.get_storage()
+    categories = eligible_categories(args)
+    if not categories:
+        print("没有需要迁移的分类")
+        return
+
+    print(f"迁移分类: {', '.join(str(category_id) for category_id in sorted(categories))}")
+    last_id = 0
+    total_migrated = 0
+    total_failed = 0
+    start = time.perf_counter()
+    while True:
+        rows = next_batch(categories, last_id, args.batch_size)
+        if not rows:
+            break
+        last_id = rows[-1][0]
+        if args.dry_run:
+            total_migrated += len(rows)
+            continue
+        migrated, failed = migrate_batch(rows, categories, store)
+        total_migrated += migrated
+        total_failed += failed
+        print(f"  已迁移 {total_migrated} 张，失败 {total_failed} 张（ID ≤ {last_id}）")
+        time.sleep(args.pause)
+
+    if args.dry_run:
+        print(f"需要迁移 {total_migrated} 张图片")
+    else:
+        print(f"完成：迁移 {total_migrated} 张，失败 {total_failed} 张，耗时 {time.perf_counter() - start:.1f} 秒")
+
+
+if __name__ == '__main__':
+    main()
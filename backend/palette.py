@@ -0,0 +1,119 @@
+import re
+
+import imaging
+
+# 图片主色调提取和LAB颜色空间量化
+# 提取时先把图片缩小（JPEG使用draft模式直接按1/8等比例解码），再用Pillow内置的中位切分算法量化为少量颜色。
+# 颜色转换到CIELAB空间后按固定步长划分为桶，桶编号可以直接建索引，搜索时只需要查询相邻的几个桶。
+
+PALETTE_SIZE = 5
+SAMPLE_SIZE = 64
+
+# LAB桶的步长：L为0~100，a和b约为-128~127
+L_STEP = 10
+AB_STEP = 16
+L_BUCKETS = 100 // L_STEP + 1
+AB_BUCKETS = 256 // AB_STEP
+
+_HEX_COLOR = re.compile(r'^#?([0-9a-fA-F]{6}|[0-9a-fA-F]{3})$')
+
+
+def parse_hex_color(value):
+    """解析#rrggbb或#rgb格式的颜色，返回(r, g, b)，格式错误时返回None"""
+    match = _HEX_COLOR.match((value or '').strip())
+    if not match:
+        return None
+    digits = match.group(1)
+    if len(digits) == 3:
+        digits = ''.join(ch * 2 for ch in digits)
+    return tuple(int(digits[i:i + 2], 16) for i in (0, 2, 4))
+
+
+def _srgb_to_linear(channel):
+    channel /= 255.0
+    if channel <= 0.04045:
+        return channel / 12.92
+    return ((channel + 0.055) / 1.055) ** 2.4
+
+
+def _lab_f(t):
+    if t > 216 / 24389:
+        return t ** (1 / 3)
+    return (24389 / 27 * t + 16) / 116
+
+
+def rgb_to_lab(rgb):
+    """sRGB转换为CIELAB（D65白点）"""
+    r, g, b = (_srgb_to_linear(c) for c in rgb)
+    x = (0.4124564 * r + 0.3575761 * g + 0.1804375 * b) / 0.95047
+    y = 0.2126729 * r + 0.7151522 * g + 0.0721750 * b
+    z = (0.0193339 * r + 0.1191920 * g + 0.9503041 * b) / 1.08883
+    fx, fy, fz = _lab_f(x), _lab_f(y), _lab_f(z)
+    return (116 * fy - 16, 500 * (fx - fy), 200 * (fy - fz))
+
+
+def _bucket_coords(lab):
+    l, a, b = lab
+    li = min(max(int(l // L_STEP), 0), L_BUCKETS - 1)
+    ai = min(max(int((a + 128) // AB_STEP), 0), AB_BUCKETS - 1)
+    bi = min(max(int((b + 128) // AB_STEP), 0), AB_BUCKETS - 1)
+    return li, ai, bi
+
+
+def _encode_bucket(li, ai, bi):
+    return (li * AB_BUCKETS + ai) * AB_BUCKETS + bi
+
+
+def lab_bucket(lab):
+    """返回LAB颜色所在桶的编号"""
+    return _encode_bucket(*_bucket_coords(lab))
+
+
+def neighbor_buckets(lab, radius=1):
+    """返回LAB颜色所在桶及其在三个维度上radius范围内的相邻桶"""
+    li, ai, bi = _bucket_coords(lab)
+    buckets = []
+    for dl in range(-radius, radius + 1):
+        for da in range(-radius, radius + 1):
+            for db in range(-radius, radius + 1):
+                l2, a2, b2 = li + dl, ai + da, bi + db
+                if 0 <= l2 < L_BUCKETS and 0 <= a2 < AB_BUCKETS and 0 <= b2 < AB_BUCKETS:
+                    buckets.append(_encode_bucket(l2, a2, b2))
+    return buckets
+
+
+def extract_palette(file_path, colors=PALETTE_SIZE):
+    """
+    提取图片的主色调，返回[(L, a, b, 占比), ...]，按占比从大到小排列
+    图片无法解析时返回None；读取文件出错（文件不存在、磁盘或网络错误等带errno的OSError）时抛出异常，
+    没有安装Pillow时抛出ImportError
+    """
+    Image = imaging.image_module()
+    if Image is None:
+        raise ImportError('没有安装Pillow')
+    try:
+        with Image.open(file_path) as img:
+            # JPEG可以在解码时直接缩小，避免解码完整的大图
+            img.draft('RGB', (SAMPLE_SIZE * 2, SAMPLE_SIZE * 2))
+            sample = img.convert('RGB')
+        sample.thumbnail((SAMPLE_SIZE, SAMPLE_SIZE))
+        quantized = sample.quantize(colors=colors, method=Image.Quantize.MEDIANCUT)
+        palette = quantized.getpalette()
+        counts = quantized.getcolors()
+    except OSError as e:
+        # Pillow解析失败时抛出的OSError没有errno
+        if e.errno is not None:
+            raise
+        return None
+    except Exception:
+        return None
+    if not counts:
+        return None
+
+    total = float(sum(count for count, _ in counts))
+    result = []
+    for count, index in sorted(counts, reverse=True):
+        rgb = tuple(palette[index * 3:index * 3 + 3])
+        l, a, b = rgb_to_lab(rgb)
+        result.append((l, a, b, count / total))
+    return result
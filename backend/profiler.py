@@ -0,0 +1,67 @@
+import collections
+import os
+import sys
+import threading
+import time
+
+# 采样式性能分析器
+# 后台线程按固定间隔读取被跟踪线程的调用栈并计数，请求结束后取出计数结果。
+# 只有在开启慢请求分析时才会启动，采样线程为守护线程；没有被跟踪的线程时等待下一次start()，不再轮询。
+
+
+def _stack_key(frame, max_depth):
+    # 生成"文件:行号:函数"形式、从外到内以分号连接的调用栈（与flamegraph折叠格式一致）
+    parts = []
+    while frame is not None and len(parts) < max_depth:
+        code = frame.f_code
+        parts.append('%s:%d:%s' % (os.path.basename(code.co_filename), frame.f_lineno, code.co_name))
+        frame = frame.f_back
+    parts.reverse()
+    return ';'.join(parts)
+
+
+class StackSampler(object):
+    def __init__(self, interval=0.005, max_depth=40):
+        self.interval = interval
+        self.max_depth = max_depth
+        self._targets = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """开始采样当前线程"""
+        ident = threading.get_ident()
+        with self._lock:
+            self._targets[ident] = collections.Counter()
+            self._wake.set()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+                self._thread.start()
+
+    def stop(self):
+        """停止采样当前线程，返回调用栈计数"""
+        with self._lock:
+            return self._targets.pop(threading.get_ident(), None)
+
+    def _run(self):
+        while True:
+            with self._lock:
+                if not self._targets:
+                    # 在锁内清除，start()添加目标后再设置，不会错过唤醒
+                    self._wake.clear()
+            self._wake.wait()
+            time.sleep(self.interval)
+            with self._lock:
+                frames = sys._current_frames()
+                for ident, counter in self._targets.items():
+                    frame = frames.get(ident)
+                    if frame is not None:
+                        counter[_stack_key(frame, self.max_depth)] += 1
+
+
+def top_stacks(counter, limit=10):
+    """返回采样次数最多的调用栈"""
+    if not counter:
+        return []
+    return [{'stack': stack, 'samples': count} for stack, count in counter.most_common(limit)]
@@ -0,0 +1,138 @@
+import math
+import threading
+import time
+
+# 请求限流
+# 令牌桶：每个客户端在每类接口上有一个桶，按固定速率补充令牌，每个请求消耗一个令牌，桶的容量决定允许的突发请求数。
+# 桶的状态默认保存在进程内存中（MemoryStore）；多进程部署时可换成共享存储（如RedisStore），接口相同。
+# InFlightLimiter限制同时发送中的响应字节数，超出时直接拒绝，而不是无限排队。
+
+# 内存中的桶超过该时间没有使用就会被清理
+IDLE_SECONDS = 600
+
+
+def take_tokens(tokens, updated, now, rate, burst, cost=1):
+    """
+    按经过的时间补充令牌后取出cost个，返回(剩余令牌数, 是否允许, 需要等待的秒数)
+    与_REDIS_TAKE_SCRIPT中的计算相同
+    """
+    tokens = min(burst, tokens + max(0.0, now - updated) * rate)
+    if tokens >= cost:
+        return tokens - cost, True, 0.0
+    return tokens, False, (cost - tokens) / rate
+
+
+def client_ip(remote_addr, forwarded_for, trusted_proxies=0):
+    """
+    返回客户端的IP地址：trusted_proxies为服务前面可信的反向代理（负载均衡）层数，
+    每层代理把它看到的来源地址追加到X-Forwarded-For末尾，因此从右数第trusted_proxies个是真实的客户端地址；
+    更靠左的部分可以由客户端伪造，不使用。头中的地址少于代理层数时使用连接的地址
+    """
+    if trusted_proxies > 0 and forwarded_for:
+        addresses = [address.strip() for address in forwarded_for.split(',')]
+        if len(addresses) >= trusted_proxies and addresses[-trusted_proxies]:
+            return addresses[-trusted_proxies]
+    return remote_addr
+
+
+class MemoryStore(object):
+    """保存在进程内存中的令牌桶"""
+
+    def __init__(self, idle_seconds=IDLE_SECONDS, clock=time.monotonic):
+        self.idle_seconds = idle_seconds
+        self.clock = clock
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._next_prune = 0
+
+    def take(self, key, rate, burst, cost=1):
+        """
+        从桶中取出cost个令牌，rate为每秒补充的令牌数，burst为桶的容量
+        返回(是否允许, 需要等待的秒数)
+        """
+        now = self.clock()
+        with self._lock:
+            tokens, updated = self._buckets.get(key, (burst, now))
+            tokens, allowed, wait = take_tokens(tokens, updated, now, rate, burst, cost)
+            self._buckets[key] = (tokens, now)
+            if now >= self._next_prune:
+                self._prune(now)
+        return allowed, wait
+
+    def _prune(self, now):
+        # 空闲超过idle_seconds的桶一定已经补满，删除后再次使用时按满桶处理，结果相同
+        self._next_prune = now + self.idle_seconds
+        expired = [key for key, (_, updated) in self._buckets.items() if now - updated > self.idle_seconds]
+        for key in expired:
+            del self._buckets[key]
+
+    def __len__(self):
+        with self._lock:
+            return len(self._buckets)
+
+
+# 在Redis中原子地更新令牌桶，返回{是否允许, 等待的毫秒数}
+_REDIS_TAKE_SCRIPT = '''
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local bucket = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(bucket[1]) or burst
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+local wait = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    wait = math.ceil((cost - tokens) / rate * 1000)
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, wait}
+'''
+
+
+class RedisStore(object):
+    """
+    保存在Redis中的令牌桶，供多个进程共享
+    client为redis-py的客户端对象（redis为可选依赖，由调用方创建并传入）
+    """
+
+    def __init__(self, client, prefix='ratelimit:', clock=time.time):
+        self.client = client
+        self.prefix = prefix
+        self.clock = clock
+        self._script = client.register_script(_REDIS_TAKE_SCRIPT)
+
+    def take(self, key, rate, burst, cost=1):
+        allowed, wait_ms = self._script(keys=[self.prefix + key], args=[rate, burst, cost, self.clock()])
+        return bool(allowed), wait_ms / 1000.0
+
+
+class InFlightLimiter(object):
+    """限制同时发送中的响应总字节数"""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def acquire(self, size):
+        """占用size字节的额度，超出上限时返回False；单个响应超过上限时只在没有其他响应时允许"""
+        with self._lock:
+            if self.in_flight and self.in_flight + size > self.max_bytes:
+                return False
+            self.in_flight += size
+            return True
+
+    def release(self, size):
+        with self._lock:
+            self.in_flight -= size
+
+
+def retry_after_header(seconds):
+    """Retry-After头只能是整数秒"""
+    return str(max(1, int(math.ceil(seconds))))
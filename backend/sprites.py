@@ -0,0 +1,61 @@
+import os
+
+import imaging
+
+# 分类概览用的缩略图拼图（contact sheet）
+# 把一页图片缩小后按网格拼成一张JPEG，客户端根据偏移量用CSS background-position显示各个缩略图，
+# 一页只需要请求一次图片。
+
+# 每个缩略图的尺寸（16:9，与大多数壁纸一致）和每行的缩略图数量
+TILE_WIDTH = 160
+TILE_HEIGHT = 90
+COLUMNS = 10
+JPEG_QUALITY = 80
+BACKGROUND_COLOR = (32, 32, 32)
+
+
+def tile_offsets(count, columns=COLUMNS, tile_width=TILE_WIDTH, tile_height=TILE_HEIGHT):
+    """返回每个缩略图在拼图中的(x, y)偏移量"""
+    return [((index % columns) * tile_width, (index // columns) * tile_height) for index in range(count)]
+
+
+def sprite_size(count, columns=COLUMNS, tile_width=TILE_WIDTH, tile_height=TILE_HEIGHT):
+    """返回拼图的(宽, 高)"""
+    rows = max((count + columns - 1) // columns, 1)
+    return (min(count, columns) or 1) * tile_width, rows * tile_height
+
+
+def _load_tile(source, tile_width, tile_height):
+    Image = imaging.image_module()
+    with Image.open(source) as img:
+        # JPEG可以在解码时直接缩小，避免解码完整的大图
+        img.draft('RGB', (tile_width * 2, tile_height * 2))
+        img = img.convert('RGB')
+    return imaging.image_ops_module().fit(img, (tile_width, tile_height), Image.Resampling.BILINEAR)
+
+
+def render_sprite(file_paths, target_path, columns=COLUMNS, tile_width=TILE_WIDTH, tile_height=TILE_HEIGHT,
+                  open_file=None):
+    """
+    把图片按顺序拼成一张JPEG并写入target_path（先写临时文件再替换，读取方不会看到写了一半的文件）
+    open_file(path)返回传给Image.open的对象（如从对象存储下载的数据），默认直接打开路径
+    返回无法读取的图片路径列表，对应位置保留为背景色
+    """
+    Image = imaging.image_module()
+    if Image is None:
+        raise RuntimeError('需要安装Pillow才能生成缩略图拼图')
+
+    sheet = Image.new('RGB', sprite_size(len(file_paths), columns, tile_width, tile_height), BACKGROUND_COLOR)
+    failed = []
+    for file_path, offset in zip(file_paths, tile_offsets(len(file_paths), columns, tile_width, tile_height)):
+        try:
+            source = open_file(file_path) if open_file else file_path
+            sheet.paste(_load_tile(source, tile_width, tile_height), offset)
+        except Exception:
+            failed.append(file_path)
+
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    temp_path = target_path + '.tmp'
+    sheet.save(temp_path, 'JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    os.replace(temp_path, target_path)
+    return failed
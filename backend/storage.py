@@ -0,0 +1,382 @@
+import datetime
+import hashlib
+import hmac
+import io
+import os
+import shutil
+import urllib.parse
+import xml.etree.ElementTree as ElementTree
+from email.utils import parsedate_to_datetime
+
+# 图片文件的存储后端
+# 数据库中保存的filepath在两种后端下格式相同（如 ../uploads/default/a.jpg），由存储后端负责映射到实际位置：
+#   LocalStorage 本地磁盘，filepath就是文件路径
+#   S3Storage    S3兼容的对象存储（AWS S3、MinIO等），filepath去掉开头的 ../ 和 / 后作为对象键
+# 两者的接口相同，调用方只通过get_storage()返回的对象访问文件，不直接使用os和open。
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class LocalStorage(object):
+    """本地磁盘存储"""
+
+    remote = False
+
+    def stat(self, path):
+        """返回(文件大小, 修改时间)，文件不存在时抛出OSError"""
+        stat_result = os.stat(path)
+        return stat_result.st_size, stat_result.st_mtime
+
+    def exists(self, path):
+        return os.path.isfile(path)
+
+    def folder_exists(self, folder):
+        return os.path.isdir(folder)
+
+    def open(self, path):
+        return open(path, 'rb')
+
+    def read_range(self, path, start, length):
+        with open(path, 'rb') as f:
+            f.seek(start)
+            return f.read(length)
+
+    def read(self, path):
+        with open(path, 'rb') as f:
+            return f.read()
+
+    def image_source(self, path):
+        """返回可以传给PIL.Image.open的对象"""
+        return path
+
+    def save(self, path, stream):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path, 'wb') as f:
+            shutil.copyfileobj(stream, f, CHUNK_SIZE)
+
+    def delete(self, path):
+        if os.path.exists(path):
+            os.remove(path)
+
+    def move(self, source, target):
+        if os.path.exists(source):
+            os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+            shutil.move(source, target)
+
+    def copy(self, source, target, overwrite=True):
+        """
+        复制文件，同一文件系统上使用硬链接，不占用额外空间
+        overwrite为False时目标文件已存在则抛出FileExistsError（原子地检查，不会覆盖同时写入的文件）
+        """
+        os.makedirs(os.path.dirname(target) or '.', exist_ok=True)
+        try:
+            os.link(source, target)
+            return
+        except FileExistsError:
+            if not overwrite:
+                raise
+        except FileNotFoundError:
+            raise
+        except OSError:
+            pass
+        if overwrite:
+            shutil.copy2(source, target)
+            return
+        with open(source, 'rb') as src, open(target, 'xb') as dst:
+            shutil.copyfileobj(src, dst, CHUNK_SIZE)
+        shutil.copystat(source, target)
+
+    def walk(self, folder):
+        """遍历文件夹（含子文件夹）中的文件，返回(路径, 文件名)"""
+        for root, dirs, files in os.walk(folder):
+            for name in files:
+                yield os.path.join(root, name), name
+
+    def presigned_url(self, path, expires):
+        return None
+
+
+class StorageError(IOError):
+    pass
+
+
+class RangeNotSatisfiable(StorageError):
+    """请求的字节范围超出对象大小，size为对象大小（未知时为None）"""
+
+    def __init__(self, message, size=None):
+        super().__init__(message)
+        self.size = size
+
+
+def object_key(path, prefix=''):
+    """把数据库中的文件路径转换为对象键：统一使用/分隔，去掉盘符、开头的/和 ../"""
+    normalized = os.path.normpath(path).replace('\\', '/')
+    parts = [part for part in normalized.split('/') if part not in ('', '.', '..') and not part.endswith(':')]
+    return prefix + '/'.join(parts)
+
+
+def _quote(value, safe='-_.~'):
+    return urllib.parse.quote(value, safe=safe)
+
+
+def _sha256(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def _hmac(key, message):
+    return hmac.new(key, message.encode('utf-8'), hashlib.sha256).digest()
+
+
+# 不对请求体计算摘要（S3和MinIO都支持），上传时不需要先读完整个分块再签名
+UNSIGNED_PAYLOAD = 'UNSIGNED-PAYLOAD'
+
+
+class _ResponseReader(io.RawIOBase):
+    """把流式下载的响应包装为只读文件对象，关闭时把连接还给连接池"""
+
+    def __init__(self, response):
+        self._response = response
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._response.raw.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._response.close()
+        super().close()
+
+
+class S3Storage(object):
+    """
+    S3兼容的对象存储，使用路径风格的地址（endpoint/bucket/key），请求用AWS Signature V4签名
+    requests.Session在线程间共享，每个主机保持最多pool_size个长连接；
+    大文件分块上传，原图通过预签名地址由对象存储直接发送给客户端
+    """
+
+    remote = True
+
+    def __init__(self, endpoint, bucket, access_key, secret_key, region='us-east-1', prefix='',
+                 pool_size=16, multipart_threshold=16 * 1024 * 1024, part_size=8 * 1024 * 1024, timeout=30):
+        # requests只在使用对象存储时导入
+        import requests
+        from requests.adapters import HTTPAdapter
+
+        self.endpoint = endpoint.rstrip('/')
+        self.host = urllib.parse.urlsplit(self.endpoint).netloc
+        self.bucket = bucket
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.prefix = prefix.strip('/') + '/' if prefix.strip('/') else ''
+        self.multipart_threshold = multipart_threshold
+        # S3要求除最后一块外每块至少5MB
+        self.part_size = max(part_size, 5 * 1024 * 1024)
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=2)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def key(self, path):
+        return object_key(path, self.prefix)
+
+    def _canonical_uri(self, key):
+        return '/' + _quote(self.bucket) + ('/' + _quote(key, safe='/-_.~') if key else '')
+
+    def _scope(self, now):
+        return f"{now.strftime('%Y%m%d')}/{self.region}/s3/aws4_request"
+
+    def _signature(self, now, canonical_request):
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', now.strftime('%Y%m%dT%H%M%SZ'), self._scope(now),
+            _sha256(canonical_request.encode('utf-8'))
+        ])
+        signing_key = _hmac(('AWS4' + self.secret_key).encode('utf-8'), now.strftime('%Y%m%d'))
+        for part in (self.region, 's3', 'aws4_request'):
+            signing_key = _hmac(signing_key, part)
+        return hmac.new(signing_key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+
+    def _request(self, method, key, params=None, headers=None, data=None, stream=False, expected=(200,)):
+        now = datetime.datetime.now(datetime.timezone.utc)
+        query = '&'.join(f"{_quote(name)}={_quote(str(value))}" for name, value in sorted((params or {}).items()))
+        headers = dict(headers or {})
+        headers['host'] = self.host
+        headers['x-amz-date'] = now.strftime('%Y%m%dT%H%M%SZ')
+        headers['x-amz-content-sha256'] = UNSIGNED_PAYLOAD
+        signed = sorted(name.lower() for name in headers if name.lower() == 'host' or name.lower().startswith('x-amz-'))
+        lower_headers = {name.lower(): str(value).strip() for name, value in headers.items()}
+        canonical_request = '\n'.join([
+            method, self._canonical_uri(key), query,
+            ''.join(f"{name}:{lower_headers[name]}\n" for name in signed),
+            ';'.join(signed), UNSIGNED_PAYLOAD
+        ])
+        headers['Authorization'] = (
+            f"AWS4-HMAC-SHA256 Credential={self.access_key}/{self._scope(now)}, "
+            f"SignedHeaders={';'.join(signed)}, Signature={self._signature(now, canonical_request)}"
+        )
+        del headers['host']
+        url = self.endpoint + self._canonical_uri(key) + ('?' + query if query else '')
+        response = self.session.request(method, url, headers=headers, data=data, stream=stream, timeout=self.timeout)
+        if response.status_code not in expected:
+            body = response.content[:200]
+            response.close()
+            if response.status_code == 404:
+                raise FileNotFoundError(f"对象不存在: {key}")
+            raise StorageError(f"{method} {key} 失败: HTTP {response.status_code} {body!r}")
+        return response
+
+    def stat(self, path):
+        response = self._request('HEAD', self.key(path))
+        modified = response.headers.get('Last-Modified')
+        mtime = parsedate_to_datetime(modified).timestamp() if modified else 0
+        return int(response.headers.get('Content-Length', 0)), mtime
+
+    def exists(self, path):
+        try:
+            self._request('HEAD', self.key(path))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def folder_exists(self, folder):
+        # 对象存储中没有真正的文件夹，任何前缀都可以使用
+        return True
+
+    def open(self, path):
+        return io.BufferedReader(_ResponseReader(self._request('GET', self.key(path), stream=True)), CHUNK_SIZE)
+
+    def open_range(self, path, byte_range=None):
+        """
+        用一个GET请求流式读取对象，byte_range为HTTP Range头的值（如 bytes=0-99），原样发给对象存储
+        返回(文件对象, 范围, 对象大小)：范围为返回内容的(起点, 终点)（包含两端），返回整个对象时
+        （没有请求范围或服务不支持Range）为None；范围超出对象大小时抛出RangeNotSatisfiable
+        """
+        headers = {'Range': byte_range} if byte_range else None
+        response = self._request('GET', self.key(path), headers=headers, stream=True, expected=(200, 206, 416))
+        if response.status_code == 416:
+            response.close()
+            total = response.headers.get('Content-Range', '').rpartition('/')[2]
+            raise RangeNotSatisfiable(f"GET {self.key(path)} 范围无效: {byte_range}",
+                                      int(total) if total.isdigit() else None)
+        reader = io.BufferedReader(_ResponseReader(response), CHUNK_SIZE)
+        if response.status_code == 200:
+            return reader, None, int(response.headers.get('Content-Length', 0))
+        # Content-Range: bytes 起点-终点/大小
+        span, _, total = response.headers.get('Content-Range', '').replace('bytes ', '', 1).partition('/')
+        start, _, end = span.partition('-')
+        return reader, (int(start), int(end)), int(total) if total.isdigit() else None
+
+    def read_range(self, path, start, length):
+        response = self._request('GET', self.key(path), headers={'Range': f"bytes={start}-{start + length - 1}"},
+                                 expected=(200, 206))
+        if response.status_code == 200:
+            # 不支持Range的服务会返回整个对象
+            return response.content[start:start + length]
+        return response.content
+
+    def read(self, path):
+        return self._request('GET', self.key(path)).content
+
+    def image_source(self, path):
+        return io.BytesIO(self.read(path))
+
+    def save(self, path, stream):
+        key = self.key(path)
+        data = stream.read(self.multipart_threshold)
+        if len(data) < self.multipart_threshold:
+            self._request('PUT', key, data=data)
+            return
+        self._multipart_upload(key, data, stream)
+
+    def _multipart_upload(self, key, first_chunk, stream):
+        response = self._request('POST', key, params={'uploads': ''})
+        upload_id = ElementTree.fromstring(response.content).findtext('{*}UploadId')
+        try:
+            parts = []
+            pending = first_chunk
+            while pending:
+                while len(pending) >= self.part_size:
+                    parts.append(self._upload_part(key, upload_id, len(parts) + 1, pending[:self.part_size]))
+                    pending = pending[self.part_size:]
+                data = stream.read(self.part_size)
+                if not data:
+                    break
+                pending += data
+            if pending or not parts:
+                parts.append(self._upload_part(key, upload_id, len(parts) + 1, pending))
+            body = '<CompleteMultipartUpload>' + ''.join(
+                f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>" for number, etag in parts
+            ) + '</CompleteMultipartUpload>'
+            response = self._request('POST', key, params={'uploadId': upload_id}, data=body.encode('utf-8'))
+            # 合并失败时S3也可能返回200，错误信息在响应体中
+            if b'<Error>' in response.content:
+                raise StorageError(f"合并分块失败: {key}")
+        except Exception:
+            try:
+                self._request('DELETE', key, params={'uploadId': upload_id}, expected=(200, 204, 404))
+            except Exception:
+                pass
+            raise
+
+    def _upload_part(self, key, upload_id, number, data):
+        response = self._request('PUT', key, params={'partNumber': number, 'uploadId': upload_id}, data=data)
+        return number, response.headers.get('ETag', '')
+
+    def delete(self, path):
+        self._request('DELETE', self.key(path), expected=(200, 204, 404))
+
+    def copy(self, source, target, overwrite=True):
+        """在服务端复制对象，数据不经过本机；overwrite为False时目标对象已存在则抛出FileExistsError（先检查再复制，不是原子的）"""
+        if not overwrite and self.exists(target):
+            raise FileExistsError(f"对象已存在: {self.key(target)}")
+        source_key = self.key(source)
+        self._request('PUT', self.key(target),
+                      headers={'x-amz-copy-source': _quote(f"/{self.bucket}/{source_key}", safe='/-_.~')})
+
+    def move(self, source, target):
+        # 对象存储没有重命名操作，先在服务端复制再删除原对象
+        try:
+            self.copy(source, target)
+        except FileNotFoundError:
+            return
+        self.delete(source)
+
+    def walk(self, folder):
+        folder_key = self.key(folder)
+        list_prefix = folder_key + '/' if folder_key else ''
+        token = None
+        while True:
+            params = {'list-type': '2', 'prefix': list_prefix, 'max-keys': '1000'}
+            if token:
+                params['continuation-token'] = token
+            root = ElementTree.fromstring(self._request('GET', '', params=params).content)
+            for item in root.findall('{*}Contents'):
+                relative = item.findtext('{*}Key')[len(list_prefix):]
+                if relative and not relative.endswith('/'):
+                    yield os.path.join(folder, *relative.split('/')), relative.rsplit('/', 1)[-1]
+            if root.findtext('{*}IsTruncated') != 'true':
+                break
+            token = root.findtext('{*}NextContinuationToken')
+
+    def presigned_url(self, path, expires):
+        """生成有效期为expires秒的GET地址，客户端可直接从对象存储下载"""
+        now = datetime.datetime.now(datetime.timezone.utc)
+        key = self.key(path)
+        params = {
+            'X-Amz-Algorithm': 'AWS4-HMAC-SHA256',
+            'X-Amz-Credential': f"{self.access_key}/{self._scope(now)}",
+            'X-Amz-Date': now.strftime('%Y%m%dT%H%M%SZ'),
+            'X-Amz-Expires': str(int(expires)),
+            'X-Amz-SignedHeaders': 'host'
+        }
+        query = '&'.join(f"{_quote(name)}={_quote(value)}" for name, value in sorted(params.items()))
+        canonical_request = '\n'.join([
+            'GET', self._canonical_uri(key), query, f"host:{self.host}\n", 'host', UNSIGNED_PAYLOAD
+        ])
+        signature = self._signature(now, canonical_request)
+        return f"{self.endpoint}{self._canonical_uri(key)}?{query}&X-Amz-Signature={signature}"
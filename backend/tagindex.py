@@ -0,0 +1,329 @@
+import collections
+import re
+
+# 标签位图索引
+# 每个标签（以及每个分类）对应一个图片ID的位图，标签的交集、并集和差集直接用位运算完成，不需要查询数据库。
+# 位图参照Roaring Bitmap的结构：按ID的高16位分块，每块是一个65536位的Python整数，只保存有图片的块，
+# 稀疏的标签只占用少量内存，块内的与/或/差运算和计数（bit_count）都在C中完成。
+# 快照（TagSnapshot）创建后不再修改，更新时生成新的快照并整体替换，查询过程中不需要加锁。
+# 数据库中的变化逐行记录在catalog_changes中，快照过期后只应用这之后的变化，不需要重新读取全部标签。
+
+CONTAINER_BITS = 16
+CONTAINER_SIZE = 1 << CONTAINER_BITS
+CONTAINER_MASK = CONTAINER_SIZE - 1
+CONTAINER_BYTES = CONTAINER_SIZE // 8
+
+try:
+    _popcount = int.bit_count
+except AttributeError:
+    def _popcount(value):
+        return bin(value).count('1')
+
+# 每个字节中置位的数量，用于按字节跳过不需要的ID
+_BYTE_POPCOUNT = [bin(value).count('1') for value in range(256)]
+
+
+class Bitmap(object):
+    """按16位分块的图片ID位图，运算结果都是新的位图，原位图不会被修改"""
+
+    __slots__ = ('containers',)
+
+    def __init__(self, containers=None):
+        self.containers = containers if containers is not None else {}
+
+    @classmethod
+    def from_ids(cls, ids):
+        buffers = {}
+        for image_id in ids:
+            high = image_id >> CONTAINER_BITS
+            buffer = buffers.get(high)
+            if buffer is None:
+                buffer = buffers[high] = bytearray(CONTAINER_BYTES)
+            low = image_id & CONTAINER_MASK
+            buffer[low >> 3] |= 1 << (low & 7)
+        return cls({high: int.from_bytes(buffer, 'little') for high, buffer in buffers.items()})
+
+    def __and__(self, other):
+        small, large = sorted((self.containers, other.containers), key=len)
+        result = {}
+        for high, bits in small.items():
+            other_bits = large.get(high)
+            if other_bits:
+                value = bits & other_bits
+                if value:
+                    result[high] = value
+        return Bitmap(result)
+
+    def __or__(self, other):
+        result = dict(self.containers)
+        for high, bits in other.containers.items():
+            result[high] = result.get(high, 0) | bits
+        return Bitmap(result)
+
+    def __sub__(self, other):
+        result = {}
+        for high, bits in self.containers.items():
+            value = bits & ~other.containers.get(high, 0)
+            if value:
+                result[high] = value
+        return Bitmap(result)
+
+    def __len__(self):
+        return sum(_popcount(bits) for bits in self.containers.values())
+
+    def __bool__(self):
+        return bool(self.containers)
+
+    def __contains__(self, image_id):
+        bits = self.containers.get(image_id >> CONTAINER_BITS, 0)
+        return bool(bits >> (image_id & CONTAINER_MASK) & 1)
+
+    def intersection_count(self, other):
+        """交集的元素个数（不生成中间位图）"""
+        small, large = sorted((self.containers, other.containers), key=len)
+        count = 0
+        for high, bits in small.items():
+            other_bits = large.get(high)
+            if other_bits:
+                count += _popcount(bits & other_bits)
+        return count
+
+    def page_desc(self, offset, limit):
+        """按ID从大到小跳过offset个后取limit个ID"""
+        result = []
+        for high in sorted(self.containers, reverse=True):
+            bits = self.containers[high]
+            count = _popcount(bits)
+            if offset >= count:
+                offset -= count
+                continue
+            data = bits.to_bytes(CONTAINER_BYTES, 'little')
+            base = high << CONTAINER_BITS
+            for index in range(CONTAINER_BYTES - 1, -1, -1):
+                byte = data[index]
+                if not byte:
+                    continue
+                if offset >= _BYTE_POPCOUNT[byte]:
+                    offset -= _BYTE_POPCOUNT[byte]
+                    continue
+                for bit in range(7, -1, -1):
+                    if byte >> bit & 1:
+                        if offset:
+                            offset -= 1
+                            continue
+                        result.append(base + index * 8 + bit)
+                        if len(result) >= limit:
+                            return result
+        return result
+
+
+def _apply_changes(bitmaps, changes):
+    """changes为{(键, 图片ID): 是否加入}，返回更新后的{键: Bitmap}，没有变化的位图与原快照共享"""
+    added = collections.defaultdict(list)
+    removed = collections.defaultdict(list)
+    for (key, image_id), present in changes.items():
+        (added if present else removed)[key].append(image_id)
+    result = dict(bitmaps)
+    for key in set(added) | set(removed):
+        bitmap = result.get(key, Bitmap())
+        if removed[key]:
+            bitmap = bitmap - Bitmap.from_ids(removed[key])
+        if added[key]:
+            bitmap = bitmap | Bitmap.from_ids(added[key])
+        if bitmap:
+            result[key] = bitmap
+        else:
+            result.pop(key, None)
+    return result
+
+
+def union_all(bitmaps):
+    result = Bitmap()
+    for bitmap in bitmaps:
+        result = result | bitmap
+    return result
+
+
+class TagSnapshot(object):
+    """某一时刻的标签和分类位图"""
+
+    def __init__(self, version, tags, names, categories):
+        self.version = version
+        self.tags = tags              # 标签ID -> Bitmap
+        self.names = names            # 小写标签名 -> (标签ID, 标签名)
+        self.categories = categories  # 分类ID -> Bitmap
+
+    @classmethod
+    def load(cls, cursor):
+        """从数据库读取全部标签和分类，生成快照"""
+        cursor.execute("SELECT version FROM catalog_version WHERE id = 1")
+        row = cursor.fetchone()
+        version = row[0] if row else 0
+
+        cursor.execute("SELECT id, name FROM tags")
+        names = {name.lower(): (tag_id, name) for tag_id, name in cursor.fetchall()}
+
+        tags = {}
+        for tag_id, _ in names.values():
+            cursor.execute("SELECT image_id FROM image_tags WHERE tag_id = ?", (tag_id,))
+            tags[tag_id] = Bitmap.from_ids(image_id for (image_id,) in cursor)
+
+        categories = {}
+        cursor.execute("SELECT DISTINCT category_id FROM images")
+        for (category_id,) in cursor.fetchall():
+            cursor.execute("SELECT id FROM images WHERE category_id = ?", (category_id,))
+            categories[category_id] = Bitmap.from_ids(image_id for (image_id,) in cursor)
+        return cls(version, tags, names, categories)
+
+    def load_changes(self, cursor):
+        """
+        读取本快照之后catalog_changes中逐行记录的变化，返回应用后的新快照（没有变化时返回自身）
+        变化记录不完整（已被清理，或数据库升级前的变化没有记录）时返回None，需要调用load()重新加载
+        """
+        cursor.execute("SELECT version FROM catalog_version WHERE id = 1")
+        row = cursor.fetchone()
+        version = row[0] if row else 0
+        if version == self.version:
+            return self
+        cursor.execute('''
+            SELECT image_id, tag_id, tag_added, old_category_id, new_category_id FROM catalog_changes
+            WHERE version > ? AND version <= ? ORDER BY version
+        ''', (self.version, version))
+        rows = cursor.fetchall()
+        if len(rows) != version - self.version:
+            return None
+
+        # 同一张图片多次变化时以最后一次为准
+        tag_changes = {}
+        category_changes = {}
+        for image_id, tag_id, tag_added, old_category_id, new_category_id in rows:
+            if tag_id is not None:
+                tag_changes[(tag_id, image_id)] = bool(tag_added)
+                continue
+            if old_category_id is not None:
+                category_changes[(old_category_id, image_id)] = False
+            if new_category_id is not None:
+                category_changes[(new_category_id, image_id)] = True
+
+        # 标签表很小，直接重新读取全部标签名
+        cursor.execute("SELECT id, name FROM tags")
+        names = {name.lower(): (tag_id, name) for tag_id, name in cursor.fetchall()}
+        return TagSnapshot(version, _apply_changes(self.tags, tag_changes), names,
+                           _apply_changes(self.categories, category_changes))
+
+    def tag_bitmap(self, name):
+        entry = self.names.get(name.lower())
+        return self.tags.get(entry[0], Bitmap()) if entry else Bitmap()
+
+    def category_bitmap(self, category_ids):
+        return union_all(self.categories[category_id] for category_id in category_ids
+                         if category_id in self.categories)
+
+    def with_tag_changes(self, version, tag_id, name, bitmap, action):
+        """返回添加或移除了一批图片标签后的新快照"""
+        tags = dict(self.tags)
+        names = dict(self.names)
+        names[name.lower()] = (tag_id, name)
+        current = tags.get(tag_id, Bitmap())
+        tags[tag_id] = current | bitmap if action == 'add' else current - bitmap
+        return TagSnapshot(version, tags, names, self.categories)
+
+    def facet_counts(self, scope, limit=50):
+        """统计scope中每个标签的图片数，按数量从多到少返回[(标签名, 数量)]"""
+        counts = []
+        for tag_id, name in self.names.values():
+            count = scope.intersection_count(self.tags.get(tag_id, Bitmap()))
+            if count:
+                counts.append((name, count))
+        counts.sort(key=lambda item: (-item[1], item[0]))
+        return counts[:limit]
+
+
+class TagQueryError(ValueError):
+    pass
+
+
+_TOKEN = re.compile(r'\s*(?:(\()|(\))|"([^"]*)"|([^\s()"]+))')
+
+
+def _tokenize(query):
+    tokens = []
+    position = 0
+    query = query.strip()
+    while position < len(query):
+        match = _TOKEN.match(query, position)
+        if not match or match.end() == position:
+            raise TagQueryError('无法解析的标签查询')
+        position = match.end()
+        if match.group(1):
+            tokens.append(('(', None))
+        elif match.group(2):
+            tokens.append((')', None))
+        elif match.group(3) is not None:
+            tokens.append(('tag', match.group(3)))
+        else:
+            word = match.group(4)
+            operator = word.upper()
+            tokens.append((operator, None) if operator in ('AND', 'OR', 'NOT') else ('tag', word))
+    return tokens
+
+
+def evaluate_query(query, snapshot, universe):
+    """
+    计算标签查询，如 'nature AND dark NOT anime'、'(4k OR 8k) 风景'
+    支持AND、OR、NOT和括号，相邻的标签默认为AND，标签名包含空格时用双引号括起来；
+    universe为允许出现在结果中的图片（单独的NOT相对于它取补集）
+    """
+    tokens = _tokenize(query)
+    if not tokens:
+        raise TagQueryError('标签查询为空')
+    position = [0]
+
+    def peek():
+        return tokens[position[0]][0] if position[0] < len(tokens) else None
+
+    def advance():
+        token = tokens[position[0]]
+        position[0] += 1
+        return token
+
+    def parse_or():
+        result = parse_and()
+        while peek() == 'OR':
+            advance()
+            result = result | parse_and()
+        return result
+
+    def parse_and():
+        result = parse_not()
+        while peek() in ('AND', 'NOT', 'tag', '('):
+            if peek() == 'AND':
+                advance()
+                result = result & parse_not()
+            elif peek() == 'NOT':
+                # a NOT b 表示 a AND NOT b
+                advance()
+                result = result - parse_not()
+            else:
+                result = result & parse_not()
+        return result
+
+    def parse_not():
+        if peek() == 'NOT':
+            advance()
+            return universe - parse_not()
+        if peek() == '(':
+            advance()
+            result = parse_or()
+            if peek() != ')':
+                raise TagQueryError('括号不匹配')
+            advance()
+            return result
+        if peek() == 'tag':
+            return snapshot.tag_bitmap(advance()[1]) & universe
+        raise TagQueryError('标签查询格式错误')
+
+    result = parse_or()
+    if position[0] != len(tokens):
+        raise TagQueryError('标签查询格式错误')
+    return result
@@ -0,0 +1,282 @@
+import datetime
+import hashlib
+import hmac
+import threading
+import urllib.parse
+import uuid
+import xml.etree.ElementTree as ElementTree
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 测试用的本地S3兼容服务（代替MinIO）：对象保存在内存中
+# 按AWS Signature V4的规范独立计算每个请求（包括预签名地址）的签名并校验，不使用storage.py中的签名代码；
+# 支持PutObject、GetObject（单个Range）、HeadObject、DeleteObject、CopyObject、分块上传和ListObjectsV2分页
+
+NAMESPACE = 'http://s3.amazonaws.com/doc/2006-03-01/'
+MIN_PART_SIZE = 5 * 1024 * 1024
+
+
+def _uri_encode(value, safe='-_.~'):
+    return urllib.parse.quote(value, safe=safe)
+
+
+def _sign(secret_key, date, region, string_to_sign):
+    key = ('AWS4' + secret_key).encode('utf-8')
+    for part in (date, region, 's3', 'aws4_request'):
+        key = hmac.new(key, part.encode('utf-8'), hashlib.sha256).digest()
+    return hmac.new(key, string_to_sign.encode('utf-8'), hashlib.sha256).hexdigest()
+
+
+class S3Stub(object):
+    """在后台线程中运行的服务，endpoint为地址；requests记录收到的(方法, 路径, 查询参数)"""
+
+    def __init__(self, access_key='test-access', secret_key='test-secret', region='us-east-1', bucket='wallpapers',
+                 max_keys=None):
+        self.access_key = access_key
+        self.secret_key = secret_key
+        self.region = region
+        self.bucket = bucket
+        # 每页最多返回的对象数，小于客户端请求的max-keys时用于测试分页
+        self.max_keys = max_keys
+        self.objects = {}
+        self.uploads = {}
+        self.requests = []
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(_Handler):
+            server_stub = stub
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.endpoint = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def verify(self, method, raw_path, query_pairs, headers):
+        """校验签名，失败时返回错误代码"""
+        presigned = any(name == 'X-Amz-Signature' for name, _ in query_pairs)
+        if presigned:
+            params = dict(query_pairs)
+            credential = params.get('X-Amz-Credential', '')
+            signed_headers = params.get('X-Amz-SignedHeaders', '')
+            signature = params.get('X-Amz-Signature', '')
+            amz_date = params.get('X-Amz-Date', '')
+            payload_hash = 'UNSIGNED-PAYLOAD'
+            query_pairs = [(name, value) for name, value in query_pairs if name != 'X-Amz-Signature']
+            try:
+                signed_at = datetime.datetime.strptime(amz_date, '%Y%m%dT%H%M%SZ').replace(tzinfo=datetime.timezone.utc)
+                expires = int(params['X-Amz-Expires'])
+            except (KeyError, ValueError):
+                return 'AuthorizationQueryParametersError'
+            if datetime.datetime.now(datetime.timezone.utc) > signed_at + datetime.timedelta(seconds=expires):
+                return 'AccessDenied'
+        else:
+            authorization = headers.get('authorization', '')
+            if not authorization.startswith('AWS4-HMAC-SHA256 '):
+                return 'AccessDenied'
+            fields = dict(item.strip().split('=', 1) for item in authorization[len('AWS4-HMAC-SHA256 '):].split(','))
+            credential = fields.get('Credential', '')
+            signed_headers = fields.get('SignedHeaders', '')
+            signature = fields.get('Signature', '')
+            amz_date = headers.get('x-amz-date', '')
+            payload_hash = headers.get('x-amz-content-sha256', '')
+            if not payload_hash:
+                return 'InvalidRequest'
+
+        parts = credential.split('/')
+        if len(parts) != 5 or parts[0] != self.access_key or parts[2] != self.region or parts[3:] != ['s3', 'aws4_request']:
+            return 'InvalidAccessKeyId'
+        if parts[1] != amz_date[:8]:
+            return 'SignatureDoesNotMatch'
+        signed = signed_headers.split(';')
+        if 'host' not in signed or (not presigned and 'x-amz-date' not in signed):
+            return 'AccessDenied'
+        if signed != sorted(signed):
+            return 'SignatureDoesNotMatch'
+
+        canonical_query = '&'.join(
+            f"{_uri_encode(name)}={_uri_encode(value)}" for name, value in sorted(query_pairs)
+        )
+        canonical_headers = ''.join(
+            f"{name}:{' '.join(headers.get(name, '').split())}\n" for name in signed
+        )
+        canonical_request = '\n'.join([
+            method, _uri_encode(urllib.parse.unquote(raw_path), safe='/-_.~'), canonical_query,
+            canonical_headers, signed_headers, payload_hash
+        ])
+        scope = '/'.join(parts[1:])
+        string_to_sign = '\n'.join([
+            'AWS4-HMAC-SHA256', amz_date, scope, hashlib.sha256(canonical_request.encode('utf-8')).hexdigest()
+        ])
+        expected = _sign(self.secret_key, parts[1], self.region, string_to_sign)
+        if not hmac.compare_digest(expected, signature):
+            return 'SignatureDoesNotMatch'
+        return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    server_stub = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, body=b'', headers=None):
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if self.command != 'HEAD':
+            self.wfile.write(body)
+
+    def _error(self, status, code):
+        body = f"<?xml version=\"1.0\" encoding=\"UTF-8\"?><Error><Code>{code}</Code></Error>".encode('utf-8')
+        self._send(status, body, {'Content-Type': 'application/xml'})
+
+    def _xml(self, element):
+        self._send(200, ElementTree.tostring(element, encoding='utf-8'), {'Content-Type': 'application/xml'})
+
+    def _handle(self):
+        stub = self.server_stub
+        raw_path, _, raw_query = self.path.partition('?')
+        query_pairs = urllib.parse.parse_qsl(raw_query, keep_blank_values=True)
+        query = dict(query_pairs)
+        headers = {name.lower(): value for name, value in self.headers.items()}
+        length = int(headers.get('content-length', 0) or 0)
+        body = self.rfile.read(length) if length else b''
+        with stub.lock:
+            stub.requests.append((self.command, raw_path, query))
+
+        error = stub.verify(self.command, raw_path, query_pairs, headers)
+        if error:
+            return self._error(403, error)
+
+        path = urllib.parse.unquote(raw_path).lstrip('/')
+        bucket, _, key = path.partition('/')
+        if bucket != stub.bucket:
+            return self._error(404, 'NoSuchBucket')
+        if not key:
+            if self.command == 'GET' and query.get('list-type') == '2':
+                return self._list(query)
+            return self._error(400, 'InvalidRequest')
+
+        with stub.lock:
+            if self.command == 'POST' and 'uploads' in query:
+                upload_id = uuid.uuid4().hex
+                stub.uploads[upload_id] = (key, {})
+                result = ElementTree.Element('InitiateMultipartUploadResult', xmlns=NAMESPACE)
+                ElementTree.SubElement(result, 'UploadId').text = upload_id
+                return self._xml(result)
+            if 'uploadId' in query:
+                return self._multipart(key, query, body)
+            if self.command == 'PUT':
+                source = headers.get('x-amz-copy-source')
+                if source:
+                    source_bucket, _, source_key = urllib.parse.unquote(source).lstrip('/').partition('/')
+                    if source_bucket != stub.bucket or source_key not in stub.objects:
+                        return self._error(404, 'NoSuchKey')
+                    stub.objects[key] = (stub.objects[source_key][0], datetime.datetime.now(datetime.timezone.utc))
+                    result = ElementTree.Element('CopyObjectResult', xmlns=NAMESPACE)
+                    ElementTree.SubElement(result, 'ETag').text = '"copied"'
+                    return self._xml(result)
+                stub.objects[key] = (body, datetime.datetime.now(datetime.timezone.utc))
+                return self._send(200, headers={'ETag': '"' + hashlib.md5(body).hexdigest() + '"'})
+            if self.command == 'DELETE':
+                stub.objects.pop(key, None)
+                return self._send(204)
+            if key not in stub.objects:
+                return self._error(404, 'NoSuchKey')
+            data, modified = stub.objects[key]
+
+        response_headers = {'Last-Modified': formatdate(modified.timestamp(), usegmt=True),
+                            'Content-Type': 'application/octet-stream'}
+        range_header = headers.get('range')
+        if range_header and self.command == 'GET':
+            start, _, end = range_header[len('bytes='):].partition('-')
+            if not start:
+                # bytes=-N：最后N个字节
+                start, end = max(len(data) - int(end), 0), len(data) - 1
+            else:
+                start = int(start)
+                end = min(int(end) if end else len(data) - 1, len(data) - 1)
+            if start >= len(data):
+                self.send_response(416)
+                self.send_header('Content-Range', f"bytes */{len(data)}")
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+                return None
+            response_headers['Content-Range'] = f"bytes {start}-{end}/{len(data)}"
+            return self._send(206, data[start:end + 1], response_headers)
+        if self.command == 'HEAD':
+            self.send_response(200)
+            for name, value in response_headers.items():
+                self.send_header(name, value)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            return None
+        return self._send(200, data, response_headers)
+
+    def _multipart(self, key, query, body):
+        stub = self.server_stub
+        upload = stub.uploads.get(query['uploadId'])
+        if upload is None or upload[0] != key:
+            return self._error(404, 'NoSuchUpload')
+        parts = upload[1]
+        if self.command == 'PUT':
+            etag = '"' + hashlib.md5(body).hexdigest() + '"'
+            parts[int(query['partNumber'])] = (body, etag)
+            return self._send(200, headers={'ETag': etag})
+        if self.command == 'DELETE':
+            del stub.uploads[query['uploadId']]
+            return self._send(204)
+        # 合并分块：分块必须按编号递增列出、ETag一致，除最后一块外每块至少5MB
+        root = ElementTree.fromstring(body)
+        listed = [(int(part.findtext('PartNumber')), part.findtext('ETag')) for part in root.findall('Part')]
+        numbers = [number for number, _ in listed]
+        if not listed or numbers != sorted(set(numbers)):
+            return self._error(400, 'InvalidPartOrder')
+        for index, (number, etag) in enumerate(listed):
+            if number not in parts or parts[number][1] != etag:
+                return self._error(400, 'InvalidPart')
+            if index < len(listed) - 1 and len(parts[number][0]) < MIN_PART_SIZE:
+                return self._error(400, 'EntityTooSmall')
+        stub.objects[key] = (b''.join(parts[number][0] for number in numbers), datetime.datetime.now(datetime.timezone.utc))
+        del stub.uploads[query['uploadId']]
+        result = ElementTree.Element('CompleteMultipartUploadResult', xmlns=NAMESPACE)
+        ElementTree.SubElement(result, 'Key').text = key
+        return self._xml(result)
+
+    def _list(self, query):
+        stub = self.server_stub
+        prefix = query.get('prefix', '')
+        max_keys = int(query.get('max-keys', 1000))
+        if stub.max_keys:
+            max_keys = min(max_keys, stub.max_keys)
+        with stub.lock:
+            keys = sorted(key for key in stub.objects if key.startswith(prefix))
+        token = query.get('continuation-token')
+        if token:
+            keys = [key for key in keys if key > token]
+        page, rest = keys[:max_keys], keys[max_keys:]
+        result = ElementTree.Element('ListBucketResult', xmlns=NAMESPACE)
+        ElementTree.SubElement(result, 'Name').text = stub.bucket
+        ElementTree.SubElement(result, 'Prefix').text = prefix
+        ElementTree.SubElement(result, 'KeyCount').text = str(len(page))
+        ElementTree.SubElement(result, 'IsTruncated').text = 'true' if rest else 'false'
+        if rest:
+            ElementTree.SubElement(result, 'NextContinuationToken').text = page[-1]
+        for key in page:
+            contents = ElementTree.SubElement(result, 'Contents')
+            ElementTree.SubElement(contents, 'Key').text = key
+            ElementTree.SubElement(contents, 'Size').text = str(len(stub.objects[key][0]))
+        return self._xml(result)
+
+    do_GET = do_PUT = do_POST = do_DELETE = do_HEAD = _handle
@@ -0,0 +1,106 @@
+import os
+import sys
+import tempfile
+import threading
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import integrity
+import iohealth
+import storage
+
+
+class IOGuardTest(unittest.TestCase):
+    def setUp(self):
+        self.release = threading.Event()
+        self.addCleanup(self.release.set)
+
+    def hang(self):
+        self.release.wait(5)
+        return 'late'
+
+    def test_hung_roots_do_not_block_other_roots(self):
+        guard = iohealth.IOGuard(max_per_root=2, timeout=0.05, failure_threshold=100)
+        # 多个无响应的根目录各自占满自己的线程池
+        for root in ('/mnt/a', '/mnt/b', '/mnt/c', '/mnt/d', '/mnt/e'):
+            for _ in range(2):
+                with self.assertRaises(TimeoutError):
+                    guard.run(root, self.hang)
+            with self.assertRaises(iohealth.FolderUnavailable):
+                guard.run(root, self.hang)
+        self.assertEqual(guard.run('/srv/healthy', lambda: 'ok'), 'ok')
+
+    def test_timed_out_calls_release_slots_when_they_finish(self):
+        guard = iohealth.IOGuard(max_per_root=1, timeout=0.05, failure_threshold=100)
+        with self.assertRaises(TimeoutError):
+            guard.run('/mnt/a', self.hang)
+        self.assertEqual(guard.health()[0]['in_flight'], 1)
+        self.release.set()
+        guard._executors['/mnt/a'].submit(lambda: None).result(1)
+        self.assertEqual(guard.health()[0]['in_flight'], 0)
+        self.assertEqual(guard.run('/mnt/a', lambda: 'ok'), 'ok')
+
+    def test_queued_call_is_cancelled_on_timeout(self):
+        guard = iohealth.IOGuard(max_per_root=2, timeout=0.05, failure_threshold=100)
+        calls = []
+        # 占用线程池唯一的线程，使下一个调用只能排队
+        guard._admit('/mnt/a')
+        guard._executors['/mnt/a']._max_workers = 1
+        guard._executors['/mnt/a'].submit(self.hang)
+        with self.assertRaises(TimeoutError):
+            guard.run('/mnt/a', calls.append, 'ran')
+        self.release.set()
+        guard._executors['/mnt/a'].submit(lambda: None).result(1)
+        self.assertEqual(calls, [])
+        # _admit占用的名额没有对应的调用，只剩它
+        self.assertEqual(guard.health()[0]['in_flight'], 1)
+
+
+class GuardedStorageTest(unittest.TestCase):
+    def test_reads_after_open_are_guarded(self):
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'a.bin')
+            with open(path, 'wb') as f:
+                f.write(os.urandom(3 * 1024 * 1024))
+            guard = iohealth.IOGuard(max_per_root=2, timeout=1)
+            store = iohealth.GuardedStorage(storage.LocalStorage(), guard, lambda path: folder)
+            with open(path, 'rb') as f:
+                expected = integrity.hash_file(lambda path: f, path)
+            self.assertEqual(integrity.hash_file(store.open, path), expected)
+            # open一次，读取3MB的文件分多次读取，每次都经过IOGuard
+            self.assertGreaterEqual(guard.health()[0]['calls'], 4)
+
+    def test_hung_read_times_out(self):
+        release = threading.Event()
+        self.addCleanup(release.set)
+
+        class HangingStorage(storage.LocalStorage):
+            def open(self, path):
+                inner = super().open(path)
+
+                class Hanging(object):
+                    def read(self, size=-1):
+                        release.wait(5)
+                        return inner.read(size)
+
+                    def close(self):
+                        inner.close()
+                return Hanging()
+
+        with tempfile.TemporaryDirectory() as folder:
+            path = os.path.join(folder, 'a.bin')
+            with open(path, 'wb') as f:
+                f.write(b'data')
+            guard = iohealth.IOGuard(timeout=0.05)
+            store = iohealth.GuardedStorage(HangingStorage(), guard, lambda path: folder)
+            f = store.open(path)
+            with self.assertRaises(TimeoutError):
+                f.read(4)
+            with self.assertRaises(TimeoutError):
+                f.read(4)
+            f.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,170 @@
+import math
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import ratelimit
+
+
+class FakeClock(object):
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class LocalRedis(object):
+    """
+    代替Redis的本地客户端，只支持RedisStore用到的register_script：
+    按_REDIS_TAKE_SCRIPT的逻辑（HMGET、HSET、PEXPIRE）操作内存中的哈希表，键按PEXPIRE设置的时间过期
+    """
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.hashes = {}
+        self.expires = {}
+        self.calls = []
+
+    def register_script(self, script):
+        if script != ratelimit._REDIS_TAKE_SCRIPT:
+            raise ValueError('unknown script')
+        return self._take
+
+    def _take(self, keys, args):
+        self.calls.append((list(keys), list(args)))
+        key = keys[0]
+        rate, burst, cost, now = (float(value) for value in args)
+        if key in self.expires and self.clock() >= self.expires[key]:
+            del self.hashes[key]
+            del self.expires[key]
+        bucket = self.hashes.get(key, {})
+        tokens = bucket.get('tokens', burst)
+        updated = bucket.get('updated', now)
+        tokens, allowed, wait = ratelimit.take_tokens(tokens, updated, now, rate, burst, cost)
+        self.hashes[key] = {'tokens': tokens, 'updated': now}
+        self.expires[key] = self.clock() + (math.ceil(burst / rate * 1000) + 1000) / 1000.0
+        return [1 if allowed else 0, 0 if allowed else math.ceil(wait * 1000)]
+
+
+class TokenBucketTests(unittest.TestCase):
+    def check_store(self, store, clock):
+        # 容量为3，每秒补充2个
+        results = [store.take('api:ip:1', 2, 3)[0] for _ in range(4)]
+        self.assertEqual(results, [True, True, True, False])
+        allowed, wait = store.take('api:ip:1', 2, 3)
+        self.assertFalse(allowed)
+        self.assertAlmostEqual(wait, 0.5, places=2)
+        # 其他客户端使用自己的桶
+        self.assertTrue(store.take('api:ip:2', 2, 3)[0])
+        clock.now += 0.5
+        self.assertTrue(store.take('api:ip:1', 2, 3)[0])
+        self.assertFalse(store.take('api:ip:1', 2, 3)[0])
+        # 长时间空闲后最多补满到容量
+        clock.now += 100
+        self.assertEqual([store.take('api:ip:1', 2, 3)[0] for _ in range(4)], [True, True, True, False])
+
+    def test_memory_store(self):
+        clock = FakeClock()
+        self.check_store(ratelimit.MemoryStore(clock=clock), clock)
+
+    def test_memory_store_prunes_idle_buckets(self):
+        clock = FakeClock()
+        store = ratelimit.MemoryStore(idle_seconds=10, clock=clock)
+        store.take('a', 1, 5)
+        clock.now += 11
+        store.take('b', 1, 5)
+        self.assertEqual(len(store), 1)
+
+    def test_redis_store(self):
+        clock = FakeClock()
+        client = LocalRedis(clock)
+        store = ratelimit.RedisStore(client, prefix='test:', clock=clock)
+        self.check_store(store, clock)
+        self.assertEqual(client.calls[0], (['test:api:ip:1'], [2, 3, 1, 1000.0]))
+
+    def test_redis_bucket_expires(self):
+        clock = FakeClock()
+        client = LocalRedis(clock)
+        store = ratelimit.RedisStore(client, clock=clock)
+        store.take('k', 1, 2)
+        clock.now += 4
+        store.take('other', 1, 2)
+        self.assertNotIn('ratelimit:k', [key for key in client.hashes if clock() < client.expires[key]])
+
+
+class InFlightLimiterTests(unittest.TestCase):
+    def test_limit(self):
+        limiter = ratelimit.InFlightLimiter(100)
+        self.assertTrue(limiter.acquire(60))
+        self.assertFalse(limiter.acquire(50))
+        self.assertTrue(limiter.acquire(40))
+        limiter.release(60)
+        limiter.release(40)
+        # 单个超过上限的响应只在没有其他响应时允许
+        self.assertTrue(limiter.acquire(500))
+        self.assertFalse(limiter.acquire(1))
+
+
+class ClientIpTests(unittest.TestCase):
+    def test_without_proxy(self):
+        self.assertEqual(ratelimit.client_ip('10.0.0.1', '1.2.3.4', 0), '10.0.0.1')
+
+    def test_trusted_proxies(self):
+        self.assertEqual(ratelimit.client_ip('10.0.0.1', '1.2.3.4', 1), '1.2.3.4')
+        # 客户端自己伪造的部分在左边，不使用
+        self.assertEqual(ratelimit.client_ip('10.0.0.1', '6.6.6.6, 1.2.3.4', 1), '1.2.3.4')
+        self.assertEqual(ratelimit.client_ip('10.0.0.1', '6.6.6.6, 1.2.3.4, 10.0.0.2', 2), '1.2.3.4')
+
+    def test_missing_header(self):
+        self.assertEqual(ratelimit.client_ip('10.0.0.1', None, 1), '10.0.0.1')
+        self.assertEqual(ratelimit.client_ip('10.0.0.1', '1.2.3.4', 2), '10.0.0.1')
+
+
+class AppRateLimitTests(unittest.TestCase):
+    """经过负载均衡的匿名访问者按X-Forwarded-For分别限流"""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.cwd = os.getcwd()
+        cls.temp = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(cls.temp.name, 'run'))
+        os.chdir(os.path.join(cls.temp.name, 'run'))
+        import app
+        cls.app_module = app
+        cls.saved = {key: app.app.config[key] for key in ('RATE_LIMIT_ENABLED', 'RATE_LIMITS', 'RATE_LIMIT_STORE',
+                                                          'TRUSTED_PROXY_COUNT')}
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.app_module.app.config.update(cls.saved)
+        os.chdir(cls.cwd)
+        cls.temp.cleanup()
+
+    def test_clients_behind_proxy(self):
+        config = self.app_module.app.config
+        clock = FakeClock()
+        config.update({
+            'RATE_LIMIT_ENABLED': True,
+            'RATE_LIMITS': dict(config['RATE_LIMITS'], api=(1, 2)),
+            'RATE_LIMIT_STORE': ratelimit.RedisStore(LocalRedis(clock), clock=clock),
+            'TRUSTED_PROXY_COUNT': 1
+        })
+        client = self.app_module.app.test_client()
+
+        def status(forwarded_for):
+            return client.get('/api/no-such-endpoint', headers={'X-Forwarded-For': forwarded_for},
+                              environ_base={'REMOTE_ADDR': '10.0.0.1'}).status_code
+
+        self.assertEqual([status('1.1.1.1') for _ in range(3)], [404, 404, 429])
+        self.assertEqual(status('2.2.2.2'), 404)
+        # 没有信任的代理时所有访问者共用负载均衡的地址
+        config['TRUSTED_PROXY_COUNT'] = 0
+        self.assertEqual([status(address) for address in ('3.3.3.3', '4.4.4.4', '5.5.5.5')], [404, 404, 429])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import io
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import requests
+
+import storage
+from s3stub import S3Stub
+
+
+class S3StorageTest(unittest.TestCase):
+    """在本地的S3兼容服务（tests/s3stub.py）上验证签名、分块上传、ListObjectsV2分页和预签名地址"""
+
+    def setUp(self):
+        self.stub = S3Stub(max_keys=3)
+        self.stub.__enter__()
+        self.addCleanup(self.stub.__exit__, None, None, None)
+        self.storage = self.make_storage()
+
+    def make_storage(self, **kwargs):
+        options = dict(endpoint=self.stub.endpoint, bucket=self.stub.bucket, access_key=self.stub.access_key,
+                       secret_key=self.stub.secret_key, prefix='library', timeout=10)
+        options.update(kwargs)
+        return storage.S3Storage(**options)
+
+    def test_save_read_and_stat(self):
+        # 文件名中的空格、#、%和中文都要按签名规范编码
+        path = os.path.join('wallpapers', 'sea & sky', '海边 #1 100%.jpg')
+        self.storage.save(path, io.BytesIO(b'0123456789'))
+        self.assertIn('library/wallpapers/sea & sky/海边 #1 100%.jpg', self.stub.objects)
+        self.assertEqual(self.storage.read(path), b'0123456789')
+        self.assertEqual(self.storage.read_range(path, 2, 3), b'234')
+        with self.storage.open(path) as f:
+            self.assertEqual(f.read(), b'0123456789')
+        size, mtime = self.storage.stat(path)
+        self.assertEqual(size, 10)
+        self.assertGreater(mtime, 0)
+        self.assertTrue(self.storage.exists(path))
+        self.assertFalse(self.storage.exists(os.path.join('wallpapers', 'missing.jpg')))
+        with self.assertRaises(FileNotFoundError):
+            self.storage.read(os.path.join('wallpapers', 'missing.jpg'))
+
+    def test_open_range_uses_one_request(self):
+        self.storage.save('a/one.jpg', io.BytesIO(b'0123456789'))
+        del self.stub.requests[:]
+        reader, byte_range, size = self.storage.open_range('a/one.jpg')
+        with reader:
+            self.assertEqual(reader.read(), b'0123456789')
+        self.assertEqual((byte_range, size), (None, 10))
+        reader, byte_range, size = self.storage.open_range('a/one.jpg', 'bytes=2-4')
+        with reader:
+            self.assertEqual(reader.read(), b'234')
+        self.assertEqual((byte_range, size), ((2, 4), 10))
+        reader, byte_range, size = self.storage.open_range('a/one.jpg', 'bytes=-3')
+        with reader:
+            self.assertEqual(reader.read(), b'789')
+        self.assertEqual((byte_range, size), ((7, 9), 10))
+        self.assertEqual([method for method, _, _ in self.stub.requests], ['GET'] * 3)
+        with self.assertRaises(storage.RangeNotSatisfiable) as context:
+            self.storage.open_range('a/one.jpg', 'bytes=20-')
+        self.assertEqual(context.exception.size, 10)
+        with self.assertRaises(FileNotFoundError):
+            self.storage.open_range('a/missing.jpg')
+
+    def test_copy_move_and_delete(self):
+        self.storage.save('a/one.jpg', io.BytesIO(b'one'))
+        self.storage.save('a/two.jpg', io.BytesIO(b'two'))
+        with self.assertRaises(FileExistsError):
+            self.storage.copy('a/one.jpg', 'a/two.jpg', overwrite=False)
+        self.assertEqual(self.storage.read('a/two.jpg'), b'two')
+        self.storage.copy('a/one.jpg', 'b/one copy.jpg', overwrite=False)
+        self.assertEqual(self.storage.read('b/one copy.jpg'), b'one')
+        self.storage.move('a/two.jpg', 'b/two.jpg')
+        self.assertFalse(self.storage.exists('a/two.jpg'))
+        self.assertEqual(self.storage.read('b/two.jpg'), b'two')
+        self.storage.delete('b/two.jpg')
+        self.storage.delete('b/two.jpg')
+        self.assertFalse(self.storage.exists('b/two.jpg'))
+
+    def test_multipart_upload(self):
+        s3 = self.make_storage(multipart_threshold=1024 * 1024, part_size=5 * 1024 * 1024)
+        data = bytes(range(256)) * (11 * 1024 * 1024 // 256 + 7)
+        s3.save('big/photo.png', io.BytesIO(data))
+        self.assertEqual(self.stub.objects['library/big/photo.png'][0], data)
+        parts = [query for method, _, query in self.stub.requests if method == 'PUT' and 'partNumber' in query]
+        self.assertEqual([query['partNumber'] for query in parts], ['1', '2', '3'])
+        self.assertEqual(self.stub.uploads, {})
+
+    def test_failed_multipart_upload_is_aborted(self):
+        s3 = self.make_storage(multipart_threshold=1024 * 1024)
+
+        class Broken(io.BytesIO):
+            def read(self, size=-1):
+                if self.tell() >= 5 * 1024 * 1024:
+                    raise IOError('读取失败')
+                return super().read(size)
+
+        with self.assertRaises(IOError):
+            s3.save('big/broken.png', Broken(b'x' * (12 * 1024 * 1024)))
+        self.assertEqual(self.stub.uploads, {})
+        self.assertNotIn('library/big/broken.png', self.stub.objects)
+
+    def test_walk_follows_continuation_tokens(self):
+        names = [f"{index:02d}.jpg" for index in range(8)]
+        for name in names:
+            self.storage.save(os.path.join('cats', name), io.BytesIO(b'x'))
+        self.storage.save(os.path.join('cats', 'sub', 'kitten.jpg'), io.BytesIO(b'x'))
+        self.storage.save(os.path.join('dogs', 'a.jpg'), io.BytesIO(b'x'))
+        found = sorted(filename for _, filename in self.storage.walk('cats'))
+        self.assertEqual(found, sorted(names + ['kitten.jpg']))
+        pages = [query for method, path, query in self.stub.requests if query.get('list-type') == '2']
+        self.assertEqual(len(pages), 3)
+        self.assertNotIn('continuation-token', pages[0])
+        self.assertTrue(all('continuation-token' in query for query in pages[1:]))
+
+    def test_presigned_url(self):
+        path = os.path.join('wallpapers', '海边 #1.jpg')
+        self.storage.save(path, io.BytesIO(b'image-bytes'))
+        url = self.storage.presigned_url(path, 60)
+        response = requests.get(url, timeout=10)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content, b'image-bytes')
+        # 改动签名覆盖的任何部分都会被拒绝
+        tampered = url.replace('X-Amz-Expires=60', 'X-Amz-Expires=600')
+        self.assertEqual(requests.get(tampered, timeout=10).status_code, 403)
+
+    def test_wrong_secret_is_rejected(self):
+        s3 = self.make_storage(secret_key='wrong-secret')
+        with self.assertRaises(storage.StorageError) as context:
+            s3.save('a/one.jpg', io.BytesIO(b'one'))
+        self.assertIn('403', str(context.exception))
+        self.assertEqual(self.stub.objects, {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+import math
+import threading
+import time
+
+# 图片浏览次数的写回缓存
+# 每次浏览只在内存中累加，后台线程定期把累积的结果批量写入数据库，避免每次请求都争用SQLite的写锁。
+#
+# 热度分数按时间指数衰减：score = Σ exp(-(now - t_i) / tau)，t_i为每次浏览的时间。
+# 数据库中保存的是 log(Σ exp((t_i - EPOCH) / tau))，它与当前热度只差一个对所有图片都相同的常数，
+# 因此不需要定期重新计算所有图片的分数，按该列排序就是按当前热度排序，新的浏览用logaddexp累加即可。
+
+# 热度的半衰期（秒）和计算分数的起始时间
+HALF_LIFE = 3 * 24 * 3600
+TAU = HALF_LIFE / math.log(2)
+EPOCH = 1704067200  # 2024-01-01 00:00:00 UTC
+
+
+def view_weight(timestamp):
+    """一次浏览对应的对数权重"""
+    return (timestamp - EPOCH) / TAU
+
+
+def logaddexp(a, b):
+    """计算log(exp(a) + exp(b))，任一参数为None时返回另一个"""
+    if a is None:
+        return b
+    if b is None:
+        return a
+    if a < b:
+        a, b = b, a
+    return a + math.log1p(math.exp(b - a))
+
+
+def current_score(popularity, now=None):
+    """把数据库中保存的分数换算为当前时刻的衰减后热度"""
+    if popularity is None:
+        return 0.0
+    return math.exp(popularity - view_weight(now if now is not None else time.time()))
+
+
+class ViewCounter(object):
+    """
+    在内存中累计浏览次数，每隔interval秒调用flush(pending)写入数据库
+    pending为{图片ID: (浏览次数, 对数权重之和)}
+    """
+
+    def __init__(self, flush, interval=10.0):
+        self.flush = flush
+        self.interval = interval
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def record(self, image_id, timestamp=None):
+        weight = view_weight(timestamp if timestamp is not None else time.time())
+        with self._lock:
+            count, total = self._pending.get(image_id, (0, None))
+            self._pending[image_id] = (count + 1, logaddexp(total, weight))
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='view-counter', daemon=True)
+                self._thread.start()
+
+    def drain(self):
+        """取出并清空累积的浏览记录"""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        return pending
+
+    def flush_now(self):
+        """立即写入累积的浏览记录，写入失败时放回缓存，下次再试"""
+        pending = self.drain()
+        if not pending:
+            return 0
+        try:
+            self.flush(pending)
+        except Exception:
+            with self._lock:
+                for image_id, (count, total) in pending.items():
+                    current_count, current_total = self._pending.get(image_id, (0, None))
+                    self._pending[image_id] = (current_count + count, logaddexp(current_total, total))
+            raise
+        return len(pending)
+
+    def pending_count(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush_now()
+            except Exception as e:
+                print(f"写入浏览次数失败: {e}")
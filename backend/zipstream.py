@@ -0,0 +1,81 @@
+import io
+import os
+import time
+import zipfile
+
+# 流式生成ZIP文件
+# zipfile在不可seek的输出上会使用数据描述符（data descriptor），每写入一块数据就可以立即发送给客户端，
+# 不需要临时文件；单个文件超过4GB或条目过多时自动使用ZIP64扩展。
+
+# 已经压缩过的图片格式直接存储，不再重复压缩
+STORED_EXTENSIONS = {'jpg', 'jpeg', 'png', 'webp', 'gif'}
+
+CHUNK_SIZE = 1024 * 1024
+
+
+class _StreamBuffer(io.RawIOBase):
+    """只能写入、不能seek的缓冲区，每次drain取出已写入的数据"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def _zip_info(arcname, size, mtime):
+    date_time = time.localtime(mtime)[:6]
+    if date_time[0] < 1980:
+        date_time = (1980, 1, 1, 0, 0, 0)
+    info = zipfile.ZipInfo(arcname, date_time=date_time)
+    info.file_size = size
+    extension = os.path.splitext(arcname)[1].lower().lstrip('.')
+    info.compress_type = zipfile.ZIP_STORED if extension in STORED_EXTENSIONS else zipfile.ZIP_DEFLATED
+    return info
+
+
+def stream_zip(entries, chunk_size=CHUNK_SIZE, on_error=None, storage=None):
+    """
+    根据(arcname, filepath)序列逐块生成ZIP数据，storage为读取文件的存储后端（默认为本地磁盘）
+    无法读取的文件会被跳过，并调用on_error(filepath, exception)
+    """
+    buffer = _StreamBuffer()
+    archive = zipfile.ZipFile(buffer, mode='w', allowZip64=True)
+    for arcname, filepath in entries:
+        try:
+            if storage is None:
+                stat_result = os.stat(filepath)
+                size, mtime = stat_result.st_size, stat_result.st_mtime
+                source = open(filepath, 'rb')
+            else:
+                size, mtime = storage.stat(filepath)
+                source = storage.open(filepath)
+        except OSError as e:
+            if on_error:
+                on_error(filepath, e)
+            continue
+        with source:
+            info = _zip_info(arcname, size, mtime)
+            with archive.open(info, mode='w') as dest:
+                while True:
+                    data = source.read(chunk_size)
+                    if not data:
+                        break
+                    dest.write(data)
+                    output = buffer.drain()
+                    if output:
+                        yield output
+        output = buffer.drain()
+        if output:
+            yield output
+    archive.close()
+    yield buffer.drain()